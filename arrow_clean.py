@@ -0,0 +1,120 @@
+"""
+In-process cleaning backend: the rules from cleaning.py applied with Arrow
+compute kernels instead of compiled SQL.
+
+For one partition, `copy_clean` COPYs the raw staging rows out as CSV, parses
+them into an Arrow table, normalizes and filters it with `clean_table`, and
+COPYs the already-clean rows into the partition's build table. Postgres only
+streams rows in and out and evaluates no CASE or regex expressions. Parsing,
+the kernels and CSV writing release the GIL, so the partitions that
+partitions.rebuild cleans on its worker threads run in parallel.
+
+The output matches cleaning.select_sql row for row (tests/test_arrow_clean.py).
+For that, the current month is read from the database, exactly as the SQL
+filters see it, and NULL is kept apart from '' on the way in and out.
+"""
+import io, time
+from typing import Iterable, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pcsv
+
+import cleaning
+
+_NULL = pa.scalar(None, pa.string())
+
+
+def column_array(arr: pa.ChunkedArray, rule: cleaning.ColumnRule) -> pa.ChunkedArray:
+    """Vectorized cleaning.column_sql."""
+    if rule.transform == "keep":
+        return arr
+    if rule.transform == "nullif_empty":
+        return pc.if_else(pc.equal(arr, ""), _NULL, arr)
+    if rule.transform == "upper":
+        return pc.utf8_upper(arr)
+    if rule.transform == "domain":
+        keys, values = zip(*rule.values)
+        idx = pc.index_in(pc.utf8_upper(pc.fill_null(arr, "")), value_set=pa.array(keys, pa.string()))
+        out = pc.take(pa.array(values, pa.string()), idx)
+        return out if rule.default is None else pc.fill_null(out, rule.default)
+    if rule.transform == "allowed":
+        return pc.if_else(pc.is_in(arr, value_set=pa.array(rule.values, pa.string())), arr,
+                          pa.scalar(rule.default, pa.string()))
+    raise ValueError(f"unknown transform {rule.transform!r} for column {rule.name}")
+
+
+def filter_mask(arr: pa.ChunkedArray, f: cleaning.RowFilter, month: str) -> pa.ChunkedArray:
+    """Vectorized cleaning.filter_sql: True for the rows to keep."""
+    matches = pc.fill_null(pc.match_substring_regex(arr, f.pattern), False)
+    if f.kind == "match":
+        return pc.or_(pc.is_null(arr), matches)
+    if f.kind == "not_future":
+        return pc.invert(pc.and_(matches, pc.fill_null(pc.greater(arr, month), False)))
+    raise ValueError(f"unknown filter kind {f.kind!r} for column {f.column}")
+
+
+def clean_table(raw: pa.Table, present: Iterable[str], month: str,
+                rules: List[cleaning.ColumnRule] = cleaning.CLEAN_COLUMNS,
+                filters: List[cleaning.RowFilter] = cleaning.CLEAN_FILTERS, distinct: bool = True) -> pa.Table:
+    """
+    Clean rows of `raw` (string columns named as in staging); `month` is the
+    current YYYY-MM the not_future filter compares against.
+    """
+    present = set(present)
+    out = cleaning.output_columns(present, rules)
+    columns = {r.name: column_array(raw[r.name], r) if r.name in present
+               else pa.nulls(raw.num_rows, pa.string()) for r in out}
+    table = pa.table(columns)
+    masks = [filter_mask(table[f.column], f, month) for f in filters if f.column in columns]
+    if masks:
+        keep = masks[0]
+        for m in masks[1:]:
+            keep = pc.and_(keep, m)
+        table = table.filter(keep)
+    if distinct and table.num_rows:
+        table = table.group_by(list(columns), use_threads=False).aggregate([])
+    return table
+
+
+def read_rows(cur, source: str, columns: List[str], where: Optional[str] = None) -> pa.Table:
+    buf = io.BytesIO()
+    cur.copy_expert(f"COPY (SELECT {', '.join(columns)} FROM {source}{f' WHERE {where}' if where else ''}) "
+                    f"TO STDOUT WITH (FORMAT csv, HEADER true)", buf)
+    buf.seek(0)
+    # Postgres writes NULL unquoted and '' as "", so only unquoted empty fields are NULL
+    # (not Arrow's default null markers such as "N/A", a real value in several columns)
+    return pcsv.read_csv(buf, parse_options=pcsv.ParseOptions(newlines_in_values=True),
+                         convert_options=pcsv.ConvertOptions(column_types={c: pa.string() for c in columns},
+                                                             null_values=[""], strings_can_be_null=True,
+                                                             quoted_strings_can_be_null=False))
+
+
+def write_rows(cur, table: str, rows: pa.Table):
+    buf = io.BytesIO()
+    pcsv.write_csv(rows, buf, pcsv.WriteOptions(include_header=False))  # strings quoted, NULLs empty
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(rows.column_names)}) FROM STDIN WITH (FORMAT csv)", buf)
+
+
+def current_month(cur) -> str:
+    cur.execute("SELECT to_char(CURRENT_DATE, 'YYYY-MM');")
+    return cur.fetchone()[0]
+
+
+def copy_clean(cur, source: str, target: str, present: Iterable[str], where: Optional[str] = None,
+               distinct: bool = True, rules=cleaning.CLEAN_COLUMNS, filters=cleaning.CLEAN_FILTERS) -> dict:
+    """Clean the `source` rows matching `where` into the existing `target`; returns rows and timings."""
+    present = set(present)
+    needed = [r.name for r in cleaning.output_columns(present, rules) if r.name in present]
+    t0 = time.perf_counter()
+    month = current_month(cur)
+    raw = read_rows(cur, source, needed, where)
+    t1 = time.perf_counter()
+    clean = clean_table(raw, present, month, rules, filters, distinct)
+    t2 = time.perf_counter()
+    if clean.num_rows:
+        write_rows(cur, target, clean)
+    t3 = time.perf_counter()
+    return {"rows": clean.num_rows, "raw_rows": raw.num_rows, "read_sec": round(t1 - t0, 4),
+            "clean_sec": round(t2 - t1, 4), "write_sec": round(t3 - t2, 4)}
@@ -0,0 +1,115 @@
+"""
+Cold-start cost of the pipeline's entry points: interpreter start + imports.
+
+    python -m benchmarks.bench_import --out bench_import.json
+    python -m benchmarks.bench_import --baseline bench_import.json
+
+Each target runs in a fresh interpreter --repeat times (best time kept):
+
+  cli_help     : python orchestrator.py --help (no step runs)
+  orchestrator : import orchestrator
+  pipeline     : import pipeline (what every step imports first)
+  validation_api, bq_loader, pipelined : the other entry points / backends
+
+Besides the wall time, each result lists which heavy packages the import
+pulled in (pandas, pyarrow, SQLAlchemy, google-cloud-bigquery, requests) and
+the slowest modules by self time from `python -X importtime`, to show where a
+regression came from. Needs no Postgres, network or credentials.
+"""
+import argparse, json, os, platform, re, subprocess, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ["pandas", "pyarrow", "sqlalchemy", "google.cloud.bigquery", "requests"]
+TARGETS = {
+    "cli_help": ["orchestrator.py", "--help"],
+    "orchestrator": ["-c", "import orchestrator"],
+    "pipeline": ["-c", "import pipeline"],
+    "validation_api": ["-c", "import validation_api"],
+    "bq_loader": ["-c", "import bq_loader"],
+    "pipelined": ["-c", "import pipelined"],
+}
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def child_env():
+    # no .env or DATASET_ID/GCP_PROJECT_ID needed just to import
+    return {k: v for k, v in os.environ.items() if k not in ("DATASET_ID", "GCP_PROJECT_ID")}
+
+
+def wall_seconds(argv, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, *argv], cwd=ROOT, env=child_env(), check=True, capture_output=True)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def loaded_heavy(argv):
+    """The HEAVY packages in sys.modules once `argv` has run (imports only: --help exits first)."""
+    code = argv[1] if argv[0] == "-c" else "import orchestrator"
+    probe = f"{code}\nimport sys; print(','.join(m for m in {HEAVY!r} if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", probe], cwd=ROOT, env=child_env(), check=True,
+                         capture_output=True, text=True).stdout
+    return [m for m in out.strip().split(",") if m]
+
+
+def slowest_modules(argv, top):
+    """(module, self ms) of the `top` modules with the largest self import time."""
+    err = subprocess.run([sys.executable, "-X", "importtime", *argv], cwd=ROOT, env=child_env(), check=True,
+                         capture_output=True, text=True).stderr
+    rows = [(m.group(4), int(m.group(1)) / 1000) for m in map(_IMPORTTIME.match, err.splitlines()) if m]
+    return [(name, round(ms, 1)) for name, ms in sorted(rows, key=lambda r: -r[1])[:top]]
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {r["target"]: r for r in json.load(f)["results"]}
+    for r in results:
+        old = baseline.get(r["target"])
+        if not old:
+            print(f"{r['target']:>15}: not in baseline")
+            continue
+        print(f"{r['target']:>15}: {r['seconds'] / max(old['seconds'], 1e-9):.2f}x "
+              f"({old['seconds']:.3f}s -> {r['seconds']:.3f}s, <1 is faster)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--targets", default=",".join(TARGETS))
+    ap.add_argument("--repeat", type=int, default=5, help="runs per target; the fastest counts")
+    ap.add_argument("--top", type=int, default=5, help="slowest modules listed per target")
+    ap.add_argument("--out", default="bench_import.json")
+    ap.add_argument("--baseline", help="earlier --out file to compare against")
+    args = ap.parse_args()
+
+    results = []
+    for target in args.targets.split(","):
+        argv = TARGETS[target]
+        r = {"target": target, "seconds": round(wall_seconds(argv, args.repeat), 4),
+             "heavy_modules": loaded_heavy(argv), "slowest_modules": slowest_modules(argv, args.top)}
+        results.append(r)
+        print(f"{target:>15}: {r['seconds']:.3f}s  loads [{', '.join(r['heavy_modules'])}]  "
+              f"slowest: {', '.join(f'{n} {ms}ms' for n, ms in r['slowest_modules'][:3])}")
+
+    report = {
+        "benchmark": "import", "git_revision": git_revision(), "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(), "settings": {"repeat": args.repeat}, "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.out}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Peak Python heap (tracemalloc) per ingest path as CDC_PAGE_SIZE grows.
+
+    python -m benchmarks.bench_memory --rows 100000 --page-sizes 5000,25000,100000
+
+Serves synthetic rows from the local Socrata stub in a child process and feeds
+the staging writer a sink that drains the COPY payload instead of Postgres, so
+only the client-side cost is measured:
+
+  frame  : JSON page -> list of dicts -> DataFrame -> COPY text (the default path)
+  stream : CSV page parsed off the socket -> COPY, no DataFrame (INGEST_MODE=stream)
+"""
+import argparse, json, subprocess, sys, time, tracemalloc
+import pandas as pd
+import requests
+
+import socrata, staging
+
+PORT = 8765
+DATASET_ID = "bench-0001"
+
+
+class NullCopyWriter(staging.CopyWriter):
+    """CopyWriter whose COPY reads the payload the way psycopg2 does, then discards it."""
+
+    def __init__(self, columns):
+        self.table, self.columns, self._warned = "null", list(columns), set()
+
+    def copy_stream(self, f, commit=True):
+        while f.read(8192):
+            pass
+
+
+def run_frame(base_url, page_size):
+    sink = NullCopyWriter(staging.CDC_CASE_COLUMNS)
+    session = socrata.make_session()
+    for _, rows in socrata.iter_pages(base_url, DATASET_ID, page_size, session=session):
+        df = pd.DataFrame(rows)
+        df.columns = [staging.normalize_column(c) for c in df.columns]
+        sink.write_frame(df)
+        del df, rows
+    session.close()
+
+
+def run_stream(base_url, page_size):
+    sink = NullCopyWriter(staging.CDC_CASE_COLUMNS)
+    for _, header, rows in socrata.iter_csv_pages(base_url, DATASET_ID, page_size):
+        sink.write_rows(header, rows)
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn(*args)
+    secs = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, secs
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--page-sizes", default="5000,25000,100000")
+    args = ap.parse_args()
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "tests.socrata_stub", "--rows", str(args.rows),
+         "--port", str(PORT), "--dataset-id", DATASET_ID],
+        stdout=subprocess.PIPE,
+    )
+    base_url = f"http://127.0.0.1:{PORT}"
+    try:
+        server.stdout.readline()  # wait for "Serving ..."
+        requests.get(f"{base_url}/resource/{DATASET_ID}.json", params={"$limit": 1}, timeout=30).raise_for_status()
+        results = []
+        for page_size in [int(p) for p in args.page_sizes.split(",")]:
+            for mode, fn in [("frame", run_frame), ("stream", run_stream)]:
+                peak, secs = measure(fn, base_url, page_size)
+                results.append({"mode": mode, "page_size": page_size, "rows": args.rows,
+                                "peak_mib": round(peak / 2**20, 2), "seconds": round(secs, 3)})
+                print(f"{mode:>6} page_size={page_size:>7,}: peak {peak / 2**20:8.2f} MiB  ({secs:.2f}s)")
+    finally:
+        server.terminate()
+        server.wait()
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
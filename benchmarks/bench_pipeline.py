@@ -0,0 +1,155 @@
+"""
+End-to-end pipeline timings against the local Socrata stub, per dataset size.
+
+    python -m benchmarks.bench_pipeline --sizes 100000,1000000,10000000 --out bench_pipeline.json
+    python -m benchmarks.bench_pipeline --sizes 100000 --baseline bench_pipeline.json
+
+For each size a stub child process serves synthetic n8mc-b4w4-shaped rows
+(benchmarks.synth.SyntheticCases, --dirty of the sex/*_yn/res_state values
+messy) and the harness times, in order:
+
+  fetch     : pipeline.fetch_paginated, pages discarded
+  stage     : pipeline.stage_to_postgres (fetch + COPY + dedup + checkpoints)
+  transform : pipeline.simple_clean_transform(full=True)
+  validate  : validation_api.run_checks, the work behind /validate
+  export    : bq_loader.load_table into a LocalTarget (Parquet export + copy)
+
+Results go to --out as JSON (one object per size, plus the settings and git
+revision) so two runs can be diffed; --baseline prints the ratio per step
+against an earlier file. Needs Postgres (PG_* env vars); uses bench_pipe_*
+scratch tables and drops them afterwards.
+"""
+import argparse, json, os, platform, subprocess, sys, tempfile, time
+import requests
+from sqlalchemy import text
+
+os.environ.setdefault("DATASET_ID", "bench-0001")
+os.environ.setdefault("GCP_PROJECT_ID", "bench-project")
+import bq_loader, pipeline, validation_api
+
+PORT = 8766
+DATASET_ID = "bench-0001"
+RAW, CLEAN = "bench_pipe_raw", "bench_pipe_clean"
+STEPS = ["fetch", "stage", "transform", "validate", "export"]
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def serve(rows, seed, dirty):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "tests.socrata_stub", "--rows", str(rows), "--port", str(PORT),
+         "--dataset-id", DATASET_ID, "--seed", str(seed), "--dirty", str(dirty)],
+        stdout=subprocess.PIPE,
+    )
+    server.stdout.readline()  # wait for "Serving ..."
+    base_url = f"http://127.0.0.1:{PORT}"
+    requests.get(f"{base_url}/resource/{DATASET_ID}.json", params={"$limit": 1}, timeout=30).raise_for_status()
+    return server, base_url
+
+
+def cleanup(engine):
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {CLEAN}, {RAW}, {RAW}_dups CASCADE;"))
+        conn.execute(text("DELETE FROM pipeline_state WHERE dataset_id = :d"), {"d": DATASET_ID})
+        conn.execute(text("DELETE FROM ingest_checkpoints WHERE dataset_id = :d"), {"d": DATASET_ID})
+
+
+def timed(fn):
+    start = time.perf_counter()
+    rows, extra = fn()
+    secs = time.perf_counter() - start
+    return {"seconds": round(secs, 3), "rows": rows, "rows_per_sec": round(rows / max(secs, 1e-9)), **extra}
+
+
+def run_size(rows, args):
+    engine = pipeline.get_pg_engine()
+    server, base_url = serve(rows, args.seed, args.dirty)
+    pipeline.SETTINGS = pipeline.SETTINGS.replace(
+        cdc_base_url=base_url, dataset_id=DATASET_ID, page_size=args.page_size, fetch_workers=args.workers,
+        adaptive_fetch=not args.fixed_fetch, rate_limit=0, max_rows=0, ingest_mode=args.mode,
+        staging_table=RAW, clean_table=CLEAN)
+    result = {"rows": rows}
+    try:
+        cleanup(engine)
+        result["fetch"] = timed(lambda: (sum(len(df) for df in pipeline.fetch_paginated()), {}))
+        result["stage"] = timed(lambda: (pipeline.stage_to_postgres(), {}))
+
+        def transform():
+            stats = pipeline.simple_clean_transform(full=True)
+            return stats["rows"], {"partitions": stats["partitions"]}
+        result["transform"] = timed(transform)
+
+        def validate():
+            res = validation_api.run_checks(CLEAN)
+            return result["transform"]["rows"], {"overall_passed": res.overall_passed}
+        result["validate"] = timed(validate)
+
+        with tempfile.TemporaryDirectory(prefix="bench_export_") as tmp:
+            def export():
+                stats = bq_loader.load_table(engine, CLEAN, bq_loader.LocalTarget(tmp, "bench", "cases"),
+                                             workers=args.workers)
+                return stats["rows"], {"files": stats["files"], "bytes": stats["upload_bytes"]}
+            result["export"] = timed(export)
+    finally:
+        server.terminate()
+        server.wait()
+        cleanup(engine)
+    return result
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {r["rows"]: r for r in json.load(f)["results"]}
+    for r in results:
+        old = baseline.get(r["rows"])
+        if not old:
+            print(f"{r['rows']:>11,}: not in baseline")
+            continue
+        ratios = [f"{step}={r[step]['seconds'] / max(old[step]['seconds'], 1e-9):.2f}x"
+                  for step in STEPS if step in r and step in old]
+        print(f"{r['rows']:>11,}: " + "  ".join(ratios) + "  (time vs baseline, <1 is faster)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--sizes", default="100000,1000000,10000000")
+    ap.add_argument("--page-size", type=int, default=pipeline.SETTINGS.page_size)
+    ap.add_argument("--workers", type=int, default=4, help="fetch workers and export load jobs")
+    ap.add_argument("--fixed-fetch", action="store_true",
+                    help="keep --page-size/--workers instead of tuning them (CDC_ADAPTIVE_FETCH=0)")
+    ap.add_argument("--mode", choices=["frame", "stream"], default="frame")
+    ap.add_argument("--dirty", type=float, default=0.05)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="bench_pipeline.json")
+    ap.add_argument("--baseline", help="earlier --out file to compare against")
+    args = ap.parse_args()
+
+    results = []
+    for rows in [int(s) for s in args.sizes.split(",")]:
+        print(f"=== {rows:,} rows ===")
+        results.append(run_size(rows, args))
+        for step in STEPS:
+            r = results[-1][step]
+            print(f"{step:>9}: {r['seconds']:8.2f}s ({r['rows_per_sec']:,} rows/sec)")
+
+    report = {
+        "benchmark": "pipeline", "git_revision": git_revision(), "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "settings": {k: getattr(args, k) for k in ("page_size", "workers", "fixed_fetch", "mode", "dirty", "seed")},
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.out}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Compare staging throughput: DataFrame.to_sql (old path) vs COPY FROM STDIN.
+
+    python -m benchmarks.bench_staging --rows 200000 --page-size 50000
+
+Needs a reachable Postgres (PG_* env vars, same as pipeline.py). Writes to
+scratch tables bench_stg_to_sql / bench_stg_copy and drops them afterwards.
+"""
+import argparse, json, os, time
+import pandas as pd
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+
+import staging
+from benchmarks.synth import make_case_rows
+
+load_dotenv()
+
+
+def pg_engine():
+    return create_engine(
+        f"postgresql+psycopg2://{os.getenv('PG_USER', 'ph')}:{os.getenv('PG_PASSWORD', 'ph')}"
+        f"@{os.getenv('PG_HOST', 'localhost')}:{os.getenv('PG_PORT', '5433')}/{os.getenv('PG_DB', 'public_health')}",
+        pool_pre_ping=True,
+    )
+
+
+def pages(rows, page_size):
+    data = list(make_case_rows(rows))
+    return [pd.DataFrame(data[i:i + page_size]) for i in range(0, rows, page_size)]
+
+
+def bench_to_sql(engine, frames, table="bench_stg_to_sql"):
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {table};"))
+    start = time.perf_counter()
+    for df in frames:
+        # old path: new engine + row-wise INSERTs per page
+        df.to_sql(table, pg_engine(), if_exists="append", index=False)
+    return time.perf_counter() - start
+
+
+def bench_copy(engine, frames, table="bench_stg_copy"):
+    writer = staging.CopyWriter(engine, table, staging.CDC_CASE_COLUMNS)
+    start = time.perf_counter()
+    try:
+        writer.create_table(drop=True)
+        for df in frames:
+            writer.write_frame(df)
+    finally:
+        writer.close()
+    return time.perf_counter() - start
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--rows", type=int, default=200_000)
+    ap.add_argument("--page-size", type=int, default=50_000)
+    args = ap.parse_args()
+
+    engine = pg_engine()
+    frames = pages(args.rows, args.page_size)
+    results = {}
+    for name, fn in [("to_sql", bench_to_sql), ("copy", bench_copy)]:
+        secs = fn(engine, frames)
+        results[name] = {"seconds": round(secs, 3), "rows_per_sec": round(args.rows / secs)}
+        print(f"{name:>7}: {args.rows:,} rows in {secs:.2f}s ({args.rows / secs:,.0f} rows/sec)")
+    print(f"speedup: {results['to_sql']['seconds'] / results['copy']['seconds']:.1f}x")
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS bench_stg_to_sql; DROP TABLE IF EXISTS bench_stg_copy;"))
+    print(json.dumps({"rows": args.rows, "page_size": args.page_size, **results}))
+
+
+if __name__ == "__main__":
+    main()
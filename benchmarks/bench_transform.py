@@ -0,0 +1,134 @@
+"""
+Before/after timing of the staging -> clean transform on synthetic data.
+
+    python -m benchmarks.bench_transform --rows 10000000
+
+"legacy" replays the original statement sequence (CTAS, DELETE, five UPDATEs,
+DELETE, SELECT DISTINCT copy); "single_pass" runs cleaning.compile_clean_sql;
+"partitioned" is partitions.rebuild with --workers connections (staging indexed
+on case_month first, as the pipeline does), "arrow" is the same rebuild with
+the in-process backend (arrow_clean.py), and "one_month" rebuilds a single
+partition the way an incremental run would. All read the same generated
+staging table; the legacy and single-pass outputs are compared, and so are
+the SQL and Arrow partitioned ones.
+Needs Postgres (PG_* env vars); uses bench_* scratch tables.
+"""
+import argparse, json, time
+from sqlalchemy import text
+
+import cleaning, partitions, staging
+from benchmarks.bench_staging import pg_engine
+
+SRC = "bench_stg_raw"
+
+# generate_series-based generator with the dirty values the rules exist for
+SYNTH_SQL = f"""
+CREATE UNLOGGED TABLE {SRC} AS
+SELECT
+    (ARRAY['2020-01','2020-06','2021-03','2021-11','2022-07','2099-01','', NULL])[1 + (g % 8)] AS case_month,
+    (ARRAY['NY','ca','TX','fl','WA','XX1', NULL])[1 + (g % 7)] AS res_state,
+    NULL::text AS state_fips_code, 'COUNTY ' || (g % 50) AS res_county, NULL::text AS county_fips_code,
+    (ARRAY['0 - 17 years','18 to 49 years','50 to 64 years','65+ years'])[1 + (g % 4)] AS age_group,
+    (ARRAY['Male','female','UNKNOWN','Missing','Other', NULL])[1 + (g % 6)] AS sex,
+    (ARRAY['White','Black','Asian','Unknown'])[1 + (g % 4)] AS race,
+    (ARRAY['Hispanic/Latino','Non-Hispanic/Latino','Unknown'])[1 + (g % 3)] AS ethnicity,
+    NULL::text AS case_positive_specimen_interval, NULL::text AS case_onset_interval,
+    'Missing'::text AS process, 'Missing'::text AS exposure_yn,
+    (ARRAY['Confirmed Case','Probable Case','Laboratory-confirmed case'])[1 + (g % 3)] AS current_status,
+    NULL::text AS symptom_status,
+    (ARRAY['Yes','no','Unknown','Missing','', NULL])[1 + (g % 6)] AS hosp_yn,
+    (ARRAY['Yes','No','unknown', NULL])[1 + (g % 4)] AS icu_yn,
+    (ARRAY['YES','No','Missing'])[1 + (g % 3)] AS death_yn,
+    NULL::text AS underlying_conditions_yn
+FROM generate_series(1, :rows) AS g;
+"""
+
+
+def legacy_statements(src, dst, cols):
+    keep = [c for c in ['age_group', 'sex', 'current_status', 'hosp_yn', 'icu_yn', 'death_yn', 'race', 'ethnicity',
+                        'res_county', 'county_fips_code', 'state_fips_code', 'case_positive_specimen', 'process',
+                        'exposure_yn'] if c in cols]
+    yield f"""
+        CREATE TABLE {dst} AS SELECT
+            CASE WHEN EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = '{src}' AND column_name='case_month')
+                 THEN NULLIF(case_month, '') ELSE NULL END AS case_month,
+            CASE WHEN EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = '{src}' AND column_name='res_state')
+                 THEN UPPER(res_state) ELSE NULL END AS res_state,
+            {", ".join(keep)}
+        FROM {src}"""
+    yield f"""DELETE FROM {dst} WHERE case_month IS NOT NULL AND case_month ~ '^[0-9]{{4}}-[0-1][0-9]$'
+              AND case_month > to_char(CURRENT_DATE, 'YYYY-MM')"""
+    yield f"""UPDATE {dst} SET sex = CASE UPPER(COALESCE(sex,'')) WHEN 'MALE' THEN 'Male' WHEN 'FEMALE' THEN 'Female'
+              WHEN 'UNKNOWN' THEN 'Unknown' WHEN 'MISSING' THEN 'Missing' ELSE 'Unknown' END"""
+    yield f"""UPDATE {dst} SET current_status = CASE WHEN current_status IN ('Confirmed Case','Probable Case')
+              THEN current_status ELSE 'Probable Case' END"""
+    for col in ['hosp_yn', 'icu_yn', 'death_yn']:
+        yield f"""UPDATE {dst} SET {col} = CASE UPPER(COALESCE({col}, '')) WHEN 'YES' THEN 'Yes' WHEN 'NO' THEN 'No'
+                  WHEN 'UNKNOWN' THEN 'Unknown' WHEN 'MISSING' THEN 'Missing' ELSE 'Unknown' END"""
+    yield f"DELETE FROM {dst} WHERE res_state IS NOT NULL AND res_state !~ '^[A-Z]{{2}}$'"
+    yield f"CREATE TABLE {dst}_tmp AS SELECT DISTINCT * FROM {dst}"
+    yield f"DROP TABLE {dst}"
+    yield f"ALTER TABLE {dst}_tmp RENAME TO {dst}"
+
+
+def timed(engine, statements):
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        for sql in statements:
+            conn.execute(text(sql))
+    return time.perf_counter() - start
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--rows", type=int, default=10_000_000)
+    ap.add_argument("--workers", type=int, default=partitions.CLEAN_WORKERS)
+    args = ap.parse_args()
+
+    engine = pg_engine()
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {SRC}, bench_clean_legacy, bench_clean_single, bench_clean_part, bench_clean_arrow;"))
+        print(f"Generating {args.rows:,} synthetic staging rows …")
+        conn.execute(text(SYNTH_SQL), {"rows": args.rows})
+        conn.execute(text(f"ANALYZE {SRC};"))
+
+    cols = staging.CDC_CASE_COLUMNS
+    results = {
+        "legacy": timed(engine, legacy_statements(SRC, "bench_clean_legacy", cols)),
+        "single_pass": timed(engine, [cleaning.compile_clean_sql(SRC, "bench_clean_single", cols)]),
+        "index_stg": timed(engine, [f"CREATE INDEX ON {SRC} (case_month)"]),
+    }
+    start = time.perf_counter()
+    partitions.rebuild(engine, SRC, "bench_clean_part", cols, workers=args.workers)
+    results["partitioned"] = time.perf_counter() - start
+    start = time.perf_counter()
+    partitions.rebuild(engine, SRC, "bench_clean_arrow", cols, workers=args.workers, backend="arrow")
+    results["arrow"] = time.perf_counter() - start
+    start = time.perf_counter()
+    partitions.rebuild(engine, SRC, "bench_clean_part", cols, keys=["2021-03"], workers=args.workers)
+    results["one_month"] = time.perf_counter() - start
+    with engine.begin() as conn:
+        diff = conn.execute(text(
+            "SELECT (SELECT COUNT(*) FROM (SELECT * FROM bench_clean_legacy EXCEPT ALL SELECT * FROM bench_clean_single) a)"
+            " + (SELECT COUNT(*) FROM (SELECT * FROM bench_clean_single EXCEPT ALL SELECT * FROM bench_clean_legacy) b)"
+        )).scalar()
+        arrow_diff = conn.execute(text(
+            "SELECT (SELECT COUNT(*) FROM (SELECT * FROM bench_clean_part EXCEPT ALL SELECT * FROM bench_clean_arrow) a)"
+            " + (SELECT COUNT(*) FROM (SELECT * FROM bench_clean_arrow EXCEPT ALL SELECT * FROM bench_clean_part) b)"
+        )).scalar()
+        out_rows = conn.execute(text("SELECT COUNT(*) FROM bench_clean_single")).scalar()
+        part_rows = conn.execute(text("SELECT COUNT(*) FROM bench_clean_part")).scalar()
+        conn.execute(text(f"DROP TABLE IF EXISTS {SRC}, bench_clean_legacy, bench_clean_single, bench_clean_part, bench_clean_arrow;"))
+
+    for name, secs in results.items():
+        print(f"{name:>11}: {secs:8.2f}s ({args.rows / secs:,.0f} rows/sec)")
+    print(f"speedup: {results['legacy'] / results['single_pass']:.1f}x; output rows={out_rows:,}; mismatched rows={diff}; "
+          f"partitioned rows={part_rows:,}")
+    print(f"arrow vs sql partitioned: {results['partitioned'] / results['arrow']:.2f}x; mismatched rows={arrow_diff}")
+    print(json.dumps({"rows": args.rows, "clean_rows": out_rows, "mismatched_rows": diff, "partitioned_rows": part_rows,
+                      "arrow_mismatched_rows": arrow_diff,
+                      **{k: round(v, 3) for k, v in results.items()}}))
+
+
+if __name__ == "__main__":
+    main()
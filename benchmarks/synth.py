@@ -0,0 +1,107 @@
+"""Synthetic rows shaped like the CDC case-surveillance dataset (n8mc-b4w4)."""
+import random
+from functools import lru_cache
+from staging import CDC_CASE_COLUMNS
+
+STATES = ["AL", "AK", "AZ", "CA", "CO", "FL", "GA", "IL", "NY", "OH", "PA", "TX", "WA"]
+AGE_GROUPS = ["0 - 17 years", "18 to 49 years", "50 to 64 years", "65+ years", "Missing"]
+RACES = ["White", "Black", "Asian", "American Indian/Alaska Native", "Multiple/Other", "Unknown", "Missing"]
+ETHNICITIES = ["Hispanic/Latino", "Non-Hispanic/Latino", "Unknown", "Missing"]
+SEXES = ["Male", "Female", "Unknown", "Missing"]
+STATUSES = ["Laboratory-confirmed case", "Probable Case"]
+YN = ["Yes", "No", "Unknown", "Missing"]
+MONTHS = [f"{y}-{m:02d}" for y in (2020, 2021, 2022) for m in range(1, 13)]
+
+
+# raw spellings the cleaning rules normalize or reject, for dirty=... rows
+DIRTY_SEXES = ["male", "FEMALE", "MALE", "unknown", "M", ""]
+DIRTY_YN = ["yes", "NO", "Y", "unknown", "", "N/A"]
+DIRTY_STATES = ["ny", "Ca", "tx ", "XX1", "", "N.Y."]
+YN_COLUMNS = ["exposure_yn", "hosp_yn", "icu_yn", "death_yn", "underlying_conditions_yn"]
+
+
+def case_row(rnd: random.Random, dirty: float = 0.0) -> dict:
+    """One row (all string values, like the Socrata JSON API) drawn from `rnd`."""
+    state = rnd.choice(STATES)
+    row = {
+        "case_month": rnd.choice(MONTHS),
+        "res_state": state,
+        "state_fips_code": f"{STATES.index(state) + 1:02d}",
+        "res_county": f"COUNTY {rnd.randint(1, 60)}",
+        "county_fips_code": f"{rnd.randint(1000, 56999):05d}",
+        "age_group": rnd.choice(AGE_GROUPS),
+        "sex": rnd.choice(SEXES),
+        "race": rnd.choice(RACES),
+        "ethnicity": rnd.choice(ETHNICITIES),
+        "case_positive_specimen_interval": str(rnd.randint(0, 5)),
+        "case_onset_interval": str(rnd.randint(0, 5)),
+        "process": "Missing",
+        "exposure_yn": rnd.choice(YN),
+        "current_status": rnd.choice(STATUSES),
+        "symptom_status": rnd.choice(["Symptomatic", "Asymptomatic", "Unknown", "Missing"]),
+        "hosp_yn": rnd.choice(YN),
+        "icu_yn": rnd.choice(YN),
+        "death_yn": rnd.choice(YN),
+        "underlying_conditions_yn": rnd.choice(YN),
+    }
+    if dirty:
+        if rnd.random() < dirty:
+            row["sex"] = rnd.choice(DIRTY_SEXES)
+        if rnd.random() < dirty:
+            row["res_state"] = rnd.choice(DIRTY_STATES)
+        for col in YN_COLUMNS:
+            if rnd.random() < dirty:
+                row[col] = rnd.choice(DIRTY_YN)
+        if rnd.random() < dirty:
+            del row[rnd.choice(YN_COLUMNS)]  # Socrata leaves nulls out of JSON rows
+    return row
+
+
+def make_case_rows(n: int, seed: int = 0, dirty: float = 0.0):
+    """Yield `n` rows; `dirty` is the per-field chance of a messy raw spelling."""
+    rnd = random.Random(seed)
+    for _ in range(n):
+        yield case_row(rnd, dirty)
+
+
+class SyntheticCases:
+    """
+    Read-only sequence of `n` rows with Socrata system fields, generated on
+    access in blocks of BLOCK rows seeded by (seed, block number): any page
+    of a 10M-row dataset can be served without holding the dataset in memory,
+    and row i is the same whatever page size it is read with.
+    """
+
+    BLOCK = 1024
+    columns = [":id", ":updated_at"] + list(CDC_CASE_COLUMNS)
+
+    def __init__(self, n: int, seed: int = 0, dirty: float = 0.0):
+        self.n, self.seed, self.dirty = n, seed, dirty
+        self._block = lru_cache(maxsize=64)(self._make_block)
+
+    def __len__(self):
+        return self.n
+
+    def _make_block(self, b: int):
+        rnd = random.Random(self.seed * 1_000_000_007 + b)
+        first = b * self.BLOCK
+        return [{":id": f"row-{i:09d}", ":updated_at": "2024-01-01T00:00:00.000Z", **case_row(rnd, self.dirty)}
+                for i in range(first, min(first + self.BLOCK, self.n))]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.n)
+            if step != 1:
+                return [self[j] for j in range(start, stop, step)]
+            out = []
+            for b in range(start // self.BLOCK, (stop - 1) // self.BLOCK + 1 if stop > start else 0):
+                block, base = self._block(b), b * self.BLOCK
+                out += block[max(start - base, 0):stop - base]
+            return out
+        if not -self.n <= i < self.n:
+            raise IndexError(i)
+        i %= self.n
+        return self._block(i // self.BLOCK)[i % self.BLOCK]
+
+
+assert set(CDC_CASE_COLUMNS) == set(next(make_case_rows(1)))
@@ -0,0 +1,266 @@
+"""
+Export the clean table to Parquet files and load them into BigQuery.
+
+The table is read once through a server-side cursor and written as Parquet
+files of up to `rows_per_file` rows; enum columns (encoding.py) are kept as
+dictionary arrays, so they are written dictionary-encoded. The first file is loaded with
+WRITE_TRUNCATE and the rest are appended by a bounded pool of parallel load
+jobs. BigQuery is only touched through a small target interface
+(`BigQueryTarget`); `LocalTarget` is a filesystem stand-in for tests and dry runs.
+
+`sync_table` loads only what changed since the last sync of a partitioned
+clean table. The partition oids of the last sync are kept in pipeline_state,
+and a partition whose oid has changed since was rebuilt (partitions.attached_oids).
+Only those partitions are exported and loaded into a staging table, and one MERGE
+swaps their rows into the target. The first sync, a changed column list, or a
+missing target falls back to the full load.
+"""
+import json, os, shutil, tempfile, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import encoding, partitions, state
+
+SYNC_STATE_KEY = "bq_sync:{}"  # per target table: columns and partition oids of the last sync
+
+
+def merge_sql(table_id: str, staging_id: str, column: str) -> str:
+    """
+    Replace the rows of `table_id` whose `column` is in @keys (or NULL, with
+    @null_key) by all rows of `staging_id`, in one atomic statement.
+    """
+    # ON FALSE: no staged row matches a target row, so every staged row is
+    # inserted and every target row of a replaced key is deleted
+    return (f"MERGE `{table_id}` T USING `{staging_id}` S ON FALSE\n"
+            f"WHEN NOT MATCHED BY TARGET THEN INSERT ROW\n"
+            f"WHEN NOT MATCHED BY SOURCE AND (T.{column} IN UNNEST(@keys) OR (@null_key AND T.{column} IS NULL))"
+            f" THEN DELETE")
+
+
+def _load_files(load: Callable[[str, bool], int], files: List[str], workers: int) -> int:
+    """`load` the first file truncating, the rest appended by parallel jobs; returns the bytes uploaded."""
+    uploaded = load(files[0], True)
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="bq-load") as pool:
+        uploaded += sum(pool.map(lambda f: load(f, False), files[1:]))
+    return uploaded
+
+
+class BigQueryTarget:
+    def __init__(self, project: str, dataset: str, table: str, client=None):
+        from google.cloud import bigquery  # heavy import, only needed for real loads
+        self._bq = bigquery
+        self.client = client or bigquery.Client(project=project)
+        self.dataset_id = f"{project}.{dataset}"
+        self.table_id = f"{project}.{dataset}.{table}"
+        self.staging_id = f"{self.table_id}__sync"
+
+    def ensure_dataset(self):
+        try:
+            self.client.get_dataset(self.dataset_id)
+        except Exception:
+            self.client.create_dataset(self._bq.Dataset(self.dataset_id))
+
+    def exists(self) -> bool:
+        from google.api_core.exceptions import NotFound
+        try:
+            self.client.get_table(self.table_id)
+            return True
+        except NotFound:
+            return False
+
+    def load_parquet(self, path: str, truncate: bool, table_id: Optional[str] = None) -> int:
+        bq = self._bq
+        job_config = bq.LoadJobConfig(
+            source_format=bq.SourceFormat.PARQUET,
+            write_disposition=bq.WriteDisposition.WRITE_TRUNCATE if truncate else bq.WriteDisposition.WRITE_APPEND,
+        )
+        with open(path, "rb") as f:
+            self.client.load_table_from_file(f, table_id or self.table_id, job_config=job_config).result()
+        return os.path.getsize(path)
+
+    def replace_partitions(self, column: str, keys: List[Optional[str]], files: List[str], workers: int = 4) -> int:
+        """Load `files` into the staging table and MERGE them in place of the target's rows for `keys`."""
+        bq = self._bq
+        uploaded = _load_files(lambda f, truncate: self.load_parquet(f, truncate, self.staging_id), files, workers)
+        job_config = bq.QueryJobConfig(query_parameters=[
+            bq.ArrayQueryParameter("keys", "STRING", [k for k in keys if k is not None]),
+            bq.ScalarQueryParameter("null_key", "BOOL", None in keys),
+        ])
+        self.client.query(merge_sql(self.table_id, self.staging_id, column), job_config=job_config).result()
+        self.client.delete_table(self.staging_id, not_found_ok=True)
+        return uploaded
+
+
+class LocalTarget:
+    """Filesystem stand-in: a "table" is a directory of Parquet files."""
+
+    def __init__(self, root: str, dataset: str, table: str):
+        self.table_id = f"{dataset}.{table}"
+        self.path = os.path.join(root, dataset, table)
+
+    def ensure_dataset(self):
+        os.makedirs(self.path, exist_ok=True)
+
+    def exists(self) -> bool:
+        return os.path.isdir(self.path) and bool(os.listdir(self.path))
+
+    def load_parquet(self, path: str, truncate: bool) -> int:
+        if truncate:
+            shutil.rmtree(self.path, ignore_errors=True)
+            os.makedirs(self.path)
+        shutil.copy(path, os.path.join(self.path, os.path.basename(path)))
+        return os.path.getsize(path)
+
+    def replace_partitions(self, column: str, keys: List[Optional[str]], files: List[str], workers: int = 4) -> int:
+        current = self.read()
+        kept = current.filter(pc.invert(pc.is_in(current[column], value_set=pa.array(keys, pa.string()))))
+        shutil.rmtree(self.path)
+        os.makedirs(self.path)
+        pq.write_table(kept, os.path.join(self.path, "kept.parquet"))
+        return sum(self.load_parquet(f, truncate=False) for f in files)
+
+    def read(self) -> pa.Table:
+        return pq.read_table(self.path)
+
+
+def _to_arrow(columns: Sequence[str], rows: List[tuple], dictionary: Sequence[str] = ()) -> pa.Table:
+    arrays = [pa.array(list(col), type=pa.string()) for col in zip(*rows)] if rows \
+        else [pa.array([], type=pa.string()) for _ in columns]
+    arrays = [a.dictionary_encode() if c in dictionary else a for c, a in zip(columns, arrays)]
+    return pa.Table.from_arrays(arrays, names=list(columns))
+
+
+def write_parquet_files(columns: Sequence[str], batches: Iterable[List[tuple]], out_dir: str,
+                        rows_per_file: int = 1_000_000, prefix: str = "part",
+                        dictionary: Sequence[str] = ()) -> List[str]:
+    """
+    Write row batches as Parquet files of at most ~`rows_per_file` rows (always
+    at least one file); `dictionary` columns are held as Arrow dictionary arrays.
+    """
+    files, writer, in_file = [], None, 0
+    try:
+        for rows in batches:
+            if not rows:
+                continue
+            table = _to_arrow(columns, rows, dictionary)
+            if writer is None or in_file >= rows_per_file:
+                if writer:
+                    writer.close()
+                files.append(os.path.join(out_dir, f"{prefix}-{len(files):05d}.parquet"))
+                writer, in_file = pq.ParquetWriter(files[-1], table.schema, compression="snappy"), 0
+            writer.write_table(table)
+            in_file += len(rows)
+        if writer is None:  # empty table: still produce a file so the target gets truncated
+            files.append(os.path.join(out_dir, f"{prefix}-00000.parquet"))
+            pq.write_table(_to_arrow(columns, [], dictionary), files[-1])
+    finally:
+        if writer:
+            writer.close()
+    return files
+
+
+def export_parquet(engine, table: str, out_dir: str, batch_rows: int = 100_000,
+                   rows_per_file: int = 1_000_000, where: Optional[str] = None) -> List[str]:
+    """Stream `table` (its rows matching `where`) through a server-side cursor into Parquet files under `out_dir`."""
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            dictionary = encoding.enum_columns(cur, table)
+        with conn.cursor(name=f"export_{table}") as cur:  # named cursor => server-side
+            cur.itersize = batch_rows
+            cur.execute(f"SELECT * FROM {table}{f' WHERE {where}' if where else ''};")
+            first = cur.fetchmany(batch_rows)
+            columns = [d[0] for d in cur.description]
+
+            def batches():
+                rows = first
+                while rows:
+                    yield rows
+                    rows = cur.fetchmany(batch_rows)
+
+            return write_parquet_files(columns, batches(), out_dir, rows_per_file, dictionary=dictionary)
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def _export(engine, table: str, out_dir: str, batch_rows: int, rows_per_file: int,
+            where: Optional[str] = None):
+    start = time.perf_counter()
+    files = export_parquet(engine, table, out_dir, batch_rows=batch_rows, rows_per_file=rows_per_file, where=where)
+    export_sec = time.perf_counter() - start
+    rows = sum(pq.ParquetFile(f).metadata.num_rows for f in files)
+    export_bytes = sum(os.path.getsize(f) for f in files)
+    print(f"Exported {rows:,} rows to {len(files)} Parquet file(s), {export_bytes / 2**20:.1f} MiB "
+          f"in {export_sec:.1f}s ({rows / max(export_sec, 1e-9):,.0f} rows/s)")
+    return files, {"rows": rows, "files": len(files), "export_sec": round(export_sec, 3),
+                   "export_rows_per_sec": round(rows / max(export_sec, 1e-9))}
+
+
+def _upload_stats(uploaded: int, upload_sec: float) -> dict:
+    return {"upload_bytes": uploaded, "upload_sec": round(upload_sec, 3),
+            "upload_mib_per_sec": round(uploaded / 2**20 / max(upload_sec, 1e-9), 2)}
+
+
+def load_table(engine, table: str, target, workers: int = 4, rows_per_file: int = 1_000_000,
+               batch_rows: int = 100_000) -> dict:
+    """Export `table` and load it into `target`; returns export/upload throughput stats."""
+    with tempfile.TemporaryDirectory(prefix="bq_export_") as tmp:
+        files, stats = _export(engine, table, tmp, batch_rows, rows_per_file)
+
+        start = time.perf_counter()
+        target.ensure_dataset()
+        uploaded = _load_files(target.load_parquet, files, workers)
+        upload_sec = time.perf_counter() - start
+        print(f"Uploaded {uploaded / 2**20:.1f} MiB to {target.table_id} in {upload_sec:.1f}s "
+              f"({uploaded / 2**20 / max(upload_sec, 1e-9):.1f} MiB/s, {workers} parallel load jobs)")
+
+    return {**stats, **_upload_stats(uploaded, upload_sec)}
+
+
+def sync_table(engine, table: str, target, dataset_id: str, workers: int = 4, rows_per_file: int = 1_000_000,
+               batch_rows: int = 100_000) -> dict:
+    """
+    Bring `target` up to date with `table`, uploading only the partitions
+    rebuilt since the last sync (see the module docstring); returns load_table's
+    stats plus `mode` ("full" | "merge" | "unchanged") and the partitions replaced.
+    """
+    key = SYNC_STATE_KEY.format(target.table_id)
+    with engine.begin() as conn:
+        cur = conn.connection.cursor()
+        oids = partitions.attached_oids(cur, table)
+        columns = partitions.table_columns(cur, table)
+        last = state.get_state(cur, dataset_id, key)
+    last = json.loads(last) if last else None
+
+    if oids is None or last is None or last["columns"] != columns or not target.exists():
+        stats = {**load_table(engine, table, target, workers, rows_per_file, batch_rows),
+                 "mode": "full", "partitions": len(oids or {})}
+    else:
+        synced = {k: oid for k, oid in last["partitions"]}
+        changed = [k for k, oid in oids.items() if synced.get(k) != oid]
+        keys = partitions.sort_keys(changed + [k for k in synced if k not in oids])
+        if not keys:
+            print(f"{target.table_id} is up to date with {table}.")
+            stats = {"rows": 0, "files": 0, **_upload_stats(0, 0.0), "mode": "unchanged", "partitions": 0}
+        else:
+            with tempfile.TemporaryDirectory(prefix="bq_sync_") as tmp:
+                # dropped partitions have no rows to export: the MERGE only deletes theirs
+                where = " OR ".join(f"({partitions.check_sql(k)})" for k in changed) or "FALSE"
+                files, stats = _export(engine, table, tmp, batch_rows, rows_per_file, where=where)
+                start = time.perf_counter()
+                uploaded = target.replace_partitions(partitions.PARTITION_KEY, keys, files, workers)
+                upload_sec = time.perf_counter() - start
+            print(f"Replaced {len(keys)} partition(s) of {target.table_id} with {stats['rows']:,} rows, "
+                  f"{uploaded / 2**20:.1f} MiB uploaded in {upload_sec:.1f}s.")
+            stats = {**stats, **_upload_stats(uploaded, upload_sec), "mode": "merge", "partitions": len(keys)}
+
+    if oids is not None:  # only once the target has the rows: a failed sync is redone from the old oids
+        with engine.begin() as conn:
+            state.set_state(conn.connection.cursor(), dataset_id, key,
+                            json.dumps({"columns": columns, "partitions": sorted(oids.items(), key=str)}))
+    return stats
@@ -0,0 +1,155 @@
+"""
+Declarative cleaning rules for the staging -> clean step.
+
+The rules are plain data so they can be compiled to SQL: `compile_clean_sql`
+turns them into a single `CREATE UNLOGGED TABLE ... AS SELECT` that normalizes,
+filters and de-duplicates in one pass over the staging table, instead of a
+CREATE followed by per-column UPDATEs, DELETEs and a DISTINCT copy.
+"""
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+YN_DOMAIN = (("YES", "Yes"), ("NO", "No"), ("UNKNOWN", "Unknown"), ("MISSING", "Missing"))
+MONTH_PATTERN = "^[0-9]{4}-[0-1][0-9]$"
+STATE_PATTERN = "^[A-Z]{2}$"
+
+
+@dataclass(frozen=True)
+class ColumnRule:
+    """
+    How one clean column is derived from the staging column of the same name.
+
+    transform: "keep" | "nullif_empty" | "upper"
+               | "domain"  (map UPPER(COALESCE(col, '')) through `values`, else `default`)
+               | "allowed" (keep values listed in `values`, else `default`)
+    required:  emit the column (as NULL) even when staging lacks it
+    encoded:   low-cardinality column, stored as a Postgres enum in the clean table (encoding.py)
+    """
+    name: str
+    transform: str = "keep"
+    values: Tuple = ()
+    default: Optional[str] = None
+    required: bool = False
+    encoded: bool = False
+
+
+@dataclass(frozen=True)
+class RowFilter:
+    """
+    Row-level filter on a normalized column.
+
+    kind: "match"        keep NULLs and values matching `pattern`
+          "not_future"   drop values matching `pattern` that sort after the current YYYY-MM
+    """
+    column: str
+    kind: str
+    pattern: str
+
+
+CLEAN_COLUMNS = [
+    ColumnRule("case_month", "nullif_empty", required=True),
+    ColumnRule("res_state", "upper", required=True),
+    ColumnRule("age_group", encoded=True),
+    ColumnRule("sex", "domain", (("MALE", "Male"), ("FEMALE", "Female"), ("UNKNOWN", "Unknown"),
+                                 ("MISSING", "Missing")), default="Unknown", encoded=True),
+    ColumnRule("current_status", "allowed", ("Confirmed Case", "Probable Case"), default="Probable Case",
+               encoded=True),
+    ColumnRule("hosp_yn", "domain", YN_DOMAIN, default="Unknown", encoded=True),
+    ColumnRule("icu_yn", "domain", YN_DOMAIN, default="Unknown", encoded=True),
+    ColumnRule("death_yn", "domain", YN_DOMAIN, default="Unknown", encoded=True),
+    ColumnRule("race", encoded=True),
+    ColumnRule("ethnicity", encoded=True),
+    ColumnRule("res_county"),
+    ColumnRule("county_fips_code"),
+    ColumnRule("state_fips_code"),
+    ColumnRule("case_positive_specimen"),
+    ColumnRule("process", encoded=True),
+    ColumnRule("exposure_yn", encoded=True),
+]
+
+CLEAN_FILTERS = [
+    RowFilter("case_month", "not_future", MONTH_PATTERN),
+    RowFilter("res_state", "match", STATE_PATTERN),
+]
+
+
+def _lit(v: str) -> str:
+    return "'" + v.replace("'", "''") + "'"
+
+
+def column_sql(rule: ColumnRule) -> str:
+    c = rule.name
+    if rule.transform == "keep":
+        return c
+    if rule.transform == "nullif_empty":
+        return f"NULLIF({c}, '')"
+    if rule.transform == "upper":
+        return f"UPPER({c})"
+    if rule.transform == "domain":
+        whens = " ".join(f"WHEN {_lit(k)} THEN {_lit(v)}" for k, v in rule.values)
+        return f"CASE UPPER(COALESCE({c}, '')) {whens} ELSE {_lit(rule.default)} END"
+    if rule.transform == "allowed":
+        return f"CASE WHEN {c} IN ({', '.join(map(_lit, rule.values))}) THEN {c} ELSE {_lit(rule.default)} END"
+    raise ValueError(f"unknown transform {rule.transform!r} for column {c}")
+
+
+def filter_sql(f: RowFilter) -> str:
+    c = f.column
+    if f.kind == "match":
+        return f"({c} IS NULL OR {c} ~ {_lit(f.pattern)})"
+    if f.kind == "not_future":
+        return f"NOT ({c} IS NOT NULL AND {c} ~ {_lit(f.pattern)} AND {c} > to_char(CURRENT_DATE, 'YYYY-MM'))"
+    raise ValueError(f"unknown filter kind {f.kind!r} for column {c}")
+
+
+def output_columns(present: Iterable[str], rules: List[ColumnRule] = CLEAN_COLUMNS) -> List[ColumnRule]:
+    present = set(present)
+    return [r for r in rules if r.required or r.name in present]
+
+
+def select_sql(source: str, present: Iterable[str], rules: List[ColumnRule] = CLEAN_COLUMNS,
+               filters: List[RowFilter] = CLEAN_FILTERS, distinct: bool = True, where: Optional[str] = None) -> str:
+    """
+    SELECT producing clean rows from `source`; `present` are the columns staging
+    actually has. `where` restricts the raw source rows (e.g. to one partition).
+    """
+    present = set(present)
+    out = output_columns(present, rules)
+    exprs = ",\n        ".join(
+        r.name if r.transform == "keep" and r.name in present
+        else f"{column_sql(r)} AS {r.name}" if r.name in present
+        else f"CAST(NULL AS text) AS {r.name}"
+        for r in out
+    )
+    names = {r.name for r in out}
+    wheres = [filter_sql(f) for f in filters if f.column in names]
+    outer = ("\n    WHERE " + "\n      AND ".join(wheres)) if wheres else ""
+    inner = f"\n        WHERE {where}" if where else ""
+    return (
+        f"SELECT {'DISTINCT ' if distinct else ''}{', '.join(r.name for r in out)}\n"
+        f"    FROM (\n        SELECT\n        {exprs}\n        FROM {source}{inner}\n    ) n{outer}"
+    )
+
+
+def compile_clean_sql(source: str, target: str, present: Iterable[str], **kwargs) -> str:
+    """One statement: normalize, filter and de-dupe `source` into a new unlogged `target`."""
+    return f"CREATE UNLOGGED TABLE {target} AS\n{select_sql(source, present, **kwargs)};"
+
+
+def row_hash_sql(columns: Iterable[str]) -> str:
+    """
+    Immutable 128-bit fingerprint of a row's columns (md5 as uuid), usable in a
+    unique index. NULL and '' hash differently; separators are control chars.
+    """
+    parts = " || E'\\x1f' || ".join(f"COALESCE({c}, E'\\x1e')" for c in columns)
+    return f"md5({parts})::uuid"
+
+
+def fingerprint_sql(present: Iterable[str], rules: List[ColumnRule] = CLEAN_COLUMNS) -> str:
+    """
+    row_hash_sql of the clean row a staging row normalizes to, computed from the
+    staging columns: equal fingerprints mean equal clean rows, so duplicates can
+    be rejected as rows are staged instead of by a DISTINCT at transform time.
+    """
+    present = set(present)
+    return row_hash_sql(column_sql(r) if r.name in present else "NULL" for r in output_columns(present, rules))
@@ -0,0 +1,391 @@
+"""
+Column profiles of the ingested pages, for drift monitoring.
+
+Ingest folds every fetched page into a Profile on its way to staging
+(pipeline.fetch_paginated, pipelined.run), so the statistics cost no extra
+scan of the staging or clean table:
+
+  * per column: rows, nulls (missing or ""), distinct values (HyperLogLog)
+    and the most frequent values (SpaceSaving, counts with an error bound);
+  * per case_month: rows, and the nulls and most frequent values of each column.
+
+Both sketches are mergeable, so a page is summarized with vectorized pandas
+ops (hash_pandas_object, value_counts) and merged into the run's profile,
+and Profile.merge combines whole profiles. Each run's profile is stored in
+data_profiles (one row per dataset, staging table and run, so configs sharing
+a Socrata dataset keep their own history) and served by the validation API,
+which compares a run with the previous one of the same table and mode (`drift`).
+
+A profile describes the raw pages as fetched, before deduplication and
+cleaning; an incremental run profiles its delta only. INGEST_MODE=stream
+pages never become DataFrames and are not profiled.
+"""
+import base64, json, math, os, time, zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+PROFILES_TABLE = "data_profiles"
+PARTITION_KEY = "case_month"                                       # as partitions.PARTITION_KEY
+HLL_PRECISION = int(os.getenv("PROFILE_HLL_PRECISION", "12"))      # 2**p registers, ~1.04/sqrt(2**p) error
+TOP_K = int(os.getenv("PROFILE_TOP_K", "50"))                      # values tracked per column
+MONTH_TOP_K = int(os.getenv("PROFILE_MONTH_TOP_K", "10"))          # ... per column and case_month
+# drift() flags a column past any of these
+DRIFT_NULL_RATE = float(os.getenv("DRIFT_NULL_RATE", "0.05"))      # absolute change in null rate
+DRIFT_DISTINCT_RATIO = float(os.getenv("DRIFT_DISTINCT_RATIO", "1.5"))  # distinct count grew/shrank by
+DRIFT_DISTANCE = float(os.getenv("DRIFT_DISTANCE", "0.1"))         # total variation distance of top values
+
+PROFILES_DDL = f"""
+CREATE TABLE IF NOT EXISTS {PROFILES_TABLE} (
+    dataset_id TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    run_id     TEXT NOT NULL,
+    mode       TEXT NOT NULL,
+    rows       BIGINT NOT NULL,
+    profile    JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (dataset_id, table_name, run_id)
+);
+"""
+
+
+class HyperLogLog:
+    """Distinct-count sketch over 64-bit hashes; `p` from 11 to 16."""
+
+    def __init__(self, p: int = HLL_PRECISION, registers: Optional[np.ndarray] = None):
+        self.p = p
+        self.registers = np.zeros(1 << p, np.uint8) if registers is None else registers
+
+    def add_hashes(self, h: np.ndarray):
+        h = h.astype(np.uint64, copy=False)
+        idx = (h >> np.uint64(64 - self.p)).astype(np.intp)
+        rest = h & np.uint64((1 << (64 - self.p)) - 1)
+        # rank = leading zeros of the remaining 64-p bits + 1; frexp's exponent is the bit length
+        # (exact, as 64-p <= 53 bits fit a float64)
+        rank = (64 - self.p + 1) - np.frexp(rest.astype(np.float64))[1]
+        np.maximum.at(self.registers, idx, rank.astype(np.uint8))
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        return HyperLogLog(self.p, np.maximum(self.registers, other.registers))
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        raw = 0.7213 / (1 + 1.079 / m) * m * m / float(np.sum(np.ldexp(1.0, -self.registers.astype(np.int32))))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:  # small cardinalities: linear counting
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw))
+
+    def to_dict(self) -> dict:
+        return {"p": self.p, "registers": base64.b64encode(zlib.compress(self.registers.tobytes())).decode()}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "HyperLogLog":
+        data = zlib.decompress(base64.b64decode(d["registers"]))
+        return cls(d["p"], np.frombuffer(data, np.uint8).copy())
+
+
+class SpaceSaving:
+    """
+    Mergeable top-k summary: up to `capacity` values with an over-estimate of
+    their count and the most that estimate can be over (`errors`). A value not
+    listed occurred at most `floor` times.
+    """
+
+    def __init__(self, capacity: int, counts: Optional[Dict[str, int]] = None,
+                 errors: Optional[Dict[str, int]] = None, floor: int = 0):
+        self.capacity, self.floor = capacity, floor
+        self.counts, self.errors = counts or {}, errors or {}
+
+    @classmethod
+    def from_arrays(cls, values: np.ndarray, counts: np.ndarray, capacity: int) -> "SpaceSaving":
+        """Exact counts of `values`, truncated to the `capacity` largest."""
+        nz = np.flatnonzero(counts)
+        if len(nz) > capacity:  # the capacity+1 largest; the last of them bounds every value dropped
+            nz = nz[np.argpartition(-counts[nz], capacity)[:capacity + 1]]
+        order = nz[np.argsort(-counts[nz], kind="stable")]
+        floor = int(counts[order[capacity]]) if len(order) > capacity else 0
+        return cls(capacity, {str(values[i]): int(counts[i]) for i in order[:capacity]}, {}, floor)
+
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        counts, errors = {}, {}
+        for v in self.counts.keys() | other.counts.keys():
+            counts[v] = self.counts.get(v, self.floor) + other.counts.get(v, other.floor)
+            errors[v] = (self.errors.get(v, 0) if v in self.counts else self.floor) + \
+                        (other.errors.get(v, 0) if v in other.counts else other.floor)
+        out = SpaceSaving(max(self.capacity, other.capacity), floor=self.floor + other.floor)
+        ranked = sorted(counts, key=lambda v: (-counts[v], v))
+        for v in ranked[:out.capacity]:
+            out.counts[v] = counts[v]
+            if errors[v]:
+                out.errors[v] = errors[v]
+        if len(ranked) > out.capacity:
+            out.floor = max(out.floor, counts[ranked[out.capacity]])
+        return out
+
+    def top(self, k: Optional[int] = None) -> List[Tuple[str, int, int]]:
+        """(value, count, error) by count descending; the true count is within [count - error, count]."""
+        ranked = sorted(self.counts.items(), key=lambda kv: (-kv[1], kv[0]))[:k]
+        return [(v, n, self.errors.get(v, 0)) for v, n in ranked]
+
+    def to_dict(self) -> dict:
+        return {"capacity": self.capacity, "floor": self.floor, "counts": self.counts, "errors": self.errors}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "SpaceSaving":
+        return cls(d["capacity"], dict(d["counts"]), dict(d["errors"]), d["floor"])
+
+
+class Profile:
+    """Statistics of every column of the pages added so far; see the module docstring."""
+
+    def __init__(self, top_k: int = TOP_K, month_top_k: int = MONTH_TOP_K, precision: int = HLL_PRECISION):
+        self.top_k, self.month_top_k, self.precision = top_k, month_top_k, precision
+        self.rows, self.seconds = 0, 0.0
+        self.columns: Dict[str, dict] = {}  # name -> {"rows", "nulls", "hll", "top"}
+        self.months: Dict[str, dict] = {}   # case_month -> {"rows", "nulls": {col: n}, "top": {col: SpaceSaving}}
+
+    def add_records(self, rows: List[dict]):
+        self.add_frame(pd.DataFrame(rows))
+
+    def add_frame(self, df: pd.DataFrame):
+        if df.empty:
+            return
+        t0 = time.perf_counter()
+        self.rows += len(df)
+        if PARTITION_KEY in df.columns:
+            mcodes, months = pd.factorize(df[PARTITION_KEY])
+            months = [str(m) for m in months] + [""]
+            mcodes = np.where(mcodes < 0, len(months) - 1, mcodes)  # no case_month
+        else:
+            mcodes, months = np.zeros(len(df), np.intp), [""]
+        for m, n in zip(months, np.bincount(mcodes, minlength=len(months))):
+            if n:
+                self.months.setdefault(m, {"rows": 0, "nulls": {}, "top": {}})["rows"] += int(n)
+        for c in df.columns:
+            if not c.startswith(":"):  # :id/:updated_at are unique per row
+                self._add_column(c, df[c], mcodes, months)
+        self.seconds += time.perf_counter() - t0
+
+    def _add_column(self, name: str, s: pd.Series, mcodes: np.ndarray, months: List[str]):
+        # one factorize per column; every count below is a bincount over its codes
+        try:
+            codes, uniques = pd.factorize(s)
+        except TypeError:  # unhashable values, e.g. nested JSON
+            codes, uniques = pd.factorize(s.astype(str).where(s.notna()))
+        uniques = np.asarray(uniques, dtype=object)
+        valid = codes >= 0
+        for i in np.flatnonzero(uniques == ""):
+            valid &= codes != i
+        col = self.columns.setdefault(name, {"rows": 0, "nulls": 0, "hll": HyperLogLog(self.precision),
+                                             "top": SpaceSaving(self.top_k)})
+        col["rows"] += len(codes)
+        if not valid.all():
+            nulls = np.bincount(mcodes[~valid], minlength=len(months))
+            col["nulls"] += int(nulls.sum())
+            for i in np.flatnonzero(nulls):
+                month_nulls = self.months[months[i]]["nulls"]
+                month_nulls[name] = month_nulls.get(name, 0) + int(nulls[i])
+            codes, mcodes = codes[valid], mcodes[valid]
+        if not len(codes):
+            return
+        n = len(uniques)
+        counts = np.bincount(codes, minlength=n)
+        col["hll"].add_hashes(pd.util.hash_array(uniques[counts > 0]))
+        col["top"] = col["top"].merge(SpaceSaving.from_arrays(uniques, counts, self.top_k))
+        if len(months) * n <= 1 << 22:
+            grid = np.bincount(mcodes * n + codes, minlength=len(months) * n).reshape(len(months), n)
+            per_month = ((i, uniques, grid[i]) for i in np.flatnonzero(grid.any(axis=1)))
+        else:  # many distinct values: count only the (month, value) pairs present
+            keys, pair_counts = np.unique(mcodes.astype(np.int64) * n + codes, return_counts=True)
+            cuts = np.flatnonzero(np.diff(keys // n)) + 1
+            per_month = ((k[0] // n, uniques[k % n], pc) for k, pc in zip(np.split(keys, cuts),
+                                                                          np.split(pair_counts, cuts)))
+        for i, values, month_counts in per_month:
+            top = self.months[months[i]]["top"]
+            page_top = SpaceSaving.from_arrays(values, month_counts, self.month_top_k)
+            top[name] = top[name].merge(page_top) if name in top else page_top
+
+    def merge(self, other: "Profile") -> "Profile":
+        out = Profile(max(self.top_k, other.top_k), max(self.month_top_k, other.month_top_k), self.precision)
+        out.rows, out.seconds = self.rows + other.rows, self.seconds + other.seconds
+        for name in self.columns.keys() | other.columns.keys():
+            a, b = self.columns.get(name), other.columns.get(name)
+            if a is None or b is None:
+                v = a or b
+                out.columns[name] = {**v, "hll": HyperLogLog(v["hll"].p, v["hll"].registers.copy())}
+                continue
+            out.columns[name] = {"rows": a["rows"] + b["rows"], "nulls": a["nulls"] + b["nulls"],
+                                 "hll": a["hll"].merge(b["hll"]), "top": a["top"].merge(b["top"])}
+        for m in self.months.keys() | other.months.keys():
+            a = self.months.get(m, {"rows": 0, "nulls": {}, "top": {}})
+            b = other.months.get(m, {"rows": 0, "nulls": {}, "top": {}})
+            out.months[m] = {
+                "rows": a["rows"] + b["rows"],
+                "nulls": {c: a["nulls"].get(c, 0) + b["nulls"].get(c, 0) for c in a["nulls"].keys() | b["nulls"]},
+                "top": {c: a["top"][c].merge(b["top"][c]) if c in a["top"] and c in b["top"]
+                        else a["top"].get(c) or b["top"][c] for c in a["top"].keys() | b["top"]},
+            }
+        return out
+
+    def to_dict(self) -> dict:
+        return {
+            "rows": self.rows, "top_k": self.top_k, "month_top_k": self.month_top_k, "precision": self.precision,
+            "seconds": round(self.seconds, 3),
+            "columns": {c: {"rows": v["rows"], "nulls": v["nulls"], "hll": v["hll"].to_dict(),
+                            "top": v["top"].to_dict()} for c, v in self.columns.items()},
+            "months": {m: {"rows": v["rows"], "nulls": v["nulls"],
+                           "top": {c: t.to_dict() for c, t in v["top"].items()}} for m, v in self.months.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Profile":
+        out = cls(d["top_k"], d["month_top_k"], d["precision"])
+        out.rows, out.seconds = d["rows"], d.get("seconds", 0.0)
+        out.columns = {c: {"rows": v["rows"], "nulls": v["nulls"], "hll": HyperLogLog.from_dict(v["hll"]),
+                           "top": SpaceSaving.from_dict(v["top"])} for c, v in d["columns"].items()}
+        out.months = {m: {"rows": v["rows"], "nulls": dict(v["nulls"]),
+                          "top": {c: SpaceSaving.from_dict(t) for c, t in v["top"].items()}}
+                      for m, v in d["months"].items()}
+        return out
+
+
+def _top_list(top: SpaceSaving, k: Optional[int] = None) -> List[dict]:
+    return [{"value": v, "count": n, "error": e} for v, n, e in top.top(k)]
+
+
+def summary(profile: Profile, top: int = 10, months: bool = False) -> Dict[str, Any]:
+    """Readable statistics of `profile`: null rate, distinct estimate and top values per column."""
+    out = {"rows": profile.rows, "columns": {}}
+    for c, v in sorted(profile.columns.items()):
+        out["columns"][c] = {"rows": v["rows"], "nulls": v["nulls"], "null_rate": round(v["nulls"] / v["rows"], 6),
+                             "distinct": v["hll"].estimate(), "top": _top_list(v["top"], top)}
+    if months:
+        out["months"] = {m: {"rows": v["rows"],
+                             "null_rate": {c: round(n / v["rows"], 6) for c, n in sorted(v["nulls"].items())},
+                             "top": {c: _top_list(t, top) for c, t in sorted(v["top"].items())}}
+                         for m, v in sorted(profile.months.items())}
+    else:
+        out["months"] = {m: v["rows"] for m, v in sorted(profile.months.items())}
+    return out
+
+
+def distance(a: Dict[str, int], a_total: int, b: Dict[str, int], b_total: int,
+             a_floor: int = 0, b_floor: int = 0) -> float:
+    """
+    Total variation distance of two (partial) distributions; unlisted mass counts
+    as one "other" bucket. A value missing from a truncated summary may hold up to
+    that summary's `floor`, so it is taken as close to the other side as that allows.
+    """
+    if not a_total or not b_total:
+        return 0.0 if a_total == b_total else 1.0
+    pa = {v: n / a_total for v, n in a.items()}
+    pb = {v: n / b_total for v, n in b.items()}
+    for v in pb.keys() - pa.keys():
+        pa[v] = min(a_floor / a_total, pb[v])
+    for v in pa.keys() - pb.keys():
+        pb[v] = min(b_floor / b_total, pa[v])
+    d = sum(abs(pa[v] - pb[v]) for v in pa)
+    d += abs((1 - sum(pa.values())) - (1 - sum(pb.values())))
+    return round(min(d / 2, 1.0), 6)
+
+
+def drift(current: Profile, baseline: Profile) -> Dict[str, Any]:
+    """
+    Run-over-run comparison: per column, the change in null rate, distinct count
+    and top-value distribution, plus the case_month distribution of the rows.
+    A column is `drifted` past DRIFT_NULL_RATE / DRIFT_DISTINCT_RATIO / DRIFT_DISTANCE.
+    """
+    columns = {}
+    for c in sorted(current.columns.keys() | baseline.columns.keys()):
+        cur, base = current.columns.get(c), baseline.columns.get(c)
+        if cur is None or base is None:
+            columns[c] = {"drifted": True, "reasons": ["column missing" if cur is None else "new column"]}
+            continue
+        null_rate = (cur["nulls"] / cur["rows"], base["nulls"] / base["rows"])
+        distinct = (cur["hll"].estimate(), base["hll"].estimate())
+        ratio = max(distinct) / max(min(distinct), 1)
+        cur_top, base_top = cur["top"].counts, base["top"].counts
+        dist = distance(cur_top, cur["rows"] - cur["nulls"], base_top, base["rows"] - base["nulls"],
+                        cur["top"].floor, base["top"].floor)
+        reasons = []
+        if abs(null_rate[0] - null_rate[1]) > DRIFT_NULL_RATE:
+            reasons.append("null_rate")
+        if ratio > DRIFT_DISTINCT_RATIO:
+            reasons.append("distinct")
+        if dist > DRIFT_DISTANCE:
+            reasons.append("top_values")
+        columns[c] = {
+            "null_rate": round(null_rate[0], 6), "baseline_null_rate": round(null_rate[1], 6),
+            "distinct": distinct[0], "baseline_distinct": distinct[1], "top_distance": dist,
+            "new_top_values": sorted(set(cur_top) - set(base_top))[:10],
+            "gone_top_values": sorted(set(base_top) - set(cur_top))[:10],
+            "drifted": bool(reasons), "reasons": reasons,
+        }
+    month_rows = ({m: v["rows"] for m, v in current.months.items()},
+                  {m: v["rows"] for m, v in baseline.months.items()})
+    months = {"distance": distance(month_rows[0], current.rows, month_rows[1], baseline.rows),
+              "new": sorted(month_rows[0].keys() - month_rows[1].keys()),
+              "gone": sorted(month_rows[1].keys() - month_rows[0].keys())}
+    return {"rows": current.rows, "baseline_rows": baseline.rows, "months": months, "columns": columns,
+            "drifted": sorted(c for c, v in columns.items() if v["drifted"])}
+
+
+def new_run_id() -> str:
+    return datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+
+
+def save(cur, dataset_id: str, table: str, run_id: str, mode: str, profile: Profile):
+    """Store the profile of the `dataset_id` rows `run_id` staged into `table`; saving a run again replaces it."""
+    cur.execute(PROFILES_DDL)
+    cur.execute(f"""
+        INSERT INTO {PROFILES_TABLE} (dataset_id, table_name, run_id, mode, rows, profile)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (dataset_id, table_name, run_id) DO UPDATE SET
+            mode = EXCLUDED.mode, rows = EXCLUDED.rows, profile = EXCLUDED.profile, created_at = now();
+    """, (dataset_id, table, run_id, mode, profile.rows, json.dumps(profile.to_dict())))
+
+
+def _run(dataset_id, table, run_id, mode, rows, created_at) -> dict:
+    return {"dataset_id": dataset_id, "table": table, "run_id": run_id, "mode": mode, "rows": rows,
+            "created_at": created_at.isoformat()}
+
+
+def runs(cur, dataset_id: Optional[str] = None, table: Optional[str] = None, limit: int = 20) -> List[dict]:
+    """Stored profiles, newest first, without their sketches."""
+    cur.execute(PROFILES_DDL)
+    cur.execute(f"""
+        SELECT dataset_id, table_name, run_id, mode, rows, created_at FROM {PROFILES_TABLE}
+        WHERE (%(d)s IS NULL OR dataset_id = %(d)s) AND (%(t)s IS NULL OR table_name = %(t)s)
+        ORDER BY created_at DESC, run_id DESC LIMIT %(n)s;
+    """, {"d": dataset_id, "t": table, "n": limit})
+    return [_run(*row) for row in cur.fetchall()]
+
+
+def load(cur, dataset_id: str, table: Optional[str] = None,
+         run_id: Optional[str] = None) -> Optional[Tuple[dict, Profile]]:
+    """
+    (run, profile) of `run_id`, or of the latest run; None when there is none.
+    Without `table`, the newest match among the dataset's staging tables.
+    """
+    cur.execute(PROFILES_DDL)
+    cur.execute(f"""
+        SELECT dataset_id, table_name, run_id, mode, rows, created_at, profile FROM {PROFILES_TABLE}
+        WHERE dataset_id = %(d)s AND (%(t)s IS NULL OR table_name = %(t)s) AND (%(r)s IS NULL OR run_id = %(r)s)
+        ORDER BY created_at DESC, run_id DESC LIMIT 1;
+    """, {"d": dataset_id, "t": table, "r": run_id})
+    row = cur.fetchone()
+    return None if row is None else (_run(*row[:6]), Profile.from_dict(row[6]))
+
+
+def previous(cur, run: dict) -> Optional[Tuple[dict, Profile]]:
+    """The run before `run` of the same dataset, table and mode (full loads compare with full loads)."""
+    cur.execute(f"""
+        SELECT run_id FROM {PROFILES_TABLE}
+        WHERE dataset_id = %s AND table_name = %s AND mode = %s AND (created_at, run_id) < (%s::timestamptz, %s)
+        ORDER BY created_at DESC, run_id DESC LIMIT 1;
+    """, (run["dataset_id"], run["table"], run["mode"], run["created_at"], run["run_id"]))
+    row = cur.fetchone()
+    return load(cur, run["dataset_id"], run["table"], row[0]) if row else None
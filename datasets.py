@@ -0,0 +1,91 @@
+"""
+Per-dataset settings, so one process can run several Socrata datasets.
+
+A DatasetConfig names the dataset, the tables it owns (stg_<name>_raw,
+stg_<name>_clean and BigQuery table <name> unless given) and the rule set
+its staging rows are cleaned and validated with. Rule sets are registered by
+name in RULE_SETS; `load_configs` reads a JSON list of configs, e.g.
+
+    [{"name": "cases", "dataset_id": "n8mc-b4w4"},
+     {"name": "cases_geo", "dataset_id": "vbim-akqf", "columns": ["case_month", "res_state", "sex"],
+      "bq_table": "cdc_cases_geo", "rule_set": "cdc_cases"}]
+"""
+import json, re
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+import cleaning, staging, validation_rules
+
+DEFAULT_COLUMNS = tuple(staging.SYSTEM_COLUMNS.values()) + tuple(staging.CDC_CASE_COLUMNS)
+
+_NAME = re.compile(r"^[a-z][a-z0-9_]*$")
+_IDENTIFIER = re.compile(r"^[a-z_][a-z0-9_]*$")  # table and column names go into DDL unquoted
+
+
+@dataclass(frozen=True)
+class RuleSet:
+    clean_columns: List[cleaning.ColumnRule]
+    clean_filters: List[cleaning.RowFilter]
+    validation: List[validation_rules.Rule]
+
+
+RULE_SETS: Dict[str, RuleSet] = {
+    "cdc_cases": RuleSet(cleaning.CLEAN_COLUMNS, cleaning.CLEAN_FILTERS, validation_rules.RULES),
+}
+
+
+@dataclass(frozen=True)
+class DatasetConfig:
+    name: str                         # table namespace; lower-case identifier
+    dataset_id: str                   # Socrata 4x4 id
+    staging_table: str = ""
+    clean_table: str = ""
+    bq_table: str = ""
+    staging_columns: Tuple[str, ...] = ()   # incl. row_id/source_updated_at; defaults to the CDC case schema
+    rule_set: str = "cdc_cases"
+    rules: RuleSet = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if not _NAME.match(self.name):
+            raise ValueError(f"dataset name {self.name!r} must be a lower-case identifier")
+        if self.rule_set not in RULE_SETS:
+            raise ValueError(f"unknown rule set {self.rule_set!r} for dataset {self.name!r}")
+        defaults = {
+            "staging_table": f"stg_{self.name}_raw",
+            "clean_table": f"stg_{self.name}_clean",
+            "bq_table": self.name,
+            "staging_columns": DEFAULT_COLUMNS,
+        }
+        for attr, value in defaults.items():
+            if not getattr(self, attr):
+                object.__setattr__(self, attr, value)
+        for attr in ("staging_table", "clean_table", "bq_table"):
+            if not _IDENTIFIER.match(getattr(self, attr)):
+                raise ValueError(f"{attr} {getattr(self, attr)!r} of dataset {self.name!r} is not a plain identifier")
+        for column in self.staging_columns:
+            if not _IDENTIFIER.match(column):
+                raise ValueError(f"column {column!r} of dataset {self.name!r} is not a plain identifier")
+        object.__setattr__(self, "rules", RULE_SETS[self.rule_set])
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "DatasetConfig":
+        d = dict(d)
+        columns = d.pop("columns", None)
+        if columns:
+            d["staging_columns"] = tuple(staging.SYSTEM_COLUMNS.values()) + tuple(
+                staging.normalize_column(c) for c in columns)
+        return cls(**d)
+
+
+def load_configs(path: str) -> List[DatasetConfig]:
+    with open(path) as f:
+        configs = [DatasetConfig.from_dict(d) for d in json.load(f)]
+    # configs may share a dataset_id (their state is kept per staging table), never a table
+    seen: Dict[str, str] = {}
+    for cfg in configs:
+        for table in (f"table {cfg.staging_table}", f"table {cfg.clean_table}", f"BigQuery table {cfg.bq_table}"):
+            if table in seen:
+                raise ValueError(f"datasets {seen[table]!r} and {cfg.name!r} both use {table}")
+            seen[table] = cfg.name
+    return configs
+
@@ -0,0 +1,143 @@
+"""
+Dictionary encoding for the low-cardinality columns of the case data.
+
+Most columns (sex, age_group, race, the Y/N flags, ...) only ever hold a
+handful of distinct values. Each stage keeps them compact in its own way:
+
+  * in memory, fetched pages hold them as pandas categoricals (`categorize`).
+    The page cache then stores them as Arrow dictionary arrays;
+  * in Postgres, clean-table columns whose ColumnRule has `encoded=True` are
+    Postgres enums. A label is stored as a 4-byte oid instead of the string,
+    and readers still compare against plain string literals. The enum type
+    `dict_<column>` is shared by every clean table and grows as new values
+    show up (`column_types`);
+  * in the BigQuery export, enum columns are written as Arrow dictionary
+    arrays to dictionary-encoded Parquet (bq_loader.py).
+
+A column whose values do not fit an enum (a label over 63 bytes, or more than
+MAX_LABELS labels) stays TEXT. Enum labels sort in the order they were added,
+not alphabetically, so cast to text (`col::text`) before ordering or regex
+matching an encoded column.
+"""
+import os
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+
+import cleaning
+
+if TYPE_CHECKING:  # pandas is heavy; categorize only needs the frames its callers pass in
+    import pandas as pd
+
+CATEGORY_MAX_RATIO = float(os.getenv("CATEGORY_MAX_RATIO", "0.5"))  # distinct/rows at most, to categorize
+MAX_LABELS = int(os.getenv("ENUM_MAX_LABELS", "1000"))            # per enum type, across all tables
+MAX_LABEL_BYTES = 63                                               # Postgres NAMEDATALEN - 1
+
+
+def categorize(df: "pd.DataFrame", max_ratio: float = CATEGORY_MAX_RATIO) -> "pd.DataFrame":
+    """Turn string columns with few distinct values (at most `max_ratio` of the rows) into categoricals."""
+    for c in df.columns:
+        if df[c].dtype != object or c.startswith(":"):  # :id/:updated_at are unique per row
+            continue
+        try:
+            cat = df[c].astype("category")
+        except TypeError:  # unhashable values, e.g. nested JSON
+            continue
+        if len(cat.cat.categories) <= max_ratio * len(df):
+            df[c] = cat
+    return df
+
+
+def enum_type(column: str) -> str:
+    return f"dict_{column}"
+
+
+def rule_labels(rule: cleaning.ColumnRule) -> List[str]:
+    """Every value a closed-domain rule can produce, in domain order; [] when the output is open."""
+    if rule.transform == "domain":
+        labels = [v for _, v in rule.values]
+    elif rule.transform == "allowed":
+        labels = list(rule.values)
+    else:
+        return []
+    return list(dict.fromkeys(labels + ([rule.default] if rule.default is not None else [])))
+
+
+def enum_labels(cur, type_name: str) -> Optional[List[str]]:
+    """Labels of enum `type_name` in sort order, or None when the type does not exist."""
+    cur.execute("SELECT to_regtype(%s) IS NOT NULL;", (type_name,))
+    if not cur.fetchone()[0]:
+        return None
+    cur.execute("SELECT enumlabel FROM pg_enum WHERE enumtypid = %s::regtype ORDER BY enumsortorder;", (type_name,))
+    return [r[0] for r in cur.fetchall()]
+
+
+def ensure_enum(cur, type_name: str, labels: Iterable[str]) -> bool:
+    """
+    Create `type_name` or add the missing `labels` to it; False (and nothing
+    changed) when the labels do not fit an enum. New labels are usable once
+    the transaction commits.
+    """
+    labels = list(dict.fromkeys(labels))
+    if any(len(v.encode()) > MAX_LABEL_BYTES for v in labels):
+        return False
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (type_name,))  # concurrent datasets share types
+    current = enum_labels(cur, type_name)
+    if current is None:
+        if len(labels) > MAX_LABELS:
+            return False
+        cur.execute(f"CREATE TYPE {type_name} AS ENUM ({', '.join(map(cleaning._lit, labels))});")
+        return True
+    new = [v for v in labels if v not in set(current)]
+    if len(current) + len(new) > MAX_LABELS:
+        return False
+    for v in new:
+        cur.execute(f"ALTER TYPE {type_name} ADD VALUE IF NOT EXISTS {cleaning._lit(v)};")
+    return True
+
+
+def distinct_values(cur, source: str, rules: List[cleaning.ColumnRule],
+                    where: Optional[str] = None) -> Dict[str, set]:
+    """Non-NULL clean values of each rule's column in `source`, from one scan (GROUPING SETS)."""
+    if not rules:
+        return {}
+    exprs = [cleaning.column_sql(r) for r in rules]
+    cur.execute(f"SELECT {', '.join(exprs)}, GROUPING({', '.join(exprs)}) FROM {source}"
+                f"{f' WHERE {where}' if where else ''} GROUP BY GROUPING SETS ({', '.join(f'({e})' for e in exprs)});")
+    out = {r.name: set() for r in rules}
+    n = len(rules)
+    for row in cur.fetchall():
+        grouped = row[-1]
+        for i, r in enumerate(rules):
+            if not grouped & (1 << (n - 1 - i)) and row[i] is not None:
+                out[r.name].add(row[i])
+    return out
+
+
+def column_types(cur, source: str, present: Iterable[str],
+                 rules: List[cleaning.ColumnRule] = cleaning.CLEAN_COLUMNS, where: Optional[str] = None,
+                 keep_text: Iterable[str] = ()) -> Dict[str, str]:
+    """
+    Postgres type of each clean column ("text" or an enum type name) for the
+    clean rows of `source` matching `where`. The enum types are created or
+    extended on `cur`, so commit before inserting rows. Columns in `keep_text`
+    stay TEXT (an incremental rebuild cannot narrow a partitioned table's columns).
+    """
+    present, keep_text = set(present), set(keep_text)
+    out = cleaning.output_columns(present, rules)
+    encoded = [r for r in out if r.encoded and r.name not in keep_text]
+    scanned = distinct_values(cur, source, [r for r in encoded if r.name in present and not rule_labels(r)], where)
+    types = {r.name: "text" for r in out}
+    for r in sorted(encoded, key=lambda r: r.name):  # one lock order for every caller
+        labels = rule_labels(r) or sorted(scanned.get(r.name, ()))
+        if ensure_enum(cur, enum_type(r.name), labels):
+            types[r.name] = enum_type(r.name)
+    return types
+
+
+def enum_columns(cur, table: str) -> List[str]:
+    """Columns of `table` stored as enums."""
+    cur.execute("""
+        SELECT a.attname FROM pg_attribute a JOIN pg_type t ON t.oid = a.atttypid
+        WHERE a.attrelid = to_regclass(%s) AND a.attnum > 0 AND NOT a.attisdropped AND t.typtype = 'e'
+        ORDER BY a.attnum;
+    """, (table,))
+    return [r[0] for r in cur.fetchall()]
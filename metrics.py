@@ -0,0 +1,207 @@
+"""
+Structured run metrics.
+
+`RunRecorder` appends one JSON object per line to logs/run_<run_id>.jsonl.
+It records:
+- "stage" events with wall time, rows and peak RSS,
+- per-page "page" events for DB writes,
+- "http" events with the latency and bytes of every Socrata request,
+- "load" events with the rows and bytes uploaded to BigQuery,
+- transform "statement" events, with the EXPLAIN ANALYZE plan when
+  PIPELINE_EXPLAIN=1.
+
+Code deep in the pipeline writes to the module-level `run`. It is a no-op
+recorder until the orchestrator calls `start_run`. `summarize` folds a run
+file back into totals, and `prometheus_lines` renders them for the
+validation API's /metrics.
+
+PIPELINE_PROFILE=cprofile dumps a pstats file per stage (profiling the
+thread that runs the stage's page loop). PIPELINE_PROFILE=py-spy attaches
+`py-spy record` to the process for the whole run, if py-spy is installed.
+"""
+import cProfile, json, os, pathlib, resource, shutil, subprocess, threading, time
+from contextlib import contextmanager
+from typing import Iterable, List, Optional
+
+METRICS_DIR = os.getenv("METRICS_DIR", "logs")
+PROFILE = os.getenv("PIPELINE_PROFILE", "")            # "" | "cprofile" | "py-spy"
+EXPLAIN = os.getenv("PIPELINE_EXPLAIN", "0") == "1"    # EXPLAIN ANALYZE transform statements
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is KiB on Linux (bytes on macOS); high-water mark of the whole process
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RunRecorder:
+    """Thread-safe JSON-lines writer for one pipeline run; `path=None` records nothing."""
+
+    def __init__(self, run_id: str = "", path: Optional[str] = None, profile: str = ""):
+        self.run_id, self.path, self.profile = run_id, path, profile
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1) if path else None
+        self._spy = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._file is not None
+
+    def event(self, kind: str, **fields):
+        if not self._file:
+            return
+        line = json.dumps({"ts": round(time.time(), 3), "run_id": self.run_id, "event": kind, **fields},
+                          default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    @contextmanager
+    def stage(self, name: str, **fields):
+        """Time a pipeline stage; the body may add counters to the yielded dict (e.g. rows)."""
+        extra = dict(fields)
+        prof = cProfile.Profile() if self.profile == "cprofile" and self.enabled else None
+        start, status = time.perf_counter(), "ok"
+        if prof:
+            prof.enable()
+        try:
+            yield extra
+        except BaseException:
+            status = "failed"
+            raise
+        finally:
+            if prof:
+                prof.disable()
+                out = pathlib.Path(self.path).with_name(f"profile_{self.run_id}_{name.lower()}.prof")
+                prof.dump_stats(out)
+                extra["profile"] = str(out)
+            secs = time.perf_counter() - start
+            rows = extra.get("rows")
+            if rows:
+                extra["rows_per_sec"] = round(rows / max(secs, 1e-9))
+            self.event("stage", stage=name, status=status, seconds=round(secs, 3),
+                       peak_rss_bytes=peak_rss_bytes(), **extra)
+
+    def http(self, url: str, offset, status: int, seconds: float, nbytes: int, attempt: int):
+        self.event("http", url=url, offset=offset, status=status, seconds=round(seconds, 4),
+                   bytes=nbytes, attempt=attempt)
+
+    def page(self, stage: str, offset: int, rows: int, write_seconds: float, **fields):
+        self.event("page", stage=stage, offset=offset, rows=rows, write_seconds=round(write_seconds, 4),
+                   rows_per_sec=round(rows / max(write_seconds, 1e-9)), **fields)
+
+    def start_profiler(self):
+        if self.profile != "py-spy" or not self.enabled:
+            return
+        if not shutil.which("py-spy"):
+            print("PIPELINE_PROFILE=py-spy but py-spy is not on PATH; skipping profiler")
+            return
+        out = pathlib.Path(self.path).with_name(f"profile_{self.run_id}.svg")
+        self._spy = subprocess.Popen(["py-spy", "record", "--pid", str(os.getpid()), "--threads",
+                                      "--output", str(out)], stdout=subprocess.DEVNULL)
+        self.event("profiler", tool="py-spy", output=str(out))
+
+    def close(self, status: str, duration_sec: float):
+        self.event("run_end", status=status, duration_sec=round(duration_sec, 3), peak_rss_bytes=peak_rss_bytes())
+        if self._spy:
+            self._spy.terminate()
+            self._spy.wait()
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+run = RunRecorder()  # replaced by start_run(); until then every call is a no-op
+
+
+def start_run(run_id: str, directory: str = METRICS_DIR, profile: str = PROFILE) -> RunRecorder:
+    global run
+    pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
+    run = RunRecorder(run_id, os.path.join(directory, f"run_{run_id}.jsonl"), profile)
+    run.event("run_start", pid=os.getpid())
+    run.start_profiler()
+    return run
+
+
+def explain_analyze(cur, sql: str) -> dict:
+    """Run `sql` under EXPLAIN ANALYZE and return the timing part of the plan (the statement's effects persist)."""
+    cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}")
+    plan = cur.fetchone()[0][0]
+    top = plan["Plan"]
+    node = (top.get("Plans") or [top])[0]  # ModifyTable reports 0 rows; its input is what got written
+    return {"planning_ms": plan.get("Planning Time"), "execution_ms": plan.get("Execution Time"),
+            "node": node.get("Node Type"), "rows": node.get("Actual Rows"),
+            "shared_hit_blocks": top.get("Shared Hit Blocks"), "shared_read_blocks": top.get("Shared Read Blocks")}
+
+
+def read_run(path: str) -> List[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def latest_run_file(directory: str = METRICS_DIR) -> Optional[str]:
+    files = sorted(pathlib.Path(directory).glob("run_*.jsonl"), key=lambda p: p.stat().st_mtime)
+    return str(files[-1]) if files else None
+
+
+def summarize(events: Iterable[dict]) -> dict:
+    """Totals of one run: per-stage seconds/rows, HTTP request/byte counts and latency, page writes, uploads."""
+    out = {"run_id": None, "status": "running", "duration_sec": None, "peak_rss_bytes": 0,
+           "stages": {}, "http": {"requests": 0, "bytes": 0, "seconds": 0.0, "by_status": {}},
+           "pages": {"count": 0, "rows": 0, "write_seconds": 0.0},
+           "load": {"count": 0, "rows": 0, "partitions": 0, "upload_bytes": 0, "upload_seconds": 0.0}}
+    for e in events:
+        out["run_id"] = e.get("run_id", out["run_id"])
+        kind = e.get("event")
+        if kind == "stage":
+            out["stages"][e["stage"]] = {"seconds": e["seconds"], "rows": e.get("rows"), "status": e["status"]}
+            out["peak_rss_bytes"] = max(out["peak_rss_bytes"], e.get("peak_rss_bytes", 0))
+        elif kind == "http":
+            h = out["http"]
+            h["requests"] += 1
+            h["bytes"] += e.get("bytes") or 0
+            h["seconds"] += e["seconds"]
+            h["by_status"][str(e["status"])] = h["by_status"].get(str(e["status"]), 0) + 1
+        elif kind == "page":
+            p = out["pages"]
+            p["count"] += 1
+            p["rows"] += e["rows"]
+            p["write_seconds"] += e["write_seconds"]
+        elif kind == "load":
+            ld = out["load"]
+            ld["count"] += 1
+            ld["rows"] += e.get("rows") or 0
+            ld["partitions"] += e.get("partitions") or 0
+            ld["upload_bytes"] += e.get("upload_bytes") or 0
+            ld["upload_seconds"] += e.get("upload_sec") or 0.0
+        elif kind == "run_end":
+            out["status"], out["duration_sec"] = e["status"], e["duration_sec"]
+            out["peak_rss_bytes"] = max(out["peak_rss_bytes"], e.get("peak_rss_bytes", 0))
+    return out
+
+
+def prometheus_lines(summary: dict) -> List[str]:
+    """Prometheus text exposition of a run summary (gauges describing the latest run)."""
+    run_id = summary["run_id"] or ""
+    lab = f'run_id="{run_id}"'
+    lines = ["# TYPE pipeline_run_success gauge",
+             f'pipeline_run_success{{{lab},status="{summary["status"]}"}} {int(summary["status"] == "success")}',
+             "# TYPE pipeline_run_duration_seconds gauge",
+             f"pipeline_run_duration_seconds{{{lab}}} {summary['duration_sec'] or 0}",
+             "# TYPE pipeline_peak_rss_bytes gauge",
+             f"pipeline_peak_rss_bytes{{{lab}}} {summary['peak_rss_bytes']}",
+             "# TYPE pipeline_stage_seconds gauge"]
+    lines += [f'pipeline_stage_seconds{{{lab},stage="{name}"}} {s["seconds"]}'
+              for name, s in summary["stages"].items()]
+    lines.append("# TYPE pipeline_stage_rows gauge")
+    lines += [f'pipeline_stage_rows{{{lab},stage="{name}"}} {s["rows"]}'
+              for name, s in summary["stages"].items() if s["rows"] is not None]
+    h, p, ld = summary["http"], summary["pages"], summary["load"]
+    lines.append("# TYPE pipeline_http_requests gauge")
+    lines += [f'pipeline_http_requests{{{lab},status="{code}"}} {n}' for code, n in sorted(h["by_status"].items())]
+    lines += ["# TYPE pipeline_http_bytes gauge", f"pipeline_http_bytes{{{lab}}} {h['bytes']}",
+              "# TYPE pipeline_http_seconds gauge", f"pipeline_http_seconds{{{lab}}} {round(h['seconds'], 3)}",
+              "# TYPE pipeline_page_writes gauge", f"pipeline_page_writes{{{lab}}} {p['count']}",
+              "# TYPE pipeline_page_write_seconds gauge",
+              f"pipeline_page_write_seconds{{{lab}}} {round(p['write_seconds'], 3)}",
+              "# TYPE pipeline_load_upload_bytes gauge", f"pipeline_load_upload_bytes{{{lab}}} {ld['upload_bytes']}",
+              "# TYPE pipeline_load_rows gauge", f"pipeline_load_rows{{{lab}}} {ld['rows']}"]
+    return lines
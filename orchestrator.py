@@ -1,60 +1,231 @@
-import os, sys, time, logging, pathlib, requests
+"""
+Command line for the pipeline; one subcommand per step, `run` for all of them:
+
+    python orchestrator.py [run] [--resume | --from-cache] [--datasets FILE]   ingest -> transform -> validate -> load
+    python orchestrator.py ingest [--resume | --from-cache | --incremental | --pipelined]
+    python orchestrator.py transform [--full]
+    python orchestrator.py validate [--api]
+    python orchestrator.py load
+
+Without a subcommand it runs everything, which is what run_pipeline.sh does.
+Settings come from the environment (settings.Settings, pipeline.SETTINGS) and
+each step only checks the ones it uses, so `validate` needs no GCP_PROJECT_ID.
+Backends are imported by the steps that use them: `--help` loads no pandas,
+pyarrow or SQLAlchemy, and `validate` no pyarrow or google-cloud-bigquery
+(benchmarks/bench_import.py).
+"""
+import argparse, json, logging, pathlib, sys, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from dotenv import load_dotenv
-from pipeline import stage_to_postgres, simple_clean_transform, load_to_bigquery
+import datasets, metrics
 
-load_dotenv()
-LOG_DIR = pathlib.Path("logs"); LOG_DIR.mkdir(exist_ok=True)
+LOG_DIR = pathlib.Path("logs")
 run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
 LOG_PATH = LOG_DIR / f"pipeline_{run_id}.log"
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)s | %(message)s",
-    handlers=[logging.FileHandler(LOG_PATH), logging.StreamHandler(sys.stdout)],
-)
-
-API_URL = os.getenv("VALIDATION_API_URL", "http://127.0.0.1:8000")
-VALIDATION_ENDPOINT = f"{API_URL}/validate"
+def setup_logging():
+    LOG_DIR.mkdir(exist_ok=True)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s | %(levelname)s | %(message)s",
+        handlers=[logging.FileHandler(LOG_PATH), logging.StreamHandler(sys.stdout)],
+    )
 
 def log_step(step, status="START"):
     logging.info(f"{step} | {status}")
 
-def main():
-    SKIP_INGEST = os.getenv('SKIP_INGEST', '0') == '1'
-    start = time.time()
-    try:
-        if not SKIP_INGEST:
-            log_step("INGEST")
-            staged = stage_to_postgres()
-            log_step("INGEST", f"OK (rows={staged})")
-        else:
-            logging.info("INGEST | SKIPPED")
-
-        log_step("TRANSFORM")
-        simple_clean_transform()
-        log_step("TRANSFORM", "OK")
+def prefix(cfg):
+    # stage names of a --datasets run carry the dataset's name; the default dataset's do not
+    return f"{cfg.name}:" if cfg else ""
 
-        log_step("VALIDATION", "CALL")
-        r = requests.get(VALIDATION_ENDPOINT, timeout=180)
+def run_validation(s):
+    """Submit a validation job and poll until it finishes; returns the ValidationResponse dict."""
+    import requests  # only the API-backed validation talks HTTP
+    jobs_url = f"{s.validation_api_url}/validate/jobs"
+    r = requests.post(jobs_url, timeout=30)
+    r.raise_for_status()
+    job = r.json()
+    logging.info(f"VALIDATION | job={job['job_id']} table_version={job.get('table_version')}")
+    deadline = time.time() + s.validation_timeout
+    while job["status"] in ("queued", "running"):
+        if time.time() > deadline:
+            raise TimeoutError(f"Validation job {job['job_id']} still {job['status']} after {s.validation_timeout}s")
+        time.sleep(s.validation_poll_sec)
+        r = requests.get(f"{jobs_url}/{job['job_id']}", timeout=30)
         r.raise_for_status()
-        res = r.json()
-        overall = res.get("overall_passed", False)
-        logging.info(f"VALIDATION overall={overall} checks={len(res.get('checks', []))}")
-        if not overall:
-            (LOG_DIR / f"validation_{run_id}.json").write_text(r.text)
-            raise RuntimeError("Validation failed. Aborting load.")
+        job = r.json()
+    if job["status"] != "done":
+        raise RuntimeError(f"Validation job {job['job_id']} failed: {job.get('error')}")
+    return job["result"]
 
-        log_step("LOAD_TO_BQ")
-        load_to_bigquery()
-        log_step("LOAD_TO_BQ", "OK")
+def ingest(cfg, args, run):
+    """Stage one dataset (None = the default one); True when it was cleaned on the way (--pipelined)."""
+    import pipeline
+    tag = prefix(cfg)
+    if args.pipelined:
+        import pipelined
+        log_step(f"{tag}INGEST+TRANSFORM", "START (pipelined)")
+        with run.stage(f"{tag}INGEST+TRANSFORM") as st:
+            stats = pipelined.run(cfg)
+            st["rows"] = stats["staged"]
+        log_step(f"{tag}INGEST+TRANSFORM", f"OK (rows={stats['staged']} clean={stats['clean']} "
+                                           f"busy={stats['busy_sec']})")
+        return True
+    if args.incremental:
+        log_step(f"{tag}INGEST", "START (incremental)")
+        with run.stage(f"{tag}INGEST", mode="incremental") as st:
+            new, updated = pipeline.stage_incremental(cfg)
+            st["rows"] = new + updated
+        log_step(f"{tag}INGEST", f"OK (new={new} updated={updated})")
+        return False
+    mode = "cache" if args.from_cache else "resume" if args.resume else "full"
+    log_step(f"{tag}INGEST", f"START ({mode})" if mode != "full" else "START")
+    with run.stage(f"{tag}INGEST", mode=mode) as st:
+        st["rows"] = staged = pipeline.stage_to_postgres(resume=args.resume, from_cache=args.from_cache, cfg=cfg)
+    log_step(f"{tag}INGEST", f"OK (rows={staged})")
+    return False
 
-        duration = round(time.time() - start, 2)
-        logging.info(f"RUN_STATUS=SUCCESS duration_sec={duration} log={LOG_PATH}")
+def transform(cfg, args, run):
+    import pipeline
+    tag = prefix(cfg)
+    log_step(f"{tag}TRANSFORM")
+    with run.stage(f"{tag}TRANSFORM") as st:
+        stats = pipeline.simple_clean_transform(full=args.full, cfg=cfg)
+        st.update(rows=stats["rows"], partitions=stats["partitions"])
+    log_step(f"{tag}TRANSFORM", "OK")
+
+def validate(cfg, args, run):
+    """Validate one clean table; raises when a check fails, after writing the result to logs/."""
+    import pipeline
+    tag = prefix(cfg)
+    # the API validates the default clean table only; other datasets have their own rules
+    api = args.api and cfg is None
+    log_step(f"{tag}VALIDATION", "CALL" if api else "START")
+    with run.stage(f"{tag}VALIDATION") as st:
+        res = run_validation(pipeline.SETTINGS) if api else pipeline.validate_clean(cfg)
+        overall = st["passed"] = res.get("overall_passed", False)
+    logging.info(f"{tag}VALIDATION overall={overall} checks={len(res.get('checks', []))}")
+    if not overall:
+        for c in res["checks"]:
+            if not c["passed"]:
+                logging.error(f"{tag}VALIDATION | {c['name']} FAILED {c.get('details', '')}")
+        LOG_DIR.mkdir(exist_ok=True)
+        (LOG_DIR / f"validation_{run_id}{'_' + cfg.name if cfg else ''}.json").write_text(json.dumps(res, indent=2))
+        raise RuntimeError(f"Validation of {cfg.name if cfg else 'the clean table'} failed. Not loading it.")
+
+def load(cfg, args, run):
+    import pipeline
+    tag = prefix(cfg)
+    log_step(f"{tag}LOAD_TO_BQ")
+    with run.stage(f"{tag}LOAD_TO_BQ") as st:
+        st["rows"] = pipeline.load_to_bigquery(cfg).get("rows")
+    log_step(f"{tag}LOAD_TO_BQ", "OK")
+
+def run_dataset(cfg, args, run):
+    """Ingest -> transform -> validate -> load one dataset; raises on failure."""
+    if args.skip_ingest:
+        logging.info(f"{prefix(cfg)}INGEST | SKIPPED")
+    if args.skip_ingest or not ingest(cfg, args, run):
+        transform(cfg, args, run)
+    validate(cfg, args, run)
+    load(cfg, args, run)
+
+def run_datasets(configs, args, run, workers=None, step=run_dataset):
+    """
+    Run `step` for every dataset, `workers` at a time, over the process's shared
+    connection pool and Socrata rate limit. A failing dataset is logged and
+    reported in the returned {name: error or None} without stopping the others.
+    """
+    if workers is None:
+        import pipeline
+        workers = pipeline.SETTINGS.dataset_workers
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="dataset") as pool:
+        futures = {pool.submit(step, cfg, args, run): cfg.name for cfg in configs}
+        for fut in as_completed(futures):
+            name = futures[fut]
+            try:
+                fut.result()
+                errors[name] = None
+                logging.info(f"{name} | DATASET_STATUS=SUCCESS")
+            except Exception as e:
+                errors[name] = f"{type(e).__name__}: {e}"
+                logging.error(f"{name} | DATASET_STATUS=FAIL error={e}", exc_info=e)
+    run.event("datasets", results={n: ("success" if e is None else "failed") for n, e in errors.items()})
+    return errors
+
+COMMANDS = {"run": run_dataset, "ingest": ingest, "transform": transform, "validate": validate, "load": load}
+
+def parse_args(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0].startswith("-") and argv[0] not in ("-h", "--help"):
+        argv.insert(0, "run")  # the bare `python orchestrator.py [--resume ...]` of cron runs
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--datasets", default=None,
+                        help="JSON list of dataset configs (see datasets.py) to run instead of DATASET_ID "
+                             "(default: DATASETS_FILE)")
+    fetching = argparse.ArgumentParser(add_help=False)
+    fetching.add_argument("--resume", action="store_true",
+                          help="continue an interrupted full load from its last checkpointed page")
+    fetching.add_argument("--from-cache", action="store_true",
+                          help="rebuild staging from the page cache (PAGE_CACHE_DIR) without touching the network")
+    fetching.add_argument("--incremental", action="store_true",
+                          help="fetch only rows updated since the last run (default: INCREMENTAL=1)")
+    fetching.add_argument("--pipelined", action="store_true",
+                          help="full reload with fetch/stage/clean overlapped (default: PIPELINED=1)")
+
+    ap = argparse.ArgumentParser(description="Ingest -> transform -> validate -> load")
+    sub = ap.add_subparsers(dest="command", metavar="command")
+    p = sub.add_parser("run", parents=[common, fetching], help="every step, in order (the default)")
+    p.add_argument("--skip-ingest", action="store_true", help="start at transform (default: SKIP_INGEST=1)")
+    p.add_argument("--no-api", dest="api", action="store_false",
+                   help="validate in-process instead of through the validation API")
+    sub.add_parser("ingest", parents=[common, fetching], help="Socrata -> Postgres staging")
+    p = sub.add_parser("transform", parents=[common], help="rebuild the dirty partitions of the clean table")
+    p.add_argument("--full", action="store_true", help="rebuild every partition")
+    p = sub.add_parser("validate", parents=[common], help="run the validation rules over the clean table")
+    p.add_argument("--api", action="store_true", help="submit a job to the validation API instead")
+    sub.add_parser("load", parents=[common], help="clean table -> BigQuery (or LOAD_TARGET_DIR)")
+    args = ap.parse_args(argv)
+    for name, default in (("resume", False), ("from_cache", False), ("incremental", False), ("pipelined", False),
+                          ("skip_ingest", False), ("full", False), ("api", False)):
+        if not hasattr(args, name):
+            setattr(args, name, default)
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging()
+    import pipeline
+    s = pipeline.SETTINGS
+    args.datasets = args.datasets or s.datasets_file
+    args.skip_ingest = args.skip_ingest or s.skip_ingest
+    if args.command in ("run", "ingest"):
+        # a cache replay is always a full load through stage_to_postgres
+        args.incremental = (args.incremental or s.incremental) and not args.from_cache
+        args.pipelined = (args.pipelined or s.pipelined) and not args.from_cache
+    step = COMMANDS[args.command]
+    start = time.time()
+    run = metrics.start_run(run_id, str(LOG_DIR))
+    logging.info(f"RUN | command={args.command} metrics={run.path}")
+    try:
+        if args.datasets:
+            configs = datasets.load_configs(args.datasets)
+            logging.info(f"RUN | datasets={','.join(c.name for c in configs)} workers={s.dataset_workers}")
+            errors = run_datasets(configs, args, run, step=step)
+            failed = sorted(n for n, e in errors.items() if e)
+            if failed:
+                raise RuntimeError(f"{len(failed)} of {len(configs)} dataset(s) failed: {','.join(failed)}")
+        else:
+            step(None, args, run)
     except Exception as e:
         duration = round(time.time() - start, 2)
+        run.close("failed", duration)
         logging.exception(f"RUN_STATUS=FAIL duration_sec={duration} error={e} log={LOG_PATH}")
         sys.exit(1)
+    duration = round(time.time() - start, 2)
+    run.close("success", duration)
+    logging.info(f"RUN_STATUS=SUCCESS command={args.command} duration_sec={duration} log={LOG_PATH}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,145 @@
+"""
+On-disk cache of raw Socrata pages, for replays that skip the network.
+
+A page is one Arrow IPC file (zstd-compressed by default) at
+
+    <root>/<dataset_id>/<version>/p<page_size>_o<offset>_n<rows>.arrow
+
+where <version> comes from the dataset's last-modified time, so an updated
+dataset never replays stale pages. A `complete_p<page_size>.json` marker is
+written once every page of a version, from offset 0 to the end, is on disk;
+only complete versions can be replayed without the network. Reads go
+through a memory map (zero-copy with PAGE_CACHE_COMPRESSION=none). Once the
+whole cache grows past `max_bytes`, the least recently used page files are
+evicted, and so are the complete markers they belonged to.
+"""
+import hashlib, json, os, re
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, Optional, Tuple
+import pandas as pd
+import pyarrow as pa
+
+_PAGE = re.compile(r"^p(\d+)_o(\d+)_n(\d+)\.arrow$")
+
+
+class PageCache:
+    def __init__(self, root: str, dataset_id: str, page_size: int, max_bytes: int = 0, compression: str = "zstd"):
+        self.root, self.dataset_id, self.page_size = root, dataset_id, page_size
+        self.max_bytes = max_bytes  # 0 = unbounded
+        self.options = pa.ipc.IpcWriteOptions(compression=None if compression == "none" else compression)
+
+    @staticmethod
+    def version(last_modified: Optional[str]) -> Optional[str]:
+        """Directory name for a Last-Modified value: epoch seconds for HTTP dates, else a digest."""
+        if not last_modified:
+            return None
+        try:
+            return str(int(parsedate_to_datetime(last_modified).timestamp()))
+        except (TypeError, ValueError):
+            return "h" + hashlib.md5(last_modified.encode()).hexdigest()[:12]
+
+    def _dir(self, version: str) -> str:
+        return os.path.join(self.root, self.dataset_id, version)
+
+    def _marker(self, version: str) -> str:
+        return os.path.join(self._dir(version), f"complete_p{self.page_size}.json")
+
+    def pages(self, version: str) -> Dict[int, Tuple[str, int]]:
+        """offset -> (path, rows) of the cached pages of `version` at this page size."""
+        try:
+            names = os.listdir(self._dir(version))
+        except FileNotFoundError:
+            return {}
+        out = {}
+        for name in names:
+            m = _PAGE.match(name)
+            if m and int(m.group(1)) == self.page_size:
+                out[int(m.group(2))] = (os.path.join(self._dir(version), name), int(m.group(3)))
+        return out
+
+    def get(self, path: str) -> pd.DataFrame:
+        with pa.memory_map(path) as source:
+            df = pa.ipc.open_file(source).read_all().to_pandas()
+        os.utime(path)  # mtime doubles as the LRU clock
+        return df
+
+    def replay(self, version: str, start_offset: int = 0) -> Iterator[Tuple[int, pd.DataFrame]]:
+        """Yield (offset, frame) for the contiguous run of cached pages starting at `start_offset`."""
+        pages, offset = self.pages(version), start_offset
+        while offset in pages:
+            path, rows = pages[offset]
+            yield offset, self.get(path)
+            if rows < self.page_size:
+                break
+            offset += rows
+
+    def on_boundary(self, version: str, offset: int) -> bool:
+        """Whether `offset` starts a cached page of `version` (or is just past its last page)."""
+        pages = self.pages(version)
+        return offset in pages or offset == max((o + n for o, (_, n) in pages.items()), default=0)
+
+    def put(self, version: str, offset: int, df: pd.DataFrame) -> bool:
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:  # e.g. nested values in a non-CDC dataset
+            print(f"  !! page at offset={offset} not cached: {e}")
+            return False
+        os.makedirs(self._dir(version), exist_ok=True)
+        path = os.path.join(self._dir(version), f"p{self.page_size}_o{offset:012d}_n{len(df)}.arrow")
+        tmp = path + ".tmp"
+        with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema, options=self.options) as writer:
+            writer.write_table(table)
+        os.replace(tmp, path)
+        self.evict(keep=path)
+        return True
+
+    def mark_complete(self, version: str) -> bool:
+        """After the source ran out: mark `version` complete if its pages from offset 0 have no gaps."""
+        pages, offset, walked, rows = self.pages(version), 0, 0, 0
+        while offset in pages:
+            n = pages[offset][1]
+            walked, rows = walked + 1, rows + n
+            if n < self.page_size:
+                break
+            offset += n
+        if not walked or walked != len(pages):  # a page was evicted or never cached
+            return False
+        with open(self._marker(version), "w") as f:
+            json.dump({"pages": walked, "rows": rows}, f)
+        return True
+
+    def is_complete(self, version: str) -> bool:
+        return os.path.exists(self._marker(version))
+
+    def latest_complete(self) -> Optional[str]:
+        """Most recently completed cached version of the dataset at this page size."""
+        try:
+            versions = os.listdir(os.path.join(self.root, self.dataset_id))
+        except FileNotFoundError:
+            return None
+        done = [v for v in versions if self.is_complete(v)]
+        return max(done, key=lambda v: os.path.getmtime(self._marker(v))) if done else None
+
+    def evict(self, keep: Optional[str] = None):
+        """Delete least recently used page files (any dataset under root) until the cache fits max_bytes."""
+        if not self.max_bytes:
+            return
+        files = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                if _PAGE.match(name):
+                    path = os.path.join(dirpath, name)
+                    st = os.stat(path)
+                    files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            total -= size
+            page_size = _PAGE.match(os.path.basename(path)).group(1)
+            marker = os.path.join(os.path.dirname(path), f"complete_p{page_size}.json")
+            if os.path.exists(marker):
+                os.remove(marker)
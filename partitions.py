@@ -0,0 +1,239 @@
+"""
+The clean table, LIST-partitioned by case_month.
+
+There is one partition per month plus a DEFAULT partition for rows without a
+month. `rebuild` cleans each partition on its own connection into a standalone
+unlogged table that already carries the partition's CHECK constraint and
+indexes, so ATTACH skips the validation scan and reuses the indexes. All new
+partitions are then swapped into the parent in one transaction. Incremental
+runs pass only the months whose staging rows changed; the other partitions
+are left untouched. With CLEAN_BACKEND=arrow the partitions are cleaned in
+Python by arrow_clean.py instead of by an INSERT ... SELECT. Columns whose
+rule is `encoded` are Postgres enums (encoding.py), whose labels are added
+before any partition is built.
+"""
+import hashlib, os, re, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import cleaning, encoding, metrics, state
+
+PARTITION_KEY = "case_month"
+INDEXED_COLUMNS = ["res_state"]  # filtered by validation rules; case_month is covered by pruning
+CLEAN_WORKERS = int(os.getenv("CLEAN_WORKERS", "4"))  # partitions cleaned concurrently
+CLEAN_BACKEND = os.getenv("CLEAN_BACKEND", "sql")     # "sql" (INSERT ... SELECT) | "arrow" (arrow_clean.py)
+DEFAULT = None  # key of the default partition (rows with no case_month)
+
+_BOUND = re.compile(r"FOR VALUES IN \('((?:[^']|'')*)'\)")
+
+
+def sort_keys(keys: Iterable[Optional[str]]) -> List[Optional[str]]:
+    return sorted(set(keys), key=lambda k: (k is DEFAULT, k or ""))
+
+
+def partition_name(table: str, key: Optional[str]) -> str:
+    if key is DEFAULT:
+        return f"{table}_pdefault"
+    if re.fullmatch(cleaning.MONTH_PATTERN, key):
+        return f"{table}_p{key.replace('-', '_')}"
+    return f"{table}_px{hashlib.md5(key.encode()).hexdigest()[:12]}"  # malformed months still get a stable name
+
+
+def column_ddl(columns: List[str], types: Optional[Dict[str, str]] = None) -> str:
+    return ", ".join(f"{c} {(types or {}).get(c, 'text')}" for c in columns)
+
+
+def parent_ddl(table: str, columns: List[str], types: Optional[Dict[str, str]] = None) -> str:
+    cols = column_ddl(columns, types)
+    ddl = f"CREATE TABLE {table} ({cols}) PARTITION BY LIST ({PARTITION_KEY});"
+    return ddl + "".join(f"CREATE INDEX {table}_{c}_idx ON {table} ({c});" for c in INDEXED_COLUMNS if c in columns)
+
+
+def bound_sql(key: Optional[str]) -> str:
+    return "DEFAULT" if key is DEFAULT else f"FOR VALUES IN ({cleaning._lit(key)})"
+
+
+def check_sql(key: Optional[str]) -> str:
+    # implies the partition bound, so ATTACH can skip scanning the partition (and the default one)
+    k = PARTITION_KEY
+    return f"{k} IS NULL" if key is DEFAULT else f"{k} IS NOT NULL AND {k} = {cleaning._lit(key)}"
+
+
+def source_filter(key: Optional[str]) -> str:
+    """Raw staging rows whose clean case_month (NULLIF(case_month, '')) is `key`."""
+    k = PARTITION_KEY
+    return f"({k} IS NULL OR {k} = '')" if key is DEFAULT else f"{k} = {cleaning._lit(key)}"
+
+
+def changed_keys_sql(target: str, delta: str, key: str = "row_id") -> str:
+    """Partition keys touched by upserting `delta` into `target`: new values and the ones being replaced."""
+    k = PARTITION_KEY
+    return (f"SELECT NULLIF({k}, '') FROM {delta}\n"
+            f"UNION SELECT NULLIF(t.{k}, '') FROM {target} t JOIN {delta} d USING ({key});")
+
+
+def table_columns(cur, table: str) -> List[str]:
+    cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s ORDER BY ordinal_position;",
+                (table,))
+    return [r[0] for r in cur.fetchall()]
+
+
+def table_types(cur, table: str) -> Dict[str, str]:
+    """column -> type name ("text" or an enum) of `table`, in column order."""
+    cur.execute("SELECT column_name, udt_name FROM information_schema.columns WHERE table_name = %s "
+                "ORDER BY ordinal_position;", (table,))
+    return dict(cur.fetchall())
+
+
+def attached_oids(cur, table: str) -> Optional[Dict[Optional[str], int]]:
+    """
+    key -> oid of `table`'s partitions, or None when `table` is missing or not
+    partitioned. rebuild swaps in a new table for every partition it rebuilds,
+    so a partition's oid changes exactly when its rows may have.
+    """
+    cur.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s));", (table,))
+    if not cur.fetchone()[0]:
+        return None
+    cur.execute("""
+        SELECT pg_get_expr(c.relpartbound, c.oid), c.oid FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s);
+    """, (table,))
+    return {DEFAULT if b == "DEFAULT" else _BOUND.fullmatch(b).group(1).replace("''", "'"): int(oid)
+            for b, oid in cur.fetchall()}
+
+
+def attached_keys(cur, table: str) -> Optional[List[Optional[str]]]:
+    """Keys of `table`'s partitions, or None when `table` is missing or not partitioned."""
+    oids = attached_oids(cur, table)
+    return None if oids is None else list(oids)
+
+
+def staged_keys(cur, source: str, present: Iterable[str]) -> List[Optional[str]]:
+    if PARTITION_KEY not in set(present):
+        return [DEFAULT]
+    cur.execute(f"SELECT DISTINCT NULLIF({PARTITION_KEY}, '') FROM {source};")
+    return [r[0] for r in cur.fetchall()]
+
+
+def build_partition(cur, source: str, table: str, present: Iterable[str], key: Optional[str],
+                    distinct: bool = True, rules=cleaning.CLEAN_COLUMNS, filters=cleaning.CLEAN_FILTERS,
+                    backend: str = "sql", types: Optional[Dict[str, str]] = None) -> int:
+    """
+    Clean one partition's rows into `<partition>__build` with `backend`; returns
+    its row count. `types` are the column types (encoding.column_types; TEXT if absent).
+    """
+    present = set(present)
+    columns = [r.name for r in cleaning.output_columns(present, rules)]
+    build = partition_name(table, key) + "__build"
+    where = source_filter(key) if PARTITION_KEY in present else None
+    cur.execute(f"DROP TABLE IF EXISTS {build};"
+                f"CREATE UNLOGGED TABLE {build} ({column_ddl(columns, types)}, CHECK ({check_sql(key)}));")
+    select = cleaning.select_sql(source, present, rules, filters, distinct=distinct, where=where)
+    casts = {c: t for c, t in (types or {}).items() if t != "text"}
+    if casts:  # text only casts to an enum explicitly
+        select = f"SELECT {', '.join(f'{c}::{casts[c]}' if c in casts else c for c in columns)} FROM (\n{select}\n) c"
+    insert = f"INSERT INTO {build} ({', '.join(columns)})\n{select}"
+    t0 = time.perf_counter()
+    if backend == "arrow":
+        import arrow_clean  # heavy import (pyarrow), only needed for the arrow backend
+        plan = dict(arrow_clean.copy_clean(cur, source, build, present, where, distinct, rules, filters),
+                    backend=backend)
+        rows = plan.pop("rows")
+    elif backend != "sql":
+        raise ValueError(f"unknown clean backend {backend!r}")
+    elif metrics.EXPLAIN:
+        plan = metrics.explain_analyze(cur, insert)
+        rows = plan.pop("rows")
+    else:
+        cur.execute(insert)
+        rows, plan = cur.rowcount, {}
+    metrics.run.event("statement", stage="transform", name="clean_partition", table=table, partition=key,
+                      rows=rows, seconds=round(time.perf_counter() - t0, 4), **plan)
+    for c in INDEXED_COLUMNS:
+        if c in columns:
+            cur.execute(f"CREATE INDEX {build}_{c}_idx ON {build} ({c});")
+    return rows
+
+
+def rebuild(engine, source: str, table: str, present: Iterable[str], keys=None,
+            workers: int = CLEAN_WORKERS, distinct: bool = True, finalize=None,
+            rules=cleaning.CLEAN_COLUMNS, filters=cleaning.CLEAN_FILTERS, backend: str = CLEAN_BACKEND) -> dict:
+    """
+    Rebuild the partitions of `table` for `keys` (every month in `source` when None,
+    or when `table` is not yet a partitioned table with this column set) from
+    `source`, `workers` partitions at a time, then swap them in within one
+    transaction that also bumps the table's version and runs `finalize(cur)`.
+    Partitions that come out empty are dropped. Pass distinct=False when `source`
+    already holds each clean row only once (fingerprinted staging). `rules` and
+    `filters` are the cleaning rule set (cleaning.py); `backend` is "sql" or "arrow".
+    """
+    present = set(present)
+    columns = [r.name for r in cleaning.output_columns(present, rules)]
+    with engine.begin() as conn:  # commits new enum labels before the builds use them
+        cur = conn.connection.cursor()
+        existing = attached_keys(cur, table)
+        current = table_types(cur, table) if existing is not None else {}
+        if existing is not None and list(current) != columns:
+            existing = None  # the staging schema changed: start a new parent table
+        if keys is None or existing is None:
+            keys = staged_keys(cur, source, present) + (existing or [])
+            types = encoding.column_types(cur, source, present, rules)
+        elif keys:
+            where = " OR ".join(source_filter(k) for k in keys) if PARTITION_KEY in present else None
+            types = encoding.column_types(cur, source, present, rules, where,
+                                          keep_text=[c for c, t in current.items() if t == "text"])
+            if types != current:  # new values no longer fit an enum: every partition needs the new type
+                keys = staged_keys(cur, source, present) + existing
+                types = encoding.column_types(cur, source, present, rules)
+        else:
+            types = current
+        if types != current:
+            existing = None  # a column changed type: start a new parent table
+    keys = sort_keys(keys)
+    if not keys:
+        print(f"No changed partitions; {table} is up to date.")
+        return {"partitions": 0, "rows": 0, "full": False, "build_sec": 0.0, "swap_sec": 0.0, "version": None}
+
+    def build(key):
+        with engine.begin() as conn:
+            return build_partition(conn.connection.cursor(), source, table, present, key, distinct, rules, filters,
+                                   backend, types)
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="clean") as pool:
+            counts = dict(zip(keys, pool.map(build, keys)))
+        build_sec = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with engine.begin() as conn:
+            cur = conn.connection.cursor()
+            if existing is None:
+                cur.execute(f"DROP TABLE IF EXISTS {table};")
+                cur.execute(parent_ddl(table, columns, types))
+            for key in keys:
+                part = partition_name(table, key)
+                cur.execute(f"DROP TABLE IF EXISTS {part};")
+                if not counts[key]:
+                    cur.execute(f"DROP TABLE {part}__build;")
+                    continue
+                cur.execute(f"ALTER TABLE {part}__build RENAME TO {part};")
+                for c in INDEXED_COLUMNS:
+                    if c in columns:
+                        cur.execute(f"ALTER INDEX {part}__build_{c}_idx RENAME TO {part}_{c}_idx;")
+                cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {part} {bound_sql(key)};")
+            version = state.bump_table_version(cur, table)
+            if finalize:
+                finalize(cur)
+        swap_sec = time.perf_counter() - start
+        metrics.run.event("statement", stage="transform", name="swap_partitions", table=table,
+                          partitions=len(keys), seconds=round(swap_sec, 4))
+    except BaseException:
+        with engine.begin() as conn:  # leave the current partitions in place
+            cur = conn.connection.cursor()
+            for key in keys:
+                cur.execute(f"DROP TABLE IF EXISTS {partition_name(table, key)}__build;")
+        raise
+
+    return {"partitions": len(keys), "rows": sum(counts.values()), "full": existing is None,
+            "build_sec": round(build_sec, 3), "swap_sec": round(swap_sec, 3), "version": version}
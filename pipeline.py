@@ -1,227 +1,496 @@
-import os, time, math, requests, pandas as pd
-from urllib.parse import urlencode
-from sqlalchemy import create_engine, text
-from dotenv import load_dotenv
-from google.cloud import bigquery
-
-load_dotenv()
-
-CDC_DOMAIN = os.getenv("CDC_DOMAIN", "data.cdc.gov").strip()
-DATASET_ID = os.getenv("DATASET_ID", "").strip()       
-PAGE_SIZE  = int(os.getenv("CDC_PAGE_SIZE", "50000"))
-SOCRATA_APP_TOKEN = os.getenv("SOCRATA_APP_TOKEN", "").strip()
-
-PG_HOST = os.getenv("PG_HOST", "localhost")
-PG_PORT = int(os.getenv("PG_PORT", "5433"))
-PG_USER = os.getenv("PG_USER", "ph")
-PG_PASSWORD = os.getenv("PG_PASSWORD", "ph")
-PG_DB = os.getenv("PG_DB", "public_health")
-
-GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID")
-BQ_DATASET = os.getenv("BQ_DATASET", "public_health")
-BQ_TABLE   = os.getenv("BQ_TABLE",   "cdc_state_cases")
-
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "")
-
-STAGING_TABLE = "stg_cdc_raw"
-CLEAN_TABLE   = "stg_cdc_clean"
-
-assert DATASET_ID, "Set DATASET_ID in .env (e.g., n8mc-b4w4)"
-assert GCP_PROJECT_ID, "Set GCP_PROJECT_ID in .env"
-
-MAX_ROWS = int(os.getenv('MAX_ROWS','0'))
+import hashlib, json, time
+from functools import lru_cache
+from itertools import islice
+from sqlalchemy import create_engine
+import cleaning, datasets, metrics, partitions, settings, socrata, staging, state, validation_partials
+from validation_rules import evaluate
+
+# read at call time, so tests and benchmarks swap in SETTINGS.replace(...) copies
+SETTINGS = settings.Settings.from_env()
+
+DELTA_TABLE = "stg_cdc_delta"           # session-local temp table for incremental runs
+BATCH_TABLE = "stg_cdc_batch"           # session-local temp table: one full-load page, fingerprinted on COPY
+# pipeline_state keys, per staging table: configs that share a Socrata dataset keep their own state
+WATERMARK_KEY = "source_updated_at:{}"      # the ingest watermark
+DIRTY_KEY = "clean_dirty_partitions:{}"     # JSON list of case_months to re-clean, "*" = all
+
+def default_config():
+    """The one dataset the settings describe; other datasets pass their own DatasetConfig."""
+    SETTINGS.require("dataset_id")
+    return datasets.DatasetConfig(name="cdc", dataset_id=SETTINGS.dataset_id, staging_table=SETTINGS.staging_table,
+                                  clean_table=SETTINGS.clean_table, bq_table=SETTINGS.bq_table,
+                                  staging_columns=SETTINGS.staging_columns)
+
+def retry_policy():
+    return socrata.RetryPolicy(retries=SETTINGS.max_retries, backoff=SETTINGS.backoff_base)
+
+def soql_params(where=None, cfg=None):
+    # :id/:updated_at ride along for upserts and the watermark; ordering by :id
+    # keeps offsets stable between pages. Only a config that lists its columns
+    # selects them by name: Socrata rejects unknown ones, and other datasets lack
+    # some of the default CDC columns.
+    staged = (cfg or default_config()).staging_columns
+    system = set(staging.SYSTEM_COLUMNS.values())
+    columns = ["*"] if staged == datasets.DEFAULT_COLUMNS else [c for c in staged if c not in system]
+    params = {"$select": ",".join([":id", ":updated_at"] + columns), "$order": ":id"}
+    if where:
+        params["$where"] = where
+    return params
+
+def fetch_controller(adapt_page_size=True):
+    """A socrata.FetchController from the CDC_* settings, or None with CDC_ADAPTIVE_FETCH=0."""
+    if not SETTINGS.adaptive_fetch:
+        return None
+    s = SETTINGS
+    return socrata.FetchController(s.page_size, s.fetch_workers, max_workers=max(s.max_fetch_workers, s.fetch_workers),
+                                   min_page_size=s.min_page_size, max_page_size=s.max_page_size,
+                                   target_latency=s.target_latency, adapt_page_size=adapt_page_size)
+
+def report_fetch_tuning(controller, dataset_id):
+    if controller is None:
+        return
+    r = controller.report()
+    status = "settled at" if r["measured"] else "was still probing at"
+    print(f"Fetch {status} page size {r['page_size']:,} with {r['window']} in flight "
+          f"(best ~{r['best_rows_per_sec']:,} rows/s at {r['best_page_size']:,} x {r['best_window']}).")
+    metrics.run.event("fetch_settings", dataset_id=dataset_id, **r)
 
-def fetch_paginated():
+def fetch_paginated(where=None, start_offset=0, from_cache=False, cfg=None, profile=None):
     """
     Stream the dataset page-by-page until an empty page is returned.
     Avoids $select=count(1) so it works even when count isn't available.
+    With CDC_FETCH_WORKERS > 1 several offset windows are fetched concurrently;
+    pages are still yielded in offset order. `where` is a SoQL $where filter;
+    `start_offset` skips rows already staged by an interrupted run.
+    With PAGE_CACHE_DIR set, full-load pages are served from and written to
+    the page cache; `from_cache` replays it without any network request.
+    Low-cardinality columns arrive as categoricals (encoding.categorize).
+    Every yielded page is also added to `profile` (data_profile.Profile).
     """
-    headers = {}
-    if SOCRATA_APP_TOKEN:
-        headers["X-App-Token"] = SOCRATA_APP_TOKEN
+    cfg = cfg or default_config()
+    dataset_id = cfg.dataset_id
+    cache = None
+    if SETTINGS.page_cache_dir and where is None:
+        import page_cache  # heavy import (pyarrow), only needed with the page cache
+        # pages hold the selected columns: configs sharing a dataset share its cache only if those match
+        select = hashlib.md5(soql_params(cfg=cfg)["$select"].encode()).hexdigest()[:8]
+        cache = page_cache.PageCache(SETTINGS.page_cache_dir, f"{dataset_id}_{select}", SETTINGS.page_size,
+                                     SETTINGS.page_cache_max_bytes, SETTINGS.page_cache_compression)
+    elif from_cache:
+        raise RuntimeError("Replaying from cache needs PAGE_CACHE_DIR (and a full load)")
+    pages = replay_cache(cache, start_offset) if from_cache else fetch_pages(cache, dataset_id, where, start_offset, cfg)
 
-    offset = 0
-    page = 1
     total_rows = 0
-    while True:
-        params = {"$limit": PAGE_SIZE, "$offset": offset}
-        url = f"https://{CDC_DOMAIN}/resource/{DATASET_ID}.json?{urlencode(params)}"
-        print(f"Fetching page {page} (offset={offset}) …")
-        r = requests.get(url, headers=headers, timeout=120)
-        # If the dataset ID is wrong or restricted, raise now with helpful message
-        try:
-            r.raise_for_status()
-        except requests.HTTPError as e:
-            print(f"HTTP error from Socrata API: {e}\nURL: {url}\nResponse: {r.text[:400]} …")
-            raise
-
-        rows = r.json()
-        if not rows:
-            print("No more data; stopping pagination.")
-
-
-        df = pd.DataFrame(rows)
-        total_rows += len(df)
-        print(f"  -> got {len(df):,} rows (running total {total_rows:,})")
-        if MAX_ROWS and total_rows >= MAX_ROWS:
-            over = total_rows - MAX_ROWS
-            if over > 0:
-                df = df.iloc[:-over]
-            yield df
-            print(f'Reached MAX_ROWS={MAX_ROWS}. Stopping pagination.')
-            break
-        if MAX_ROWS and total_rows >= MAX_ROWS:
-            over = total_rows - MAX_ROWS
-            if over > 0:
-                df = df.iloc[:-over]
+    try:
+        for page, (offset, df, cached) in enumerate(pages, 1):
+            total_rows += len(df)
+            print(f"{'Replayed' if cached else 'Fetched'} page {page} (offset={offset}) -> {len(df):,} rows "
+                  f"(running total {total_rows:,})")
+            if SETTINGS.max_rows and total_rows >= SETTINGS.max_rows:
+                over = total_rows - SETTINGS.max_rows
+                if over > 0:
+                    df = df.iloc[:-over]
+                if profile is not None:
+                    profile.add_frame(df)
+                yield df
+                print(f'Reached MAX_ROWS={SETTINGS.max_rows}. Stopping pagination.')
+                break
+            if profile is not None:
+                profile.add_frame(df)
             yield df
+        else:
+            print("No more data; stopping pagination.")
+    finally:
+        pages.close()
+
+def replay_cache(cache, start_offset=0):
+    version = cache.latest_complete()
+    if version is None:
+        raise RuntimeError(f"No complete page cache for {cache.dataset_id} (page size {SETTINGS.page_size}) "
+                           f"in {SETTINGS.page_cache_dir}")
+    if not cache.on_boundary(version, start_offset):
+        raise RuntimeError(f"Offset {start_offset:,} is not a page boundary of the cached {cache.dataset_id} "
+                           f"(page size {SETTINGS.page_size}); rerun without --from-cache or without --resume")
+    print(f"Replaying {cache.dataset_id} from the page cache (version {version})")
+    for offset, df in cache.replay(version, start_offset):
+        yield offset, df, True
+
+def fetch_pages(cache, dataset_id, where=None, start_offset=0, cfg=None):
+    """(offset, frame, cached) pages from the network; cached pages of the current version are read from disk."""
+    import pandas as pd, encoding  # heavy imports, only needed to fetch
+    limiter = get_limiter(SETTINGS.rate_limit)
+    controller = fetch_controller(adapt_page_size=cache is None)  # cached pages are keyed by page size
+    session = socrata.make_session(controller.max_workers if controller else SETTINGS.fetch_workers,
+                                   SETTINGS.socrata_app_token)
+    pages = None
+    try:
+        version = None
+        if cache:
+            version = cache.version(socrata.last_modified(session, SETTINGS.cdc_base_url, dataset_id, limiter,
+                                                          retry_policy()))
+            if version is None:
+                print("Socrata sent no last-modified time; page cache not used this run.")
+            elif not cache.on_boundary(version, start_offset):
+                # pages fetched from here would not line up with the cached ones
+                print(f"  !! offset {start_offset:,} is not a cached page boundary; fetching live, page cache "
+                      "not used this run.")
+                version = None
+        offset = start_offset
+        if version:
+            for offset, df in cache.replay(version, start_offset):
+                yield offset, df, True
+                offset += len(df)
+            if cache.is_complete(version):
+                return
+        pages = socrata.iter_pages(
+            SETTINGS.cdc_base_url, dataset_id, SETTINGS.page_size,
+            workers=SETTINGS.fetch_workers, limiter=limiter, session=session, params=soql_params(where, cfg),
+            start_offset=offset, retry=retry_policy(), controller=controller,
+        )
+        for offset, rows in pages:
+            df = encoding.categorize(pd.DataFrame(rows))  # low-cardinality columns as categoricals
+            if version:
+                cache.put(version, offset, df)
+            yield offset, df, False
+        if version and cache.mark_complete(version):
+            print(f"Page cache for {dataset_id} version {version} is complete.")
+    finally:
+        if pages is not None:
+            pages.close()
+            report_fetch_tuning(controller, dataset_id)
+        session.close()
+
+def new_profile():
+    """A data_profile.Profile to fill while ingesting, or None with DATA_PROFILE=0."""
+    if not SETTINGS.data_profile:
+        return None
+    import data_profile  # heavy import (pandas), only needed while ingesting
+    return data_profile.Profile()
+
+def save_profile(cfg, profile, mode):
+    """Store the run's column profile; the validation API compares it with the previous run of the same table."""
+    if profile is None or not profile.rows:
+        return
+    import data_profile
+    run_id = metrics.run.run_id or data_profile.new_run_id()
+    with get_pg_engine().begin() as conn:
+        data_profile.save(conn.connection.cursor(), cfg.dataset_id, cfg.staging_table, run_id, mode, profile)
+    print(f"Profiled {profile.rows:,} rows x {len(profile.columns)} columns in {profile.seconds:.2f}s "
+          f"(run {run_id}, {mode}).")
+    metrics.run.event("data_profile", dataset_id=cfg.dataset_id, table=cfg.staging_table, profile_run=run_id,
+                      mode=mode, rows=profile.rows, columns=len(profile.columns), seconds=round(profile.seconds, 3))
 
-        yield df
-
-        yield df
-
-        offset += PAGE_SIZE
-        page += 1
-        time.sleep(0.5)  # be polite
-
+@lru_cache(maxsize=None)
 def get_pg_engine():
-    conn = f"postgresql+psycopg2://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}"
-    return create_engine(conn, pool_pre_ping=True)
+    # one engine (and bounded connection pool) per process, shared by every dataset it runs
+    return create_engine(SETTINGS.pg_url, pool_pre_ping=True, pool_size=SETTINGS.pg_pool_size, max_overflow=0,
+                         pool_timeout=SETTINGS.pg_pool_timeout)
 
-def stage_to_postgres():
-    with get_pg_engine().begin() as conn:
-        conn.execute(text(f"DROP TABLE IF EXISTS {STAGING_TABLE};"))
+@lru_cache(maxsize=None)
+def get_limiter(rate):
+    # one token bucket per process: concurrent datasets share the Socrata request rate
+    return socrata.TokenBucket(rate)
 
-    total_rows = 0
-    for df in fetch_paginated():
-        if df.empty:
-            continue
-        # normalize column names
-        df.columns = [c.strip().lower().replace(" ", "_") for c in df.columns]
-        df.to_sql(STAGING_TABLE, get_pg_engine(), if_exists="append", index=False)
-        total_rows += len(df)
-        print(f"  -> staged {len(df):,} rows (running total: {total_rows:,})")
-
-    print(f"Staged total rows to Postgres: {total_rows:,}")
+def stage_to_postgres(resume=False, from_cache=False, cfg=None):
+    """
+    Full load into staging. Every page commits together with its checkpoint row
+    (state.ingest_checkpoints), so with `resume=True` a run that died mid-way
+    keeps what it staged and continues after the last committed page.
+    `from_cache=True` rebuilds staging from the page cache alone.
+    """
+    cfg = cfg or default_config()
+    if SETTINGS.ingest_mode == "stream" and not from_cache:  # streamed CSV pages bypass the page cache
+        return stream_to_postgres(resume, cfg)
+    import pandas as pd  # heavy import, only needed for DataFrame pages
+    writer = batch_writer(cfg)
+    profile = new_profile()
+    total_rows = total_dups = 0
+    try:
+        start = begin_full_load(writer, cfg, resume)
+        for df in fetch_paginated(start_offset=start, from_cache=from_cache, cfg=cfg, profile=profile):
+            if df.empty:
+                continue
+            t0 = time.perf_counter()
+            n = writer.write_frame(df, commit=False)
+            dups = stage_batch(writer, cfg)
+            digest = hashlib.sha256(pd.util.hash_pandas_object(df, index=False).values.tobytes()).hexdigest()
+            checkpoint(writer, cfg, start + total_rows, n, digest)
+            metrics.run.page("ingest", start + total_rows, n, time.perf_counter() - t0, duplicates=dups,
+                             dataset=cfg.name)
+            total_rows += n
+            total_dups += dups
+            print(f"  -> staged {n - dups:,} rows, {dups:,} duplicate(s) (running total: {total_rows:,})")
+        finish_full_load(writer, cfg)
+    finally:
+        writer.close()
+
+    print(f"Staged total rows to Postgres: {total_rows:,} ({total_dups:,} duplicates)")
+    save_profile(cfg, profile, "resume" if resume else "full")  # a resumed load profiles the rest only
     return total_rows
 
+class HashingRows:
+    """Passes rows through while hashing them, for the checkpoint of a streamed page."""
 
-def simple_clean_transform():
-    with get_pg_engine().begin() as conn:
-        # read columns present
-        cols = [c[0] for c in conn.execute(text(
-            f"SELECT column_name FROM information_schema.columns WHERE table_name = '{STAGING_TABLE}';"
-        )).fetchall()]
-        # choose selection columns
-        sel = ", ".join(cols)
-
-        conn.execute(text(f"DROP TABLE IF EXISTS {CLEAN_TABLE};"))
-
-        # Create a normalized/validated cleaned table
-        # Handle missing columns gracefully with COALESCE(NULL)
-        conn.execute(text(f"""
-            CREATE TABLE {CLEAN_TABLE} AS
-            SELECT
-                -- dates: keep YYYY-MM style month fields and drop future months if present
-                CASE
-                    WHEN EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = '{STAGING_TABLE}' AND column_name='case_month')
-                    THEN NULLIF(case_month, '') ELSE NULL END AS case_month,
-
-                -- state: uppercase 2-letter if present
-                CASE
-                    WHEN EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = '{STAGING_TABLE}' AND column_name='res_state')
-                    THEN UPPER(res_state) ELSE NULL END AS res_state,
-
-                -- keep common fields if they exist
-                {(", ".join([c for c in ['age_group','sex','current_status','hosp_yn','icu_yn','death_yn','race','ethnicity','res_county','county_fips_code','state_fips_code','case_positive_specimen','process','exposure_yn'] if c in cols]))}
-            FROM {STAGING_TABLE}
-        """))
-
-        # Remove future months if case_month looks like YYYY-MM
-        if 'case_month' in cols:
-            conn.execute(text(f"""
-                DELETE FROM {CLEAN_TABLE}
-                WHERE case_month IS NOT NULL
-                  AND case_month ~ '^[0-9]{{4}}-[0-1][0-9]$'
-                  AND case_month > to_char(CURRENT_DATE, 'YYYY-MM');
-            """))
-
-        # Standardize domains
-        if 'sex' in cols:
-            conn.execute(text(f"""
-                UPDATE {CLEAN_TABLE}
-                SET sex = CASE UPPER(COALESCE(sex,''))
-                    WHEN 'MALE' THEN 'Male'
-                    WHEN 'FEMALE' THEN 'Female'
-                    WHEN 'UNKNOWN' THEN 'Unknown'
-                    WHEN 'MISSING' THEN 'Missing'
-                    ELSE 'Unknown' END;
-            """))
-
-        if 'current_status' in cols:
-            conn.execute(text(f"""
-                UPDATE {CLEAN_TABLE}
-                SET current_status = CASE
-                    WHEN current_status IN ('Confirmed Case','Probable Case') THEN current_status
-                    ELSE 'Probable Case' END;
-            """))
-
-        for col in ['hosp_yn','icu_yn','death_yn']:
-            if col in cols:
-                conn.execute(text(f"""
-                    UPDATE {CLEAN_TABLE}
-                    SET {col} = CASE UPPER(COALESCE({col}, ''))
-                        WHEN 'YES' THEN 'Yes'
-                        WHEN 'NO' THEN 'No'
-                        WHEN 'UNKNOWN' THEN 'Unknown'
-                        WHEN 'MISSING' THEN 'Missing'
-                        ELSE 'Unknown' END;
-                """))
-
-        # Optionally filter state to valid 2-letter codes if present
-        if 'res_state' in cols:
-            conn.execute(text(f"""
-                DELETE FROM {CLEAN_TABLE}
-                WHERE res_state IS NOT NULL AND res_state !~ '^[A-Z]{{2}}$';
-            """))
-
-        # De-dupe
-        conn.execute(text(
-            f"CREATE TABLE tmp AS SELECT DISTINCT * FROM {CLEAN_TABLE};"
-            f"DROP TABLE {CLEAN_TABLE};"
-            f"ALTER TABLE tmp RENAME TO {CLEAN_TABLE};"
-        ))
-    print("Created cleaned table in Postgres (normalized for validation).")
-
-def load_to_bigquery():
-    client = bigquery.Client(project=GCP_PROJECT_ID)
-    table_id = f"{GCP_PROJECT_ID}.{BQ_DATASET}.{BQ_TABLE}"
-
-    # ensure dataset exists
+    def __init__(self, rows):
+        self.rows = rows
+        self.sha = hashlib.sha256()
+
+    def __iter__(self):
+        for row in self.rows:
+            self.sha.update("\x1f".join(row).encode() + b"\n")
+            yield row
+
+def stream_to_postgres(resume=False, cfg=None):
+    """
+    Zero-DataFrame ingest: pages of Socrata's `.csv` endpoint are parsed off the
+    socket and piped row by row into the staging COPY, so peak memory does not
+    grow with CDC_PAGE_SIZE. Pages are streamed one at a time and checkpointed
+    like stage_to_postgres.
+    """
+    cfg = cfg or default_config()
+    writer = batch_writer(cfg)
+    session = socrata.make_session(1, SETTINGS.socrata_app_token)
+    pages = None
+    total_rows = total_dups = 0
     try:
-        client.get_dataset(f"{GCP_PROJECT_ID}.{BQ_DATASET}")
-    except Exception:
-        client.create_dataset(bigquery.Dataset(f"{GCP_PROJECT_ID}.{BQ_DATASET}"))
-
-    chunks = pd.read_sql(f"SELECT * FROM {CLEAN_TABLE};", get_pg_engine(), chunksize=100000)
-
-    write_disposition = bigquery.WriteDisposition.WRITE_TRUNCATE
-    first = True
-    for i, df in enumerate(chunks, 1):
-        if "submission_date" in df.columns:
-            df["submission_date"] = pd.to_datetime(df["submission_date"], errors="coerce").dt.date
-        job_config = bigquery.LoadJobConfig(
-            write_disposition=write_disposition if first else bigquery.WriteDisposition.WRITE_APPEND
+        start = begin_full_load(writer, cfg, resume)
+        pages = socrata.iter_csv_pages(
+            SETTINGS.cdc_base_url, cfg.dataset_id, SETTINGS.page_size,
+            limiter=get_limiter(SETTINGS.rate_limit), session=session, params=soql_params(cfg=cfg),
+            start_offset=start, retry=retry_policy(),
         )
-        client.load_table_from_dataframe(df, table_id, job_config=job_config).result()
-        tbl = client.get_table(table_id)
-        print(f"Loaded chunk {i} to {table_id}. Current rows in BQ: {tbl.num_rows}")
-        first = False
+        for page, (offset, header, rows) in enumerate(pages, 1):
+            if SETTINGS.max_rows:
+                rows = islice(rows, SETTINGS.max_rows - total_rows)
+            rows = HashingRows(rows)
+            t0 = time.perf_counter()
+            n = writer.write_rows(header, rows, commit=False)  # includes reading the page off the socket
+            dups = stage_batch(writer, cfg)
+            if n:
+                checkpoint(writer, cfg, offset, n, rows.sha.hexdigest())
+            metrics.run.page("ingest", offset, n, time.perf_counter() - t0, duplicates=dups, streamed=True,
+                             dataset=cfg.name)
+            total_rows += n
+            total_dups += dups
+            print(f"Streamed page {page} (offset={offset}) -> staged {n - dups:,} rows, {dups:,} duplicate(s) "
+                  f"(running total: {total_rows:,})")
+            if SETTINGS.max_rows and total_rows >= SETTINGS.max_rows:
+                print(f'Reached MAX_ROWS={SETTINGS.max_rows}. Stopping pagination.')
+                break
+        finish_full_load(writer, cfg)
+    finally:
+        if pages is not None:
+            pages.close()
+        writer.close()
+        session.close()
+
+    print(f"Staged total rows to Postgres: {total_rows:,} ({total_dups:,} duplicates)")
+    return total_rows
 
-    print(f"✅ Finished loading to BigQuery: {table_id}")
+def fingerprint_sql(cfg):
+    return cleaning.fingerprint_sql(cfg.staging_columns, cfg.rules.clean_columns)
+
+def batch_writer(cfg):
+    # pages are COPYed into a temp table that fingerprints them, then moved into staging
+    return staging.CopyWriter(get_pg_engine(), BATCH_TABLE, cfg.staging_columns, fingerprint=fingerprint_sql(cfg))
+
+def begin_full_load(writer, cfg, resume=False):
+    """Prepare staging (and the batch table) for a full load; returns the source offset to fetch from."""
+    table = cfg.staging_table
+    writer.create_table(drop=True, temp=True)
+    with writer.cursor() as cur:
+        if not resume:
+            cur.execute(f"DROP TABLE IF EXISTS {table}, {table}_dups;")
+        cur.execute(staging.staging_ddl(table, cfg.staging_columns))
+        ensure_staging_keys(cur, cfg)
+        if not resume:
+            state.reset_checkpoints(cur, cfg.dataset_id, table)
+            start = 0
+        else:
+            start = state.resume_offset(cur, cfg.dataset_id, table)
+            print(f"Resuming full load of {table} at offset {start:,}")
+    writer.commit()
+    return start
+
+def stage_batch(writer, cfg):
+    """Move the fingerprinted page from the batch table into staging; returns how many rows were duplicates."""
+    table = cfg.staging_table
+    with writer.cursor() as cur:
+        cur.execute(staging.dedup_insert_sql(table, BATCH_TABLE, cfg.staging_columns, f"{table}_dups"))
+        dups = cur.rowcount
+        cur.execute(f"TRUNCATE {BATCH_TABLE};")
+    return dups
+
+def checkpoint(writer, cfg, offset, rows, digest):
+    # the page's COPY is still uncommitted: rows and checkpoint land together or not at all
+    with writer.cursor() as cur:
+        state.record_checkpoint(cur, cfg.dataset_id, cfg.staging_table, offset, rows, digest)
+    writer.commit()
+
+def finish_full_load(writer, cfg):
+    # index the upsert and partition keys after the bulk load, and start incremental runs from here
+    with writer.cursor() as cur:
+        ensure_staging_indexes(cur, cfg)
+        cur.execute(f"SELECT MAX(source_updated_at) FROM {cfg.staging_table};")
+        state.set_state(cur, cfg.dataset_id, WATERMARK_KEY.format(cfg.staging_table), cur.fetchone()[0])
+        mark_dirty(cur, cfg, "*")
+    writer.commit()
+
+def ensure_staging_keys(cur, cfg):
+    """
+    The row_fp column, its unique index (which rejects duplicate content) and
+    the duplicates table. A staging table from before fingerprints is
+    fingerprinted and de-duplicated here once.
+    """
+    table, fp = cfg.staging_table, staging.FP_COLUMN
+    dups = f"{table}_dups"
+    cur.execute(staging.dups_ddl(dups))
+    if fp not in partitions.table_columns(cur, table):
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {fp} uuid;")
+        cur.execute(f"UPDATE {table} SET {fp} = {fingerprint_sql(cfg)};")
+        cur.execute(f"""
+            INSERT INTO {dups} (row_id, {fp})
+            SELECT row_id, {fp} FROM (
+                SELECT row_id, {fp}, row_number() OVER (PARTITION BY {fp} ORDER BY row_id) AS n FROM {table}
+            ) d WHERE n > 1
+            ON CONFLICT (row_id) DO NOTHING;
+        """)
+        cur.execute(f"DELETE FROM {table} s USING {dups} d WHERE s.row_id = d.row_id;")
+    cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_{fp}_key ON {table} ({fp});")
+
+def ensure_staging_indexes(cur, cfg):
+    table = cfg.staging_table
+    cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_row_id_key ON {table} (row_id);")
+    if partitions.PARTITION_KEY in cfg.staging_columns:  # per-partition cleaning reads staging by month
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {table}_{partitions.PARTITION_KEY}_idx "
+                    f"ON {table} ({partitions.PARTITION_KEY});")
+
+def mark_dirty(cur, cfg, keys):
+    """Record clean-table partitions (case_month values, None = default) that the next transform must rebuild."""
+    key = DIRTY_KEY.format(cfg.staging_table)
+    old = state.get_state(cur, cfg.dataset_id, key)
+    if keys == "*" or old in (None, "*"):  # unknown history: rebuild everything
+        value = "*"
+    else:
+        value = json.dumps(partitions.sort_keys(json.loads(old) + list(keys)))
+    state.set_state(cur, cfg.dataset_id, key, value)
+
+def stage_incremental(cfg=None):
+    """
+    Delta ingest: fetch only rows whose Socrata :updated_at is past the stored
+    watermark, COPY them into a temp table and upsert them into staging on
+    row_id, rejecting duplicate content by fingerprint. The upsert and the new
+    watermark commit in one transaction. Returns (new_rows, updated_rows).
+    """
+    cfg = cfg or default_config()
+    table, columns = cfg.staging_table, cfg.staging_columns
+    writer = staging.CopyWriter(get_pg_engine(), DELTA_TABLE, columns, fingerprint=fingerprint_sql(cfg))
+    try:
+        with writer.cursor() as cur:
+            cur.execute(staging.staging_ddl(table, columns))
+            ensure_staging_keys(cur, cfg)
+            ensure_staging_indexes(cur, cfg)
+            watermark = state.get_state(cur, cfg.dataset_id, WATERMARK_KEY.format(table))
+        writer.create_table(drop=True, temp=True)
+        print(f"Incremental ingest from watermark :updated_at > {watermark!r}")
+
+        where = f":updated_at > '{watermark}'" if watermark else None
+        profile = new_profile()
+        fetched = 0
+        for df in fetch_paginated(where=where, cfg=cfg, profile=profile):
+            t0 = time.perf_counter()
+            n = writer.write_frame(df)
+            metrics.run.page("incremental", fetched, n, time.perf_counter() - t0, dataset=cfg.name)
+            fetched += n
+        if not fetched:
+            print("No new or updated rows since last run.")
+            return 0, 0
+
+        with writer.cursor() as cur:
+            if partitions.PARTITION_KEY in columns:
+                cur.execute(partitions.changed_keys_sql(table, DELTA_TABLE))
+                mark_dirty(cur, cfg, [r[0] for r in cur.fetchall()])
+            else:
+                mark_dirty(cur, cfg, [partitions.DEFAULT])
+            t0 = time.perf_counter()
+            new, updated, dups = staging.upsert_dedup(cur, table, DELTA_TABLE, columns, f"{table}_dups")
+            metrics.run.event("statement", stage="incremental", name="upsert_dedup", dataset=cfg.name,
+                              seconds=round(time.perf_counter() - t0, 4), new=new, updated=updated, duplicates=dups)
+            cur.execute(f"SELECT MAX(source_updated_at) FROM {DELTA_TABLE};")
+            state.set_state(cur, cfg.dataset_id, WATERMARK_KEY.format(table),
+                            max(filter(None, [watermark, cur.fetchone()[0]])))
+        writer.commit()
+    finally:
+        writer.close()
+
+    print(f"Upserted delta into {table}: new={new:,} updated={updated:,} duplicates={dups:,}")
+    save_profile(cfg, profile, "incremental")
+    return new, updated
+
+
+def simple_clean_transform(full=False, cfg=None):
+    """
+    Rebuild the clean table, LIST-partitioned by case_month (see partitions.py).
+    Each partition is cleaned by the dataset's rules (cleaning.py; normalize +
+    filter) in one statement on its own connection, or in Python with
+    CLEAN_BACKEND=arrow (arrow_clean.py). No DISTINCT is needed, because
+    staging already rejected duplicate content by fingerprint. The new partitions are
+    swapped in together with a bump of the table's version token. Only the
+    months that stage_incremental marked dirty are rebuilt, unless `full`.
+    """
+    cfg = cfg or default_config()
+    engine = get_pg_engine()
+    dirty_key = DIRTY_KEY.format(cfg.staging_table)
+    with engine.begin() as conn:
+        cur = conn.connection.cursor()
+        cols = partitions.table_columns(cur, cfg.staging_table)
+        dirty = state.get_state(cur, cfg.dataset_id, dirty_key)
+    keys = None if full or dirty in (None, "*") else json.loads(dirty)
+
+    # the version bump invalidates cached /validate results for the old table
+    stats = partitions.rebuild(engine, cfg.staging_table, cfg.clean_table, cols, keys,
+                               distinct=staging.FP_COLUMN not in cols,  # staging from before fingerprints
+                               rules=cfg.rules.clean_columns, filters=cfg.rules.clean_filters,
+                               finalize=lambda cur: state.set_state(cur, cfg.dataset_id, dirty_key, "[]"))
+    print(f"Rebuilt {stats['partitions']} partition(s) of {cfg.clean_table} ({stats['rows']:,} rows) "
+          f"in {stats['build_sec'] + stats['swap_sec']:.1f}s, version {stats['version']}.")
+    return stats
+
+def validate_clean(cfg=None):
+    """
+    The dataset's validation rules over its clean table, in-process, as a
+    /validate-shaped dict (the API only serves the default dataset's rules).
+    Only partitions rebuilt since the last validation are scanned.
+    """
+    cfg = cfg or default_config()
+    with get_pg_engine().begin() as conn:
+        values, _ = validation_partials.collect(conn.connection.cursor(), cfg.clean_table, cfg.rules.validation)
+    checks = [{"name": name, "passed": passed, "details": details}
+              for name, passed, details in evaluate(values, cfg.rules.validation)]
+    return {"overall_passed": all(c["passed"] for c in checks), "checks": checks}
+
+def load_to_bigquery(cfg=None):
+    import bq_loader  # heavy import (pyarrow), only needed to load
+    cfg = cfg or default_config()
+    # LOAD_TARGET_DIR swaps BigQuery for a local directory of Parquet files (dry runs)
+    if SETTINGS.load_target_dir:
+        target = bq_loader.LocalTarget(SETTINGS.load_target_dir, SETTINGS.bq_dataset, cfg.bq_table)
+    else:
+        SETTINGS.require("gcp_project_id")
+        target = bq_loader.BigQueryTarget(SETTINGS.gcp_project_id, SETTINGS.bq_dataset, cfg.bq_table)
+    if SETTINGS.bq_load_mode == "sync":
+        stats = bq_loader.sync_table(get_pg_engine(), cfg.clean_table, target, cfg.dataset_id,
+                                     workers=SETTINGS.bq_load_workers, rows_per_file=SETTINGS.bq_rows_per_file)
+    else:
+        stats = bq_loader.load_table(get_pg_engine(), cfg.clean_table, target,
+                                     workers=SETTINGS.bq_load_workers, rows_per_file=SETTINGS.bq_rows_per_file)
+    metrics.run.event("load", target=target.table_id, **stats)
+    print(f"✅ Finished loading to BigQuery: {target.table_id}")
+    return stats
 
 def main():
-    print(f"Using CDC dataset: {CDC_DOMAIN}/resource/{DATASET_ID}.json  (page size {PAGE_SIZE})")
+    print(f"Using CDC dataset: {SETTINGS.cdc_domain}/resource/{SETTINGS.dataset_id}.json  "
+          f"(page size {SETTINGS.page_size})")
     print("=== Ingest → Postgres staging ===")
     staged = stage_to_postgres()
     if staged == 0:
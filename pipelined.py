@@ -0,0 +1,200 @@
+"""
+Pipelined ingest: fetching, staging and cleaning overlap instead of running
+one after another.
+
+    fetch thread --(bounded queue)--> N writer threads
+
+Each writer owns one connection. Per page it COPYs the rows into a temp
+batch table, which fingerprints them. In the same transaction it moves them
+into staging (duplicate content is rejected there, as in a sequential load)
+and inserts their cleaned form (the rules from cleaning.py) into the new
+clean table, where a unique row-fingerprint index stands in for the final
+DISTINCT. The bounded queue provides backpressure (at most
+PIPELINE_QUEUE_DEPTH pages wait in memory). The first failure in any stage
+stops all the others, and the old clean table is left untouched.
+"""
+import os, queue, threading, time
+
+import cleaning, socrata, staging, state
+import pipeline as p
+
+QUEUE_DEPTH = int(os.getenv("PIPELINE_QUEUE_DEPTH", "4"))
+WRITERS = int(os.getenv("PIPELINE_WRITERS", "2"))
+
+_DONE = object()
+
+
+class Cancelled(Exception):
+    """Raised inside a stage when another stage has failed."""
+
+
+class StageGroup:
+    """Threads sharing one stop flag; the first exception cancels the rest and is re-raised by join()."""
+
+    def __init__(self):
+        self.stop = threading.Event()
+        self.errors = []
+        self.busy = {}  # stage name -> seconds spent working (not waiting on queues)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def spawn(self, name: str, fn, *args):
+        def run():
+            try:
+                fn(*args)
+            except Cancelled:
+                pass
+            except BaseException as e:
+                with self._lock:
+                    self.errors.append(e)
+                self.stop.set()
+        t = threading.Thread(target=run, name=name, daemon=True)
+        self._threads.append(t)
+        t.start()
+
+    def put(self, q: queue.Queue, item):
+        while not self.stop.is_set():
+            try:
+                return q.put(item, timeout=0.2)
+            except queue.Full:
+                pass
+        raise Cancelled()
+
+    def get(self, q: queue.Queue):
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=0.2)
+            except queue.Empty:
+                pass
+        raise Cancelled()
+
+    def add_busy(self, stage: str, secs: float):
+        with self._lock:
+            self.busy[stage] = self.busy.get(stage, 0.0) + secs
+
+    def join(self):
+        for t in self._threads:
+            t.join()
+        if self.errors:
+            raise self.errors[0]
+
+
+def clean_table_ddl(table: str, columns):
+    cols = ", ".join(f"{c} TEXT" for c in columns)
+    return (f"CREATE UNLOGGED TABLE {table} ({cols});"
+            f"CREATE UNIQUE INDEX {table}_row_key ON {table} (({cleaning.row_hash_sql(columns)}));")
+
+
+def run(cfg=None) -> dict:
+    """
+    Ingest and clean in one pipelined pass; returns row counts and per-stage busy
+    time. `dropped` counts staged rows that were filtered out or duplicates.
+    """
+    cfg = cfg or p.default_config()
+    engine = p.get_pg_engine()
+    raw, clean, columns, rules = cfg.staging_table, cfg.clean_table, cfg.staging_columns, cfg.rules
+    build = f"{clean}__build"
+    clean_cols = [r.name for r in cleaning.output_columns(columns, rules.clean_columns)]
+    select = cleaning.select_sql("stg_batch", columns, rules.clean_columns, rules.clean_filters, distinct=False)
+    clean_insert = f"INSERT INTO {build} ({', '.join(clean_cols)})\n{select}\nON CONFLICT DO NOTHING;"
+
+    with engine.begin() as conn:
+        cur = conn.connection.cursor()
+        cur.execute(f"DROP TABLE IF EXISTS {raw}, {raw}_dups, {build};")
+        cur.execute(staging.staging_ddl(raw, columns))
+        p.ensure_staging_keys(cur, cfg)
+        state.reset_checkpoints(cur, cfg.dataset_id, raw)  # not resumable; old ones are stale
+        cur.execute(clean_table_ddl(build, clean_cols))
+
+    group = StageGroup()
+    pages = queue.Queue(maxsize=QUEUE_DEPTH)
+    counts = {"fetched": 0, "staged": 0, "duplicates": 0, "clean": 0}
+    stage_insert = staging.dedup_insert_sql(raw, "stg_batch", columns, f"{raw}_dups")
+    counts_lock = threading.Lock()
+    profile = p.new_profile()
+
+    def fetch():
+        controller, s = p.fetch_controller(), p.SETTINGS
+        session = socrata.make_session(controller.max_workers if controller else s.fetch_workers,
+                                       s.socrata_app_token)
+        it = socrata.iter_pages(s.cdc_base_url, cfg.dataset_id, s.page_size, workers=s.fetch_workers,
+                                limiter=p.get_limiter(s.rate_limit), session=session,
+                                params=p.soql_params(cfg=cfg), retry=p.retry_policy(), controller=controller)
+        try:
+            t0 = time.perf_counter()
+            for offset, rows in it:
+                if s.max_rows:
+                    rows = rows[:max(0, s.max_rows - counts["fetched"])]
+                counts["fetched"] += len(rows)
+                group.add_busy("fetch", time.perf_counter() - t0)
+                if rows:
+                    group.put(pages, (offset, rows))
+                    if profile is not None:  # while the writers COPY the page
+                        profile.add_records(rows)
+                if s.max_rows and counts["fetched"] >= s.max_rows:
+                    break
+                t0 = time.perf_counter()
+        finally:
+            it.close()
+            session.close()
+            p.report_fetch_tuning(controller, cfg.dataset_id)
+        for _ in range(WRITERS):  # one end marker per writer
+            group.put(pages, _DONE)
+
+    def write():
+        writer = staging.CopyWriter(engine, "stg_batch", columns, fingerprint=p.fingerprint_sql(cfg))
+        try:
+            writer.create_table(drop=True, temp=True)
+            while True:
+                item = group.get(pages)
+                if item is _DONE:
+                    return
+                offset, rows = item
+                t0 = time.perf_counter()
+                writer.write_records(rows, commit=False)
+                with writer.cursor() as cur:
+                    cur.execute(stage_insert)
+                    dups = cur.rowcount
+                    cur.execute(clean_insert)
+                    inserted = cur.rowcount
+                    cur.execute("TRUNCATE stg_batch;")
+                writer.commit()
+                group.add_busy("write+clean", time.perf_counter() - t0)
+                with counts_lock:
+                    counts["staged"] += len(rows)
+                    counts["duplicates"] += dups
+                    counts["clean"] += inserted
+                print(f"  -> page offset={offset}: staged {len(rows):,} ({dups:,} duplicates), "
+                      f"{inserted:,} new clean rows")
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    group.spawn("pipeline-fetch", fetch)
+    for i in range(WRITERS):
+        group.spawn(f"pipeline-writer-{i}", write)
+    try:
+        group.join()
+    except BaseException:
+        with engine.begin() as conn:  # leave the previous clean table in place
+            conn.connection.cursor().execute(f"DROP TABLE IF EXISTS {build};")
+        raise
+
+    writer = staging.CopyWriter(engine, raw, columns)
+    try:
+        p.finish_full_load(writer, cfg)
+    finally:
+        writer.close()
+    with engine.begin() as conn:
+        cur = conn.connection.cursor()
+        cur.execute(f"DROP TABLE IF EXISTS {clean};")
+        cur.execute(f"ALTER TABLE {build} RENAME TO {clean};")
+        cur.execute(f"ALTER INDEX {build}_row_key RENAME TO {clean}_row_key;")
+        version = state.bump_table_version(cur, clean)
+
+    p.save_profile(cfg, profile, "full")
+    elapsed = time.perf_counter() - start
+    stats = {**counts, "dropped": counts["staged"] - counts["clean"], "elapsed_sec": round(elapsed, 2),
+             "busy_sec": {k: round(v, 2) for k, v in group.busy.items()}, "clean_version": version}
+    print(f"Pipelined ingest+clean: {stats}")
+    return stats
@@ -0,0 +1,159 @@
+"""
+Pipeline settings, read once from the environment (and .env) into one object.
+
+    cfg = Settings.from_env()
+    cfg.require("dataset_id")                  # ValueError naming DATASET_ID when unset
+    test_cfg = cfg.replace(page_size=100)      # settings are frozen; replace() copies
+
+pipeline.SETTINGS holds the process's settings; functions read it at call
+time, so a test or benchmark swaps in a replaced copy instead of patching
+module globals. Nothing is asserted at import: a step checks (`require`) only
+the settings it needs, so `validate` runs without GCP_PROJECT_ID.
+
+Settings that only tune one module (CLEAN_WORKERS, CATEGORY_MAX_RATIO,
+VALIDATION_CACHE_TTL, ...) stay next to the code they tune.
+"""
+import dataclasses, os
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+
+import staging
+
+
+def _bool(name: str, default: str = "0") -> bool:
+    return os.getenv(name, default) == "1"
+
+
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    # Socrata source
+    cdc_domain: str = "data.cdc.gov"
+    dataset_id: str = ""
+    page_size: int = 50000
+    socrata_app_token: str = ""
+    cdc_base_url: str = "https://data.cdc.gov"  # override to point at a stub
+    fetch_workers: int = 1                      # pages in flight
+    rate_limit: float = 2.0                     # requests/sec across all workers (0 = unlimited)
+    # JSON pages: tune page size and pages in flight from the responses (socrata.FetchController),
+    # starting at page_size / fetch_workers
+    adaptive_fetch: bool = True
+    max_fetch_workers: int = 8
+    min_page_size: int = 1000
+    max_page_size: int = 200000
+    target_latency: float = 30.0                # seconds per page before pages shrink
+    # 429/5xx and dropped connections are retried with jittered exponential backoff
+    max_retries: int = 5
+    backoff_base: float = 1.0
+    # raw full-load pages kept on disk as Arrow IPC for replays (--from-cache); empty = no cache
+    page_cache_dir: str = ""
+    page_cache_max_bytes: int = 10 * 2**30      # LRU-evicted past this
+    page_cache_compression: str = "zstd"        # zstd | lz4 | none (zero-copy reads)
+    max_rows: int = 0                           # stop ingest after this many rows (0 = all)
+    ingest_mode: str = "frame"                  # "frame" (JSON pages) | "stream" (CSV straight into COPY)
+    data_profile: bool = True                   # column profiles of the fetched pages (data_profile.py)
+
+    # Postgres
+    pg_host: str = "localhost"
+    pg_port: int = 5433
+    pg_user: str = "ph"
+    pg_password: str = "ph"
+    pg_db: str = "public_health"
+    pg_pool_size: int = 10                      # connections shared by all datasets in the process
+    pg_pool_timeout: float = 600.0              # seconds to wait for a free one
+    staging_table: str = "stg_cdc_raw"
+    clean_table: str = "stg_cdc_clean"
+    # explicit staging schema (all TEXT); override for datasets other than n8mc-b4w4
+    staging_columns: Tuple[str, ...] = tuple(staging.SYSTEM_COLUMNS.values()) + tuple(staging.CDC_CASE_COLUMNS)
+
+    # BigQuery
+    gcp_project_id: str = ""
+    bq_dataset: str = "public_health"
+    bq_table: str = "cdc_state_cases"
+    bq_load_workers: int = 4                    # parallel load jobs
+    bq_rows_per_file: int = 1000000             # rows per Parquet file
+    bq_load_mode: str = "sync"                  # "sync" (changed partitions) | "full"
+    load_target_dir: str = ""                   # a local directory of Parquet files instead (dry runs)
+
+    # orchestrator runs
+    datasets_file: Optional[str] = None         # JSON list of dataset configs (datasets.py)
+    dataset_workers: int = 2                    # datasets of a --datasets run processed concurrently
+    skip_ingest: bool = False
+    incremental: bool = False
+    pipelined: bool = False                     # full reload with fetch/stage/clean overlapped
+    validation_api_url: str = "http://127.0.0.1:8000"
+    validation_timeout: float = 3600.0          # overall seconds to wait for a job
+    validation_poll_sec: float = 2.0
+
+    @classmethod
+    def from_env(cls, dotenv: bool = True) -> "Settings":
+        if dotenv:
+            load_dotenv()
+        domain = os.getenv("CDC_DOMAIN", "data.cdc.gov").strip()
+        extra = [staging.normalize_column(c) for c in os.getenv("STAGING_COLUMNS", "").split(",") if c.strip()]
+        return cls(
+            cdc_domain=domain,
+            dataset_id=os.getenv("DATASET_ID", "").strip(),
+            page_size=int(os.getenv("CDC_PAGE_SIZE", "50000")),
+            socrata_app_token=os.getenv("SOCRATA_APP_TOKEN", "").strip(),
+            cdc_base_url=os.getenv("CDC_BASE_URL", f"https://{domain}").strip(),
+            fetch_workers=int(os.getenv("CDC_FETCH_WORKERS", "1")),
+            rate_limit=float(os.getenv("CDC_RATE_LIMIT", "2")),
+            adaptive_fetch=_bool("CDC_ADAPTIVE_FETCH", "1"),
+            max_fetch_workers=int(os.getenv("CDC_MAX_FETCH_WORKERS", "8")),
+            min_page_size=int(os.getenv("CDC_MIN_PAGE_SIZE", "1000")),
+            max_page_size=int(os.getenv("CDC_MAX_PAGE_SIZE", "200000")),
+            target_latency=float(os.getenv("CDC_TARGET_LATENCY", "30")),
+            max_retries=int(os.getenv("CDC_MAX_RETRIES", "5")),
+            backoff_base=float(os.getenv("CDC_BACKOFF_BASE", "1.0")),
+            page_cache_dir=os.getenv("PAGE_CACHE_DIR", "").strip(),
+            page_cache_max_bytes=int(float(os.getenv("PAGE_CACHE_MAX_GB", "10")) * 2**30),
+            page_cache_compression=os.getenv("PAGE_CACHE_COMPRESSION", "zstd"),
+            max_rows=int(os.getenv("MAX_ROWS", "0")),
+            ingest_mode=os.getenv("INGEST_MODE", "frame"),
+            data_profile=_bool("DATA_PROFILE", "1"),
+            pg_host=os.getenv("PG_HOST", "localhost"),
+            pg_port=int(os.getenv("PG_PORT", "5433")),
+            pg_user=os.getenv("PG_USER", "ph"),
+            pg_password=os.getenv("PG_PASSWORD", "ph"),
+            pg_db=os.getenv("PG_DB", "public_health"),
+            pg_pool_size=int(os.getenv("PG_POOL_SIZE", "10")),
+            pg_pool_timeout=float(os.getenv("PG_POOL_TIMEOUT", "600")),
+            staging_columns=tuple(staging.SYSTEM_COLUMNS.values()) + tuple(extra or staging.CDC_CASE_COLUMNS),
+            gcp_project_id=(os.getenv("GCP_PROJECT_ID") or "").strip(),
+            bq_dataset=os.getenv("BQ_DATASET", "public_health"),
+            bq_table=os.getenv("BQ_TABLE", "cdc_state_cases"),
+            bq_load_workers=int(os.getenv("BQ_LOAD_WORKERS", "4")),
+            bq_rows_per_file=int(os.getenv("BQ_ROWS_PER_FILE", "1000000")),
+            bq_load_mode=os.getenv("BQ_LOAD_MODE", "sync"),
+            load_target_dir=os.getenv("LOAD_TARGET_DIR", ""),
+            datasets_file=os.getenv("DATASETS_FILE") or None,
+            dataset_workers=int(os.getenv("DATASET_WORKERS", "2")),
+            skip_ingest=_bool("SKIP_INGEST"),
+            incremental=_bool("INCREMENTAL"),
+            pipelined=_bool("PIPELINED"),
+            validation_api_url=os.getenv("VALIDATION_API_URL", "http://127.0.0.1:8000"),
+            validation_timeout=float(os.getenv("VALIDATION_TIMEOUT", "3600")),
+            validation_poll_sec=float(os.getenv("VALIDATION_POLL_SEC", "2")),
+        )
+
+    def replace(self, **changes) -> "Settings":
+        return dataclasses.replace(self, **changes)
+
+    def require(self, *names: str) -> "Settings":
+        """Raise ValueError naming the environment variables of the `names` settings that are empty."""
+        missing = [ENV_HINTS.get(n, n.upper()) for n in names if not getattr(self, n)]
+        if missing:
+            raise ValueError(f"Set {', '.join(missing)} in .env or the environment")
+        return self
+
+    @property
+    def pg_url(self) -> str:
+        return f"postgresql+psycopg2://{self.pg_user}:{self.pg_password}@{self.pg_host}:{self.pg_port}/{self.pg_db}"
+
+
+ENV_HINTS = {
+    "dataset_id": "DATASET_ID (e.g., n8mc-b4w4)",
+    "gcp_project_id": "GCP_PROJECT_ID",
+    "page_cache_dir": "PAGE_CACHE_DIR",
+}
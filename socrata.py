@@ -0,0 +1,404 @@
+"""
+HTTP fetch layer for Socrata (SODA) resources.
+
+Pages are requested gzip-compressed over one pooled keep-alive session.
+`iter_pages` keeps a window of offsets in flight and still hands pages back in
+offset order; `iter_csv_pages` streams the `.csv` endpoint row by row without
+buffering a page. Throttling (429) and server errors (5xx) are retried with
+jittered backoff. A `FetchController` tunes `iter_pages`' page size and window
+from the responses as it goes. Every request's latency and size goes to the
+current metrics run record.
+"""
+import csv, io, random, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional, Tuple, List
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+
+class TokenBucket:
+    """Thread-safe token bucket: refills `rate` tokens/sec, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:  # rate limiting disabled
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def make_session(pool_size: int = 1, app_token: str = "") -> requests.Session:
+    """A keep-alive session whose connection pool fits `pool_size` concurrent requests."""
+    session = requests.Session()
+    session.headers["Accept-Encoding"] = "gzip"  # JSON/CSV pages shrink ~10x; bytes are counted compressed
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if app_token:
+        session.headers["X-App-Token"] = app_token
+    return session
+
+
+def _raise_for_status(r: requests.Response):
+    # If the dataset ID is wrong or restricted, raise now with helpful message
+    try:
+        r.raise_for_status()
+    except requests.HTTPError as e:
+        print(f"HTTP error from Socrata API: {e}\nURL: {r.url}\nResponse: {r.text[:400]} …")
+        raise
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Retry transient failures up to `retries` times with full-jitter exponential backoff."""
+    retries: int = 5
+    backoff: float = 1.0   # base delay, seconds
+    cap: float = 60.0      # max delay, seconds
+
+    def delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:  # honour the server's Retry-After (seconds form)
+                return min(float(retry_after), self.cap)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.cap, self.backoff * 2 ** attempt))
+
+
+DEFAULT_RETRY = RetryPolicy()
+
+
+class FetchController:
+    """
+    Tunes the page size and the number of pages in flight from the responses,
+    AIMD-style like TCP congestion control:
+
+    * every `window` completed pages (at least `round_pages`) make a round.
+      Its throughput is estimated as window * rows per page / latency per
+      page, so it includes the server slowing down as requests queue up;
+    * after a clean round, one setting is probed upward (additive increase),
+      alternating between one more page in flight and a page `page_step` rows
+      larger. A probe that does not raise throughput by `min_gain` is undone,
+      and that setting stops growing;
+    * throttling (429/5xx) halves the pages in flight. Timeouts also halve the
+      page size, and so does a round slower than `target_latency` per page
+      (multiplicative decrease). Neither setting grows back past where the
+      trouble started. A Retry-After pauses every worker, not just the one
+      that got it.
+
+    Changes are printed and recorded as "fetch_tuning" metrics events;
+    `report()` gives the last measured settings and the best throughput seen.
+    """
+
+    def __init__(self, page_size: int, workers: int = 1, max_workers: int = 8, min_page_size: int = 1000,
+                 max_page_size: Optional[int] = None, target_latency: float = 30.0, min_gain: float = 0.05,
+                 adapt_page_size: bool = True, round_pages: int = 4):
+        self.page_size = page_size
+        self.window = max(1, min(workers, max_workers))
+        self.max_workers = max(max_workers, self.window)
+        self.min_page_size = min(min_page_size, page_size)
+        self.page_step = max(page_size // 2, 1)
+        self.target_latency, self.min_gain = target_latency, min_gain
+        self.adapt_page_size = adapt_page_size  # off: only the window moves (e.g. pages cached by size)
+        self.round_pages = round_pages          # one page is too noisy a sample to settle a setting on
+        self._caps = {"window": self.max_workers,
+                      "page_size": max(max_page_size or 4 * page_size, page_size) if adapt_page_size else page_size}
+        self._lock = threading.Lock()
+        self._round = self._new_round()
+        self._baseline = None   # throughput at the current settings
+        self._probe = None      # (setting, value before the probe)
+        self._turn = 0
+        self._resume_at = 0.0
+        self._last_decrease = 0.0
+        self._bytes_per_sec = 0.0
+        self.best = (0.0, self.page_size, self.window)  # (rows/s, page size, window)
+
+    @staticmethod
+    def _new_round() -> dict:
+        return {"pages": 0, "rows": 0, "bytes": 0, "seconds": 0.0}
+
+    def wait(self):
+        """Block while a Retry-After is in force."""
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def done(self, rows: int, nbytes: int, seconds: float):
+        """A page of `rows` rows (`nbytes` on the wire) took `seconds`."""
+        with self._lock:
+            r = self._round
+            r["pages"], r["rows"], r["bytes"], r["seconds"] = \
+                r["pages"] + 1, r["rows"] + rows, r["bytes"] + nbytes, r["seconds"] + seconds
+            if r["pages"] >= max(self.window, self.round_pages):
+                self._end_round()
+
+    def throttled(self, status: int, retry_after: Optional[str] = None, sent_at: float = 0.0):
+        """A request sent at `sent_at` (time.monotonic) got `status` (0: timeout or dropped connection)."""
+        with self._lock:
+            try:
+                self._resume_at = max(self._resume_at, time.monotonic() + float(retry_after))
+            except (TypeError, ValueError):
+                pass
+            if sent_at < self._last_decrease:  # sent before the last decrease: already reacted to
+                return
+            self._last_decrease = time.monotonic()
+            window, page_size = self.window, self.page_size
+            self.window = max(1, window // 2)
+            self._caps["window"] = max(self.window, window - 1)
+            if status == 0 and self.adapt_page_size and self.page_size > self.min_page_size:
+                self._set_page_size(max(self.min_page_size, page_size // 2))
+                self._caps["page_size"] = max(self.page_size, page_size - 1)
+            self._baseline, self._probe, self._round = None, None, self._new_round()
+            self._log(f"{'timeout' if status == 0 else f'HTTP {status}'}, backing off", None)
+
+    def _set_page_size(self, value: int):
+        self.page_size = max(self.min_page_size, min(value, self._caps["page_size"]))
+
+    def _end_round(self):
+        r = self._round
+        self._round = self._new_round()
+        latency = r["seconds"] / r["pages"]
+        throughput = self.window * r["rows"] / max(r["seconds"], 1e-9)
+        self._bytes_per_sec = self.window * r["bytes"] / max(r["seconds"], 1e-9)
+        if throughput > self.best[0]:
+            self.best = (throughput, self.page_size, self.window)
+        if latency > self.target_latency and self.adapt_page_size and self.page_size > self.min_page_size:
+            old = self.page_size
+            self._set_page_size(old // 2)
+            self._caps["page_size"] = max(self.page_size, old - 1)
+            self._baseline, self._probe = None, None
+            self._log(f"pages take {latency:.1f}s, over {self.target_latency:g}s", throughput)
+            return
+        if self._probe:
+            setting, before = self._probe
+            self._probe = None
+            if throughput < self._baseline * (1 + self.min_gain):
+                # no gain: undo, and this setting has found its knee
+                self._caps[setting] = before
+                if setting == "window":
+                    self.window = before
+                else:
+                    self._set_page_size(before)
+                self._log(f"{setting} probe gained nothing ({throughput:,.0f} rows/s), keeping", throughput)
+                return
+            self._log(f"{setting} probe raised throughput to {throughput:,.0f} rows/s", throughput)
+        self._baseline = throughput
+        for i in range(2):
+            setting = ("window", "page_size")[(self._turn + i) % 2]
+            value = getattr(self, setting) + (1 if setting == "window" else self.page_step)
+            if getattr(self, setting) < self._caps[setting]:
+                self._turn += i + 1
+                self._probe = (setting, getattr(self, setting))
+                if setting == "window":
+                    self.window = min(value, self._caps["window"])
+                else:
+                    self._set_page_size(value)
+                return
+
+    def _log(self, reason: str, throughput: Optional[float]):
+        print(f"  ~ fetch tuning: {reason} -> page size {self.page_size:,}, {self.window} in flight")
+        metrics.run.event("fetch_tuning", reason=reason, page_size=self.page_size, window=self.window,
+                          rows_per_sec=round(throughput or 0), bytes_per_sec=round(self._bytes_per_sec))
+
+    def report(self) -> dict:
+        """
+        The last measured settings (a probe whose round never finished does not
+        count) and the best throughput seen. `measured` is False when no round
+        has finished since the start or the last back-off: still probing.
+        """
+        with self._lock:
+            page_size, window = self.page_size, self.window
+            if self._probe:
+                setting, before = self._probe
+                page_size, window = (page_size, before) if setting == "window" else (before, window)
+            measured = self._baseline is not None
+            best, best_page_size, best_window = self.best
+        return {"page_size": page_size, "window": window, "measured": measured, "best_rows_per_sec": round(best),
+                "best_page_size": best_page_size, "best_window": best_window}
+
+
+def get_with_retries(session: requests.Session, url: str, params: dict, limiter: Optional[TokenBucket] = None,
+                     timeout: int = 120, stream: bool = False, retry: RetryPolicy = DEFAULT_RETRY,
+                     controller: Optional[FetchController] = None) -> requests.Response:
+    """GET with rate limiting; 429/5xx and connection errors are retried, other errors raise."""
+    offset = params.get("$offset")
+    for attempt in range(retry.retries + 1):
+        if controller:
+            controller.wait()
+        if limiter:
+            limiter.acquire()
+        t0, sent_at = time.perf_counter(), time.monotonic()
+        try:
+            r = session.get(url, params=params, timeout=timeout, stream=stream)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            metrics.run.http(url, offset, 0, time.perf_counter() - t0, 0, attempt)
+            if controller:
+                controller.throttled(0, sent_at=sent_at)
+            if attempt == retry.retries:
+                raise
+            wait = retry.delay(attempt)
+            print(f"  !! {type(e).__name__} for offset={params.get('$offset')}; retry {attempt + 1} in {wait:.1f}s")
+        else:
+            if not (stream and r.ok):  # streamed bodies are recorded by their reader once drained
+                metrics.run.http(url, offset, r.status_code, time.perf_counter() - t0, r.raw.tell(), attempt)
+            if r.status_code not in RETRY_STATUSES or attempt == retry.retries:
+                _raise_for_status(r)
+                return r
+            wait = retry.delay(attempt, r.headers.get("Retry-After"))
+            if controller:
+                controller.throttled(r.status_code, r.headers.get("Retry-After"), sent_at)
+            print(f"  !! HTTP {r.status_code} for offset={params.get('$offset')}; retry {attempt + 1} in {wait:.1f}s")
+            r.close()
+        time.sleep(wait)
+
+
+def fetch_page(session: requests.Session, url: str, params: dict, limiter: Optional[TokenBucket] = None,
+               timeout: int = 120, retry: RetryPolicy = DEFAULT_RETRY,
+               controller: Optional[FetchController] = None) -> List[dict]:
+    t0 = time.perf_counter()
+    r = get_with_retries(session, url, params, limiter, timeout, retry=retry, controller=controller)
+    rows = r.json()
+    if controller:  # parsing counts too: it grows with the page like the transfer does
+        controller.done(len(rows), r.raw.tell(), time.perf_counter() - t0)
+    return rows
+
+
+def last_modified(session: requests.Session, base_url: str, dataset_id: str,
+                  limiter: Optional[TokenBucket] = None, retry: RetryPolicy = DEFAULT_RETRY) -> Optional[str]:
+    """The dataset's last-modified time as Socrata reports it on a one-row request, or None."""
+    url = f"{base_url.rstrip('/')}/resource/{dataset_id}.json"
+    r = get_with_retries(session, url, {"$limit": 1}, limiter, retry=retry)
+    r.close()
+    return r.headers.get("X-SODA2-Truth-Last-Modified") or r.headers.get("Last-Modified")
+
+
+@contextmanager
+def open_csv_page(session: requests.Session, url: str, params: dict, limiter: Optional[TokenBucket] = None,
+                  timeout: int = 120, retry: RetryPolicy = DEFAULT_RETRY):
+    """Open one `.csv` page; yields (header, row iterator) parsed straight off the socket."""
+    t0 = time.perf_counter()
+    r = get_with_retries(session, url, params, limiter, timeout, stream=True, retry=retry)
+    try:
+        r.raw.decode_content = True  # transparently gunzip
+        r.raw.auto_close = False      # let TextIOWrapper see EOF instead of a closed file
+        reader = csv.reader(io.TextIOWrapper(r.raw, encoding="utf-8", newline=""))
+        yield next(reader, []), reader
+    finally:
+        # latency covers retries and the whole (row-by-row consumed) body; bytes are as sent on the wire
+        metrics.run.http(url, params.get("$offset"), r.status_code, time.perf_counter() - t0, r.raw.tell(), None)
+        r.close()
+
+
+class CountingIterator:
+    """Wraps an iterator and counts the items pulled through it."""
+
+    def __init__(self, it):
+        self._it = iter(it)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = next(self._it)
+        self.count += 1
+        return item
+
+
+def iter_pages(base_url: str, dataset_id: str, page_size: int, workers: int = 1,
+               limiter: Optional[TokenBucket] = None, session: Optional[requests.Session] = None,
+               params: Optional[dict] = None, start_offset: int = 0,
+               retry: RetryPolicy = DEFAULT_RETRY,
+               controller: Optional[FetchController] = None) -> Iterator[Tuple[int, List[dict]]]:
+    """
+    Yield (offset, rows) in offset order with up to `workers` pages in flight.
+    With a `controller`, its page size and window are used instead, read again
+    before each request. Stops at the first empty page (or a page shorter than
+    requested, which can only be the last one); requests already in flight
+    past that point are discarded.
+    """
+    url = f"{base_url.rstrip('/')}/resource/{dataset_id}.json"
+    workers = max(workers, 1)
+    pool_size = controller.max_workers if controller else workers
+    own_session = session is None
+    session = session or make_session(pool_size)
+    pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="socrata-fetch")
+    pending = deque()
+    next_offset = start_offset
+
+    def fill():
+        nonlocal next_offset
+        while len(pending) < (controller.window if controller else workers):
+            size = controller.page_size if controller else page_size
+            p = dict(params or {})
+            p.update({"$limit": size, "$offset": next_offset})
+            fut = pool.submit(fetch_page, session, url, p, limiter, retry=retry, controller=controller)
+            pending.append((next_offset, size, fut))
+            next_offset += size
+
+    try:
+        fill()
+        while pending:
+            offset, size, fut = pending.popleft()
+            rows = fut.result()
+            if not rows:
+                break
+            yield offset, rows
+            if len(rows) < size:
+                break
+            fill()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        if own_session:
+            session.close()
+
+
+def iter_csv_pages(base_url: str, dataset_id: str, page_size: int,
+                   limiter: Optional[TokenBucket] = None, session: Optional[requests.Session] = None,
+                   params: Optional[dict] = None, start_offset: int = 0, retry: RetryPolicy = DEFAULT_RETRY):
+    """
+    Yield (offset, header, rows) for successive pages of the `.csv` endpoint.
+    `rows` is a lazy iterator over the open response: consume it before advancing.
+    Pages are streamed one at a time so memory stays flat regardless of page size.
+    """
+    url = f"{base_url.rstrip('/')}/resource/{dataset_id}.csv"
+    own_session = session is None
+    session = session or make_session()
+    offset = start_offset
+    try:
+        while True:
+            p = dict(params or {})
+            p.update({"$limit": page_size, "$offset": offset})
+            with open_csv_page(session, url, p, limiter, retry=retry) as (header, reader):
+                rows = CountingIterator(reader)
+                yield offset, header, rows
+                for _ in rows:  # drain whatever the consumer left, to count the page
+                    pass
+            if rows.count < page_size:
+                break
+            offset += page_size
+    finally:
+        if own_session:
+            session.close()
@@ -0,0 +1,233 @@
+"""
+Bulk writer for the Postgres staging table.
+
+Pages are streamed into Postgres with `COPY ... FROM STDIN` (text format) over a
+single pooled connection instead of row-wise INSERTs from `DataFrame.to_sql`.
+The staging table is created once with an explicit all-TEXT schema, so column
+types never depend on what pandas infers from one particular page.
+"""
+import io, json
+from typing import Iterable, List, Optional, Tuple
+
+# Columns of the CDC case-surveillance dataset with geography (n8mc-b4w4)
+CDC_CASE_COLUMNS = [
+    "case_month", "res_state", "state_fips_code", "res_county", "county_fips_code",
+    "age_group", "sex", "race", "ethnicity",
+    "case_positive_specimen_interval", "case_onset_interval", "process",
+    "exposure_yn", "current_status", "symptom_status",
+    "hosp_yn", "icu_yn", "death_yn", "underlying_conditions_yn",
+]
+
+
+# Socrata system fields requested alongside the data ($select=:id,:updated_at,*)
+SYSTEM_COLUMNS = {":id": "row_id", ":updated_at": "source_updated_at"}
+
+
+def normalize_column(name: str) -> str:
+    name = name.strip()
+    return SYSTEM_COLUMNS.get(name) or name.lower().replace(" ", "_")
+
+
+FP_COLUMN = "row_fp"  # uuid fingerprint of the clean row a staging row normalizes to
+
+
+def staging_ddl(table: str, columns: List[str], fingerprint: Optional[str] = None) -> str:
+    """All-TEXT table; `fingerprint` (SQL expression) adds a row_fp column computed as rows are COPYed in."""
+    cols = [f"{c} TEXT" for c in columns]
+    if fingerprint:
+        cols.append(f"{FP_COLUMN} uuid GENERATED ALWAYS AS ({fingerprint}) STORED")
+    cols = ",\n    ".join(cols)
+    return f"CREATE TABLE IF NOT EXISTS {table} (\n    {cols}\n);"
+
+
+def dups_ddl(table: str) -> str:
+    # row_ids whose content another staged row already holds
+    return f"CREATE TABLE IF NOT EXISTS {table} (row_id TEXT PRIMARY KEY, {FP_COLUMN} uuid NOT NULL);"
+
+
+def dedup_insert_sql(target: str, source: str, columns: List[str], dups: str) -> str:
+    """
+    Move fingerprinted `source` rows into `target`. The unique row_fp index on
+    `target` rejects rows whose content is already staged (including earlier
+    rows of the same batch); their row_ids go to `dups`. The statement's
+    rowcount is the number of duplicates.
+    """
+    cols = ", ".join(list(columns) + [FP_COLUMN])
+    return f"""
+        WITH ins AS (
+            INSERT INTO {target} ({cols}) SELECT {cols} FROM {source}
+            ON CONFLICT ({FP_COLUMN}) DO NOTHING
+            RETURNING row_id
+        )
+        INSERT INTO {dups} (row_id, {FP_COLUMN})
+        SELECT s.row_id, s.{FP_COLUMN} FROM {source} s
+        WHERE s.row_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM ins WHERE ins.row_id = s.row_id)
+        ON CONFLICT (row_id) DO UPDATE SET {FP_COLUMN} = EXCLUDED.{FP_COLUMN};
+    """
+
+
+def upsert_dedup(cur, target: str, source: str, columns: List[str], dups: str) -> Tuple[int, int, int]:
+    """
+    Apply the fingerprinted delta `source` to the de-duplicated `target` on row_id
+    (latest source_updated_at wins within a batch). Replaced rows are deleted, the
+    delta goes in like a full-load page, and for each replaced row whose old
+    content had a recorded duplicate, that duplicate takes its place, so the
+    content stays staged. Returns (new, updated, duplicates).
+    """
+    latest, replaced = f"{source}_latest", f"{source}_replaced"
+    cur.execute(f"""
+        DROP TABLE IF EXISTS pg_temp.{latest}, pg_temp.{replaced};
+        CREATE TEMP TABLE {latest} AS
+            SELECT DISTINCT ON (row_id) * FROM {source} WHERE row_id IS NOT NULL
+            ORDER BY row_id, source_updated_at DESC NULLS LAST;
+        CREATE TEMP TABLE {replaced} AS SELECT t.* FROM {target} t JOIN {latest} d USING (row_id);
+    """)
+    cur.execute(f"SELECT COUNT(*) FROM {latest};")
+    total = cur.fetchone()[0]
+    cur.execute(f"DELETE FROM {target} t USING {latest} d WHERE t.row_id = d.row_id;")
+    updated = cur.rowcount
+    cur.execute(f"DELETE FROM {dups} x USING {latest} d WHERE x.row_id = d.row_id;")
+    updated += cur.rowcount
+    cur.execute(dedup_insert_sql(target, latest, columns, dups))
+    duplicates = cur.rowcount
+
+    cols = ", ".join(list(columns) + [FP_COLUMN])
+    promoted = ", ".join("x.row_id" if c == "row_id" else f"r.{c}" for c in columns)
+    cur.execute(f"""
+        INSERT INTO {target} ({cols})
+        SELECT DISTINCT ON (r.{FP_COLUMN}) {promoted}, r.{FP_COLUMN}
+        FROM {replaced} r JOIN {dups} x USING ({FP_COLUMN})
+        ORDER BY r.{FP_COLUMN}, x.row_id
+        ON CONFLICT ({FP_COLUMN}) DO NOTHING;
+    """)
+    cur.execute(f"DELETE FROM {dups} x USING {target} t WHERE t.row_id = x.row_id;")
+    cur.execute(f"DROP TABLE {latest}, {replaced};")
+    return total - updated, updated, duplicates
+
+
+def _copy_value(v) -> str:
+    # COPY text format: \N is NULL; backslash, tab and newlines must be escaped
+    if v is None or v != v:  # None / NaN
+        return "\\N"
+    if not isinstance(v, str):
+        v = json.dumps(v) if isinstance(v, (dict, list)) else str(v)
+    return v.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def copy_text(rows: Iterable[tuple]) -> str:
+    """Serialize tuples as COPY text-format lines."""
+    return "".join("\t".join(_copy_value(v) for v in row) + "\n" for row in rows)
+
+
+class LineStream:
+    """Read-only file-like view over a generator of strings, for `copy_expert`."""
+
+    def __init__(self, chunks: Iterable[str]):
+        self._chunks = iter(chunks)
+        self._buf = ""
+
+    def read(self, size: int = -1) -> str:
+        parts, have = [self._buf], len(self._buf)
+        while size < 0 or have < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            parts.append(chunk)
+            have += len(chunk)
+        data = "".join(parts)
+        if size < 0:
+            self._buf = ""
+            return data
+        self._buf = data[size:]
+        return data[:size]
+
+
+class CopyWriter:
+    """Streams pages into `table` over one connection checked out of `engine`'s pool."""
+
+    def __init__(self, engine, table: str, columns: List[str], fingerprint: Optional[str] = None):
+        self.engine = engine
+        self.table = table
+        self.columns = list(columns)
+        self.fingerprint = fingerprint
+        self._conn = engine.raw_connection()
+        self._warned = set()
+
+    def create_table(self, drop: bool = False, temp: bool = False):
+        with self._conn.cursor() as cur:
+            if drop:  # never let a temp table's name drop a real table
+                cur.execute(f"DROP TABLE IF EXISTS {'pg_temp.' if temp else ''}{self.table};")
+            ddl = staging_ddl(self.table, self.columns, self.fingerprint)
+            cur.execute(ddl.replace("CREATE TABLE", "CREATE TEMP TABLE") if temp else ddl)
+        self._conn.commit()
+
+    def cursor(self):
+        """Cursor on the writer's connection; work done with it commits with the next commit()."""
+        return self._conn.cursor()
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def _project(self, columns: List[str]) -> List[Optional[int]]:
+        """Map each staging column to its index in an incoming page (None if absent)."""
+        pos = {normalize_column(c): i for i, c in enumerate(columns)}
+        extra = set(pos) - set(self.columns) - self._warned
+        if extra:
+            print(f"  !! ignoring columns not in staging schema: {sorted(extra)}")
+            self._warned |= extra
+        return [pos.get(c) for c in self.columns]
+
+    def copy_stream(self, f, commit: bool = True) -> None:
+        """COPY from any object with a `read(size)` method; Postgres pulls it in 8 KiB chunks."""
+        with self._conn.cursor() as cur:
+            cur.copy_expert(f"COPY {self.table} ({', '.join(self.columns)}) FROM STDIN", f)
+        if commit:
+            self._conn.commit()
+
+    def copy(self, data: str, commit: bool = True) -> None:
+        self.copy_stream(io.StringIO(data), commit)
+
+    def write_records(self, records: List[dict], commit: bool = True) -> int:
+        """COPY a page of JSON records (list of dicts, as returned by Socrata)."""
+        if not records:
+            return 0
+        keys = list(dict.fromkeys(k for r in records for k in r))
+        idx = self._project(keys)
+        names = [keys[i] if i is not None else None for i in idx]
+        self.copy(copy_text(tuple(r.get(k) if k else None for k in names) for r in records), commit)
+        return len(records)
+
+    def write_frame(self, df, commit: bool = True) -> int:
+        """COPY a DataFrame page."""
+        if df.empty:
+            return 0
+        idx = self._project(list(df.columns))
+        cols = [df.iloc[:, i] if i is not None else [None] * len(df) for i in idx]
+        self.copy(copy_text(zip(*cols)), commit)
+        return len(df)
+
+    def write_rows(self, header: List[str], rows: Iterable[list], commit: bool = True) -> int:
+        """
+        COPY positional rows (e.g. straight off a csv.reader) without materializing
+        the page: lines are produced lazily as Postgres reads them. Values are
+        encoded as write_records encodes them: an empty field stays '', and only
+        a column missing from the page is NULL.
+        """
+        idx = self._project(header)
+        count = 0
+
+        def lines():
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield "\t".join(_copy_value(row[i]) if i is not None and i < len(row) else "\\N"
+                                for i in idx) + "\n"
+
+        self.copy_stream(LineStream(lines()), commit)
+        return count
+
+    def close(self):
+        self._conn.close()
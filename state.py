@@ -0,0 +1,113 @@
+"""
+Small key/value state kept in Postgres next to the data it describes
+(e.g. the ingest watermark), so it commits atomically with the rows.
+
+Helpers take a DB-API cursor; from SQLAlchemy use `conn.connection.cursor()`.
+"""
+from typing import Optional
+
+STATE_TABLE = "pipeline_state"
+
+STATE_DDL = f"""
+CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+    dataset_id TEXT NOT NULL,
+    key        TEXT NOT NULL,
+    value      TEXT,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (dataset_id, key)
+);
+"""
+
+
+def ensure_state_table(cur):
+    cur.execute(STATE_DDL)
+
+
+def get_state(cur, dataset_id: str, key: str) -> Optional[str]:
+    ensure_state_table(cur)
+    cur.execute(f"SELECT value FROM {STATE_TABLE} WHERE dataset_id = %s AND key = %s;", (dataset_id, key))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def set_state(cur, dataset_id: str, key: str, value: Optional[str]):
+    ensure_state_table(cur)
+    cur.execute(f"""
+        INSERT INTO {STATE_TABLE} (dataset_id, key, value) VALUES (%s, %s, %s)
+        ON CONFLICT (dataset_id, key) DO UPDATE SET value = EXCLUDED.value, updated_at = now();
+    """, (dataset_id, key, value))
+
+
+# Monotonic per-table version, bumped in the same transaction that rebuilds a
+# table; readers (e.g. the validation cache) use it as a cheap change token.
+VERSIONS_TABLE = "pipeline_table_versions"
+
+VERSIONS_DDL = f"""
+CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} (
+    table_name TEXT PRIMARY KEY,
+    version    BIGINT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+
+def bump_table_version(cur, table: str) -> int:
+    cur.execute(VERSIONS_DDL)
+    cur.execute(f"""
+        INSERT INTO {VERSIONS_TABLE} (table_name, version) VALUES (%s, 1)
+        ON CONFLICT (table_name) DO UPDATE
+            SET version = {VERSIONS_TABLE}.version + 1, updated_at = now()
+        RETURNING version;
+    """, (table,))
+    return cur.fetchone()[0]
+
+
+def get_table_version(cur, table: str) -> Optional[int]:
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (VERSIONS_TABLE,))
+    if not cur.fetchone()[0]:
+        return None
+    cur.execute(f"SELECT version FROM {VERSIONS_TABLE} WHERE table_name = %s;", (table,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+# Per-page ingest checkpoints. A page's rows and its checkpoint row commit in
+# one transaction, so after a crash every checkpointed page is fully staged and
+# no other page is; a resumed run continues at the end of the last one.
+CHECKPOINTS_TABLE = "ingest_checkpoints"
+
+CHECKPOINTS_DDL = f"""
+CREATE TABLE IF NOT EXISTS {CHECKPOINTS_TABLE} (
+    dataset_id   TEXT NOT NULL,
+    table_name   TEXT NOT NULL,
+    page_offset  BIGINT NOT NULL,
+    row_count    INTEGER NOT NULL,
+    content_hash TEXT,
+    committed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (dataset_id, table_name, page_offset)
+);
+"""
+
+
+def reset_checkpoints(cur, dataset_id: str, table: str):
+    cur.execute(CHECKPOINTS_DDL)
+    cur.execute(f"DELETE FROM {CHECKPOINTS_TABLE} WHERE dataset_id = %s AND table_name = %s;", (dataset_id, table))
+
+
+def record_checkpoint(cur, dataset_id: str, table: str, offset: int, row_count: int,
+                      content_hash: Optional[str] = None):
+    cur.execute(CHECKPOINTS_DDL)
+    cur.execute(f"""
+        INSERT INTO {CHECKPOINTS_TABLE} (dataset_id, table_name, page_offset, row_count, content_hash)
+        VALUES (%s, %s, %s, %s, %s);
+    """, (dataset_id, table, offset, row_count, content_hash))
+
+
+def resume_offset(cur, dataset_id: str, table: str) -> int:
+    """Offset just past the last checkpointed page (0 when nothing was checkpointed)."""
+    cur.execute(CHECKPOINTS_DDL)
+    cur.execute(f"""
+        SELECT COALESCE(MAX(page_offset + row_count), 0) FROM {CHECKPOINTS_TABLE}
+        WHERE dataset_id = %s AND table_name = %s;
+    """, (dataset_id, table))
+    return cur.fetchone()[0]
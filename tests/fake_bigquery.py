@@ -0,0 +1,71 @@
+"""
+An in-memory stand-in for google.cloud.bigquery.Client, enough for bq_loader.
+
+Tables are Arrow tables (dictionary columns decoded, as BigQuery stores them
+as STRING). It understands Parquet load jobs (WRITE_TRUNCATE / WRITE_APPEND)
+and the partition-replacing MERGE of bq_loader.merge_sql; any other query
+raises. Every job is recorded in `jobs` as (kind, table_id, bytes).
+"""
+import re, threading
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from google.api_core.exceptions import BadRequest, NotFound
+
+_MERGE = re.compile(r"MERGE `([^`]+)` T USING `([^`]+)` S ON FALSE\n.*T\.(\w+) IN UNNEST\(@keys\)", re.S)
+
+
+class _Job:
+    def result(self):
+        return self
+
+
+class FakeClient:
+    def __init__(self):
+        self.datasets, self.tables, self.jobs = set(), {}, []
+        self._lock = threading.Lock()
+
+    def get_dataset(self, dataset_id):
+        if dataset_id not in self.datasets:
+            raise NotFound(dataset_id)
+
+    def create_dataset(self, dataset):
+        self.datasets.add(f"{dataset.project}.{dataset.dataset_id}")
+
+    def get_table(self, table_id):
+        if table_id not in self.tables:
+            raise NotFound(table_id)
+        return self.tables[table_id]
+
+    def delete_table(self, table_id, not_found_ok=False):
+        if self.tables.pop(table_id, None) is None and not not_found_ok:
+            raise NotFound(table_id)
+
+    def load_table_from_file(self, f, table_id, job_config):
+        data = f.read()
+        table = pq.read_table(pa.BufferReader(data))
+        table = pa.table({n: c.cast(pa.string()) for n, c in zip(table.column_names, table.columns)})
+        with self._lock:
+            if job_config.write_disposition == "WRITE_TRUNCATE" or table_id not in self.tables:
+                self.tables[table_id] = table
+            else:
+                self.tables[table_id] = pa.concat_tables([self.tables[table_id], table])
+            self.jobs.append(("load", table_id, len(data)))
+        return _Job()
+
+    def query(self, sql, job_config=None):
+        m = _MERGE.match(sql)
+        if not m:
+            raise BadRequest(f"unsupported query: {sql}")
+        target_id, staging_id, column = m.groups()
+        params = {p.name: p for p in job_config.query_parameters}
+        keys = list(params["keys"].values) + ([None] if params["null_key"].value else [])
+        with self._lock:
+            target, staged = self.get_table(target_id), self.get_table(staging_id)
+            if staged.column_names != target.column_names:
+                raise BadRequest("INSERT ROW: staging and target columns differ")
+            kept = target.filter(pc.invert(pc.is_in(target[column], value_set=pa.array(keys, pa.string()))))
+            self.tables[target_id] = pa.concat_tables([kept, staged])
+            self.jobs.append(("merge", target_id, 0))
+        return _Job()
@@ -0,0 +1,25 @@
+"""Helpers for tests that need the Postgres from docker-compose (PG_* env vars)."""
+import os, unittest
+from sqlalchemy import create_engine, text
+
+
+def pg_engine():
+    engine = create_engine(
+        f"postgresql+psycopg2://{os.getenv('PG_USER', 'ph')}:{os.getenv('PG_PASSWORD', 'ph')}"
+        f"@{os.getenv('PG_HOST', 'localhost')}:{os.getenv('PG_PORT', '5433')}/{os.getenv('PG_DB', 'public_health')}",
+        pool_pre_ping=True,
+    )
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception as e:
+        raise unittest.SkipTest(f"Postgres not reachable: {e.__class__.__name__}")
+    return engine
+
+
+def delete_profiles(conn, *tables):
+    """Delete the column profiles (data_profile.py) that ingest runs stored for the staging `tables`."""
+    import data_profile
+    conn.execute(text(data_profile.PROFILES_DDL))  # may not exist yet if the test failed early
+    conn.execute(text(f"DELETE FROM {data_profile.PROFILES_TABLE} WHERE table_name = ANY(:tables);"),
+                 {"tables": list(tables)})
@@ -0,0 +1,180 @@
+"""
+A minimal local stand-in for a Socrata resource endpoint.
+
+Serves `/resource/<dataset_id>.json` and `.csv` from a sequence of rows (a
+list, or benchmarks.synth.SyntheticCases for datasets too big to hold) and honours `$limit` / `$offset`, simple `$where` comparisons joined by AND
+(e.g. `:updated_at > '2024-01-01T00:00:00.000Z'`) and `$select` lists of
+fields (`*` for all of them; system fields only when named; 400 for a field
+the dataset does not have). Responses are gzipped when the client accepts it.
+
+Run standalone (e.g. for benchmarks, so the server's own allocations are out of
+process):  python -m tests.socrata_stub --rows 10000000 --dirty 0.05 --port 8765
+"""
+import argparse, csv, gzip, io, json, operator, re, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+def make_rows(n: int):
+    states = ["NY", "CA", "TX", "FL", "WA"]
+    return [
+        {":id": f"row-{i:08d}", ":updated_at": "2024-01-01T00:00:00.000Z",
+         "case_month": f"2021-{(i % 12) + 1:02d}", "res_state": states[i % len(states)],
+         "sex": "Male" if i % 2 else "Female", "row_no": str(i)}
+        for i in range(n)
+    ]
+
+
+SYSTEM_FIELDS = (":id", ":updated_at", ":created_at")
+_OPS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le, "=": operator.eq, "!=": operator.ne}
+_CLAUSE = re.compile(r"^\s*(:?\w+)\s*(>=|<=|!=|>|<|=)\s*'([^']*)'\s*$")
+
+
+def parse_where(where: str):
+    """Compile a conjunction of `field op 'literal'` clauses into a row predicate."""
+    clauses = []
+    for part in re.split(r"\s+AND\s+", where, flags=re.IGNORECASE):
+        m = _CLAUSE.match(part)
+        if not m:
+            raise ValueError(f"unsupported $where clause: {part!r}")
+        clauses.append((m.group(1), _OPS[m.group(2)], m.group(3)))
+    return lambda row: all(row.get(f) is not None and op(row[f], v) for f, op, v in clauses)
+
+
+def to_csv(rows, columns):
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, fieldnames=columns, lineterminator="\n")
+    w.writeheader()
+    w.writerows(rows)
+    return buf.getvalue()
+
+
+class SocrataStub:
+    def __init__(self, rows, dataset_id="test-0001", port=0):
+        self.dataset_id = dataset_id
+        self.datasets = {}  # dataset_id -> (rows, columns); add_dataset serves more than one
+        self.add_dataset(dataset_id, rows)
+        self.requests = []  # (path, params) for every request served
+        self.fail_offsets = set()  # fault injection: $offset values answered with HTTP 500
+        self.faults = {}  # transient faults: $offset -> statuses to answer with, one per request
+        self.retry_after = "0"  # Retry-After sent with injected 429s
+        self.last_modified = "Mon, 01 Jan 2024 00:00:00 GMT"  # sent as X-SODA2-Truth-Last-Modified
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def add_dataset(self, dataset_id, rows):
+        # like Socrata, the CSV header lists every column even when a page lacks some
+        columns = getattr(rows, "columns", None) or list(dict.fromkeys(k for r in rows for k in r))
+        self.datasets[dataset_id] = (rows, columns)
+
+    @property
+    def rows(self):
+        return self.datasets[self.dataset_id][0]
+
+    @property
+    def columns(self):
+        return self.datasets[self.dataset_id][1]
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def page(self, params, dataset_id=None):
+        limit = int(params.get("$limit", 1000))
+        offset = int(params.get("$offset", 0))
+        rows = self.datasets[dataset_id or self.dataset_id][0]
+        if params.get("$where"):
+            rows = list(filter(parse_where(params["$where"]), rows))
+        wanted = set(self.columns_for(params, dataset_id))
+        return [{k: v for k, v in r.items() if k in wanted} for r in rows[offset:offset + limit]]
+
+    def columns_for(self, params, dataset_id=None):
+        # system fields (":id", ":updated_at") are only returned when selected
+        selected = {f.strip() for f in params.get("$select", "*").split(",")}
+        return [c for c in self.datasets[dataset_id or self.dataset_id][1]
+                if c in selected or ("*" in selected and not c.startswith(":"))]
+
+    def unknown_fields(self, params, dataset_id=None):
+        columns = self.datasets[dataset_id or self.dataset_id][1]
+        return [f for f in (f.strip() for f in params.get("$select", "*").split(","))
+                if f != "*" and f not in columns and f not in SYSTEM_FIELDS]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                with stub._lock:
+                    stub.requests.append((url.path, params))
+                base, _, ext = url.path.rpartition(".")
+                dataset_id = base[len("/resource/"):] if base.startswith("/resource/") else None
+                if dataset_id not in stub.datasets or ext not in ("json", "csv"):
+                    self.send_error(404, "dataset not found")
+                    return
+                offset = int(params.get("$offset", 0))
+                with stub._lock:
+                    fault = stub.faults[offset].pop(0) if stub.faults.get(offset) else None
+                if fault:
+                    self.send_response(fault)
+                    if fault == 429:
+                        self.send_header("Retry-After", stub.retry_after)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if offset in stub.fail_offsets:
+                    self.send_error(500, "injected failure")
+                    return
+                unknown = stub.unknown_fields(params, dataset_id)
+                if unknown:  # like Socrata, which answers 400 "no-such-column"
+                    self.send_error(400, f"No such column: {unknown[0]}")
+                    return
+                rows = stub.page(params, dataset_id)
+                if ext == "csv":
+                    body, ctype = to_csv(rows, stub.columns_for(params, dataset_id)).encode(), "text/csv"
+                else:
+                    body, ctype = json.dumps(rows).encode(), "application/json"
+                self.send_response(200)
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body, compresslevel=1)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Type", ctype)
+                self.send_header("X-SODA2-Truth-Last-Modified", stub.last_modified)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    from benchmarks.synth import SyntheticCases
+    ap = argparse.ArgumentParser(description="Serve synthetic CDC rows as a Socrata resource.")
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--dataset-id", default="test-0001")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--dirty", type=float, default=0.0, help="per-field chance of a messy raw value")
+    args = ap.parse_args()
+    stub = SocrataStub(SyntheticCases(args.rows, args.seed, args.dirty), args.dataset_id, args.port)
+    print(f"Serving {args.rows:,} rows at {stub.base_url}/resource/{args.dataset_id}.json", flush=True)
+    stub.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import unittest
+import pyarrow as pa
+from sqlalchemy import text
+
+import arrow_clean, partitions, staging
+from benchmarks.synth import make_case_rows
+from tests.pg import pg_engine
+
+SRC = "test_arrow_raw"
+
+# values each rule has a branch for: NULL vs '', case, unmapped and future/malformed months
+EDGE_ROWS = [
+    {"case_month": "", "res_state": "ny", "sex": None, "hosp_yn": "", "current_status": None},
+    {"case_month": None, "res_state": None, "sex": "mAlE", "hosp_yn": "yEs", "current_status": ""},
+    {"case_month": "2999-01", "res_state": "CA", "sex": "Female"},
+    {"case_month": "2020-13", "res_state": "tx", "sex": "F"},
+    {"case_month": "20-01", "res_state": "Wa", "icu_yn": "N/A", "death_yn": "no"},
+    {"case_month": "2021-03", "res_state": "", "sex": "Male"},
+    {"case_month": "2021-03", "res_state": "N.Y.", "sex": "Male"},
+    {"case_month": "2021-03", "res_state": "fl", "res_county": 'O"Brien, "X"\nline'},
+    {"case_month": "2021-03", "res_state": "fl", "res_county": 'O"Brien, "X"\nline'},  # duplicate
+]
+
+
+class TestCleanTable(unittest.TestCase):
+    def test_rules(self):
+        raw = pa.table({"case_month": ["2021-03", "", "2999-01", None],
+                        "res_state": ["ny", "ca", "TX", "N.Y."],
+                        "sex": ["female", None, "M", "Male"],
+                        "current_status": ["Confirmed Case", "confirmed case", None, "Probable Case"]})
+        out = arrow_clean.clean_table(raw, raw.column_names, "2024-06").to_pylist()
+        self.assertEqual(out, [
+            {"case_month": "2021-03", "res_state": "NY", "sex": "Female", "current_status": "Confirmed Case"},
+            {"case_month": None, "res_state": "CA", "sex": "Unknown", "current_status": "Probable Case"},
+        ])
+
+    def test_distinct_keeps_null_apart_from_empty(self):
+        raw = pa.table({"case_month": ["2021-03"] * 4, "res_state": ["NY"] * 4,
+                        "age_group": ["", None, "", None]})
+        out = arrow_clean.clean_table(raw, raw.column_names, "2024-06")
+        self.assertEqual(sorted(out["age_group"].to_pylist(), key=str), ["", None])
+        self.assertEqual(arrow_clean.clean_table(raw, raw.column_names, "2024-06", distinct=False).num_rows, 4)
+
+
+class TestSqlParity(unittest.TestCase):
+    def setUp(self):
+        self.engine = pg_engine()
+        rows = list(make_case_rows(5000, seed=11, dirty=0.4))
+        rows += [dict(rows[0], **r) for r in EDGE_ROWS]
+        self.cols = staging.CDC_CASE_COLUMNS
+        writer = staging.CopyWriter(self.engine, SRC, self.cols)
+        try:
+            writer.create_table(drop=True)
+            writer.write_records(rows)
+        finally:
+            writer.close()
+
+    def tearDown(self):
+        with self.engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {SRC}, {SRC}_sql, {SRC}_arrow;"))
+
+    def mismatched(self):
+        with self.engine.begin() as conn:
+            return conn.execute(text(
+                f"SELECT (SELECT COUNT(*) FROM (SELECT * FROM {SRC}_sql EXCEPT ALL SELECT * FROM {SRC}_arrow) a)"
+                f" + (SELECT COUNT(*) FROM (SELECT * FROM {SRC}_arrow EXCEPT ALL SELECT * FROM {SRC}_sql) b)"
+            )).scalar()
+
+    def test_row_for_row(self):
+        for distinct in (True, False):
+            with self.subTest(distinct=distinct):
+                sql = partitions.rebuild(self.engine, SRC, f"{SRC}_sql", self.cols, distinct=distinct, backend="sql")
+                arrow = partitions.rebuild(self.engine, SRC, f"{SRC}_arrow", self.cols, distinct=distinct,
+                                           workers=3, backend="arrow")
+                self.assertEqual((arrow["rows"], arrow["partitions"]), (sql["rows"], sql["partitions"]))
+                self.assertGreater(sql["rows"], 1000)
+                self.assertEqual(self.mismatched(), 0)
+
+    def test_unknown_backend(self):
+        with self.assertRaisesRegex(ValueError, "unknown clean backend"):
+            partitions.rebuild(self.engine, SRC, f"{SRC}_sql", self.cols, backend="nope")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
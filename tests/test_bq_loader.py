@@ -0,0 +1,107 @@
+import os, tempfile, unittest
+from collections import Counter
+import pyarrow.parquet as pq
+from sqlalchemy import text
+
+import bq_loader, partitions, staging
+from benchmarks.synth import make_case_rows
+from tests.fake_bigquery import FakeClient
+from tests.pg import pg_engine
+
+
+class TestParquetExport(unittest.TestCase):
+    def test_files_split_by_rows(self):
+        batches = [[(str(i), "NY") for i in range(j, j + 40)] for j in range(0, 200, 40)]
+        with tempfile.TemporaryDirectory() as tmp:
+            files = bq_loader.write_parquet_files(["n", "state"], batches, tmp, rows_per_file=100)
+            self.assertEqual(len(files), 2)  # 120 + 80 rows: files roll over at batch boundaries
+            self.assertEqual([r["n"] for f in files for r in pq.read_table(f).to_pylist()],
+                             [str(i) for i in range(200)])
+
+    def test_empty_table_still_truncates_target(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            files = bq_loader.write_parquet_files(["n"], [], tmp)
+            target = bq_loader.LocalTarget(tmp, "ds", "t")
+            target.ensure_dataset()
+            with open(os.path.join(target.path, "stale.parquet"), "wb"):
+                pass
+            target.load_parquet(files[0], truncate=True)
+            self.assertEqual(os.listdir(target.path), ["part-00000.parquet"])
+            self.assertEqual(target.read().num_rows, 0)
+
+
+class TestLoadTable(unittest.TestCase):
+    def test_export_and_parallel_load(self):
+        engine = pg_engine()
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS test_bq_export;"
+                              "CREATE TABLE test_bq_export AS SELECT g::text AS n, 'NY'::text AS res_state "
+                              "FROM generate_series(1, 2500) g;"))
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                target = bq_loader.LocalTarget(tmp, "ds", "t")
+                stats = bq_loader.load_table(engine, "test_bq_export", target, workers=3,
+                                             rows_per_file=1000, batch_rows=500)
+                self.assertEqual((stats["rows"], stats["files"], target.read().num_rows), (2500, 3, 2500))
+                self.assertGreater(stats["upload_bytes"], 0)
+        finally:
+            with engine.begin() as conn:
+                conn.execute(text("DROP TABLE IF EXISTS test_bq_export;"))
+
+
+class TestSyncTable(unittest.TestCase):
+    SRC, CLEAN = "test_bq_sync_raw", "test_bq_sync_clean"
+
+    def setUp(self):
+        self.engine = pg_engine()
+        self.cols = staging.CDC_CASE_COLUMNS
+        writer = staging.CopyWriter(self.engine, self.SRC, self.cols)
+        try:
+            writer.create_table(drop=True)
+            writer.write_records(list(make_case_rows(20000, seed=3)))
+        finally:
+            writer.close()
+        partitions.rebuild(self.engine, self.SRC, self.CLEAN, self.cols)
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        with self.engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {self.SRC}, {self.CLEAN};"
+                              f"DELETE FROM pipeline_state WHERE dataset_id = 'test_bq_sync';"))
+
+    def clean_rows(self):
+        with self.engine.begin() as conn:
+            return Counter(map(tuple, conn.execute(text(f"SELECT * FROM {self.CLEAN}")).fetchall()))
+
+    def sync(self, target):
+        return bq_loader.sync_table(self.engine, self.CLEAN, target, "test_bq_sync", workers=2, rows_per_file=1000)
+
+    def check_sync(self, target, read):
+        full = self.sync(target)
+        self.assertEqual((full["mode"], full["partitions"]), ("full", 36))
+        self.assertEqual(Counter(tuple(r.values()) for r in read().to_pylist()), self.clean_rows())
+        self.assertEqual(self.sync(target)["mode"], "unchanged")
+
+        with self.engine.begin() as conn:
+            conn.execute(text(f"UPDATE {self.SRC} SET sex = 'F' WHERE case_month = '2021-05'"))
+            conn.execute(text(f"UPDATE {self.SRC} SET case_month = '2021-07' WHERE case_month = '2021-06'"))
+        partitions.rebuild(self.engine, self.SRC, self.CLEAN, self.cols, keys=["2021-05", "2021-06", "2021-07"])
+        merged = self.sync(target)
+        self.assertEqual((merged["mode"], merged["partitions"]), ("merge", 3))  # 2021-06 only deleted
+        self.assertLess(merged["upload_bytes"] * 4, full["upload_bytes"])
+        self.assertEqual(Counter(tuple(r.values()) for r in read().to_pylist()), self.clean_rows())
+
+    def test_bigquery_merges_changed_partitions(self):
+        client = FakeClient()
+        self.check_sync(bq_loader.BigQueryTarget("proj", "ds", "t", client=client),
+                        lambda: client.get_table("proj.ds.t"))
+        self.assertEqual([kind for kind, _, _ in client.jobs].count("merge"), 1)
+        self.assertNotIn("proj.ds.t__sync", client.tables)
+
+    def test_local_target_replaces_partitions(self):
+        target = bq_loader.LocalTarget(self.tmp.name, "ds", "t")
+        self.check_sync(target, target.read)
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
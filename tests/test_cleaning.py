@@ -0,0 +1,35 @@
+import unittest
+import cleaning, staging
+
+
+class TestCompileCleanSQL(unittest.TestCase):
+    def test_single_statement_without_catalog_lookups(self):
+        sql = cleaning.compile_clean_sql("stg", "clean", staging.CDC_CASE_COLUMNS)
+        self.assertTrue(sql.startswith("CREATE UNLOGGED TABLE clean AS"))
+        self.assertEqual(sql.count(";"), 1)
+        self.assertNotIn("information_schema", sql)
+        self.assertNotIn("UPDATE", sql)
+        self.assertIn("SELECT DISTINCT", sql)
+
+    def test_missing_columns(self):
+        sql = cleaning.select_sql("stg", ["sex", "hosp_yn"])
+        # required columns are emitted as NULL, optional ones are dropped
+        self.assertIn("CAST(NULL AS text) AS case_month", sql)
+        self.assertIn("CAST(NULL AS text) AS res_state", sql)
+        self.assertNotIn("icu_yn", sql)
+        self.assertIn("ELSE 'Unknown' END AS hosp_yn", sql)
+
+    def test_filters_apply_to_normalized_values(self):
+        sql = cleaning.select_sql("stg", ["case_month", "res_state"])
+        inner, outer = sql.split(") n")
+        self.assertIn("UPPER(res_state) AS res_state", inner)
+        self.assertIn("res_state ~ '^[A-Z]{2}$'", outer)
+        self.assertIn("to_char(CURRENT_DATE, 'YYYY-MM')", outer)
+
+    def test_literals_are_quoted(self):
+        rule = cleaning.ColumnRule("x", "allowed", ("O'Brien",), default="n/a")
+        self.assertIn("'O''Brien'", cleaning.column_sql(rule))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
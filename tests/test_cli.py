@@ -0,0 +1,87 @@
+import contextlib, io, json, os, subprocess, sys, tempfile, unittest
+from sqlalchemy import text
+
+import orchestrator, partitions, staging
+from benchmarks.synth import make_case_rows
+from tests.pg import pg_engine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("pandas", "pyarrow", "sqlalchemy", "google.cloud.bigquery")
+
+
+def python(code, cwd, **env):
+    """Run `code` in a fresh interpreter without DATASET_ID/GCP_PROJECT_ID; returns the CompletedProcess."""
+    env = dict({k: v for k, v in os.environ.items() if k not in ("DATASET_ID", "GCP_PROJECT_ID")},
+               PYTHONPATH=ROOT, **env)
+    return subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True)
+
+
+def loaded(code):
+    return f"{code}\nimport sys; print(*[m for m in {HEAVY!r} if m in sys.modules])"
+
+
+class TestParseArgs(unittest.TestCase):
+    def test_bare_flags_mean_run(self):
+        args = orchestrator.parse_args([])
+        self.assertEqual((args.command, args.resume, args.api), ("run", False, True))
+        args = orchestrator.parse_args(["--resume", "--datasets", "d.json"])
+        self.assertEqual((args.command, args.resume, args.datasets), ("run", True, "d.json"))
+
+    def test_subcommands(self):
+        self.assertTrue(orchestrator.parse_args(["transform", "--full"]).full)
+        args = orchestrator.parse_args(["ingest", "--incremental"])
+        self.assertEqual((args.command, args.incremental, args.skip_ingest), ("ingest", True, False))
+        self.assertEqual(orchestrator.parse_args(["validate"]).api, False)
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            orchestrator.parse_args(["load", "--resume"])  # only ingest and run fetch
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_cli_imports_no_backend(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            out = python(loaded("import orchestrator"), tmp)
+            self.assertEqual(out.returncode, 0, out.stderr)
+            self.assertEqual(out.stdout.strip(), "")
+            self.assertEqual(python("import orchestrator; orchestrator.main(['--help'])", tmp).returncode, 0)
+
+    def test_api_imports_no_dataframes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            out = python(loaded("import validation_api"), tmp)  # pandas only loads for /profiles
+            self.assertEqual(out.returncode, 0, out.stderr)
+            self.assertEqual(out.stdout.strip(), "sqlalchemy")
+
+
+class TestValidateCommand(unittest.TestCase):
+    def setUp(self):
+        self.engine = pg_engine()
+        writer = staging.CopyWriter(self.engine, "stg_cli_a_raw", staging.CDC_CASE_COLUMNS)
+        try:
+            writer.create_table(drop=True)
+            writer.write_records(list(make_case_rows(2000, seed=4)))
+        finally:
+            writer.close()
+        partitions.rebuild(self.engine, "stg_cli_a_raw", "stg_cli_a_clean", staging.CDC_CASE_COLUMNS)
+
+    def tearDown(self):
+        with self.engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS stg_cli_a_raw, stg_cli_a_clean;"))
+            conn.execute(text("DELETE FROM validation_partials WHERE table_name = 'stg_cli_a_clean';"))
+
+    def test_validate_without_gcp_settings(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "datasets.json")
+            with open(path, "w") as f:
+                json.dump([{"name": "cli_a", "dataset_id": "cli-000a"}], f)
+            out = python(loaded(f"import orchestrator; orchestrator.main(['validate', '--datasets', {path!r}])"), tmp)
+            self.assertEqual(out.returncode, 0, out.stdout[-2000:] + out.stderr[-2000:])
+            self.assertIn("cli_a | DATASET_STATUS=SUCCESS", out.stdout)
+            # validation reads Postgres; the fetch and load backends stay unloaded
+            self.assertEqual(out.stdout.strip().splitlines()[-1], "sqlalchemy")
+
+            out = python("import orchestrator; orchestrator.main(['load'])", tmp, LOAD_TARGET_DIR="")
+            self.assertEqual(out.returncode, 1)
+            self.assertIn("Set DATASET_ID", out.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
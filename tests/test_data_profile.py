@@ -0,0 +1,162 @@
+import random, tempfile, unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import data_profile, datasets, encoding, metrics, pipeline, validation_api
+from benchmarks.synth import make_case_rows
+from tests.pg import delete_profiles, pg_engine
+from tests.socrata_stub import SocrataStub, make_rows
+
+T = "test_profile_raw"
+
+
+def frame(rows):
+    return pd.DataFrame([dict(r, **{":id": f"row-{i}"}) for i, r in enumerate(rows)])
+
+
+def exact(profile):
+    """Everything a profile counts, with top values as dicts (ties have no order)."""
+    out = data_profile.summary(profile, months=True)
+    for c, v in profile.columns.items():
+        out["columns"][c]["top"] = (v["top"].counts, v["top"].errors, v["hll"].registers.tolist())
+    for m, v in profile.months.items():
+        out["months"][m]["top"] = {c: t.counts for c, t in v["top"].items()}
+    return out
+
+
+class TestSketches(unittest.TestCase):
+    def test_hyperloglog(self):
+        values = np.array([f"v{i}" for i in range(20000)], dtype=object)
+        whole, a, b = data_profile.HyperLogLog(), data_profile.HyperLogLog(), data_profile.HyperLogLog()
+        whole.add_hashes(pd.util.hash_array(values))
+        a.add_hashes(pd.util.hash_array(values[:12000]))
+        b.add_hashes(pd.util.hash_array(values[8000:]))  # overlapping halves
+        self.assertLess(abs(whole.estimate() - 20000), 20000 * 0.05)
+        self.assertTrue((a.merge(b).registers == whole.registers).all())
+        self.assertEqual(data_profile.HyperLogLog.from_dict(whole.to_dict()).estimate(), whole.estimate())
+
+    def test_space_saving_bounds(self):
+        rnd = random.Random(3)
+        data = [f"k{min(int(rnd.paretovariate(1.2)), 500)}" for _ in range(20000)]
+        truth = pd.Series(data).value_counts()
+        summary = data_profile.SpaceSaving(10)
+        for i in range(0, len(data), 1000):  # one exact, truncated summary per "page", merged
+            counts = pd.Series(data[i:i + 1000]).value_counts()
+            page = data_profile.SpaceSaving.from_arrays(counts.index.to_numpy(), counts.to_numpy(), 10)
+            summary = summary.merge(page)
+        self.assertEqual([v for v, _, _ in summary.top(3)], list(truth.index[:3]))
+        for v, n, err in summary.top():
+            self.assertTrue(n - err <= truth[v] <= n, (v, n, err, truth[v]))
+        self.assertLessEqual(max(truth[v] for v in truth.index if v not in summary.counts), summary.floor)
+
+
+class TestProfile(unittest.TestCase):
+    def test_pages_match_one_frame(self):
+        df = frame(make_case_rows(6000, seed=7, dirty=0.2))
+        # summaries wide enough to hold every value, so merged pages must match exactly
+        whole, paged = (data_profile.Profile(top_k=len(df), month_top_k=len(df)) for _ in range(2))
+        whole.add_frame(df)
+        for i in range(0, len(df), 2000):  # categoricals and plain objects, as fetch and pipelined pages come
+            page = df.iloc[i:i + 2000].reset_index(drop=True)
+            paged.add_frame(encoding.categorize(page) if i % 4000 else page)
+        paged = data_profile.Profile.from_dict(paged.to_dict())
+        self.assertEqual(exact(paged), exact(whole))
+        sex = df["sex"][df["sex"].notna() & (df["sex"] != "")]
+        s = data_profile.summary(whole)["columns"]["sex"]
+        self.assertEqual(s["nulls"], len(df) - len(sex))
+        self.assertEqual(s["distinct"], sex.nunique())
+        self.assertEqual([(t["value"], t["count"]) for t in s["top"]], list(sex.value_counts().items())[:10])
+        self.assertEqual(set(data_profile.summary(whole)["months"]), set(df["case_month"]))
+
+    def test_drift(self):
+        base = data_profile.Profile()
+        base.add_frame(frame(make_case_rows(4000, seed=1)))
+        same = data_profile.Profile()
+        same.add_frame(frame(make_case_rows(4000, seed=2)))
+        self.assertEqual(data_profile.drift(same, base)["drifted"], [])
+
+        rows = list(make_case_rows(4000, seed=2))
+        for i, r in enumerate(rows):
+            if i % 3 == 0:
+                r["sex"] = ""           # null rate up by a third
+            if i % 2 == 0:
+                r["res_state"] = "ZZ"   # a new dominant value
+        shifted = data_profile.Profile()
+        shifted.add_frame(frame(rows))
+        out = data_profile.drift(shifted, base)
+        self.assertEqual(out["drifted"], ["res_state", "sex"])
+        self.assertEqual(out["columns"]["sex"]["reasons"], ["null_rate"])
+        self.assertIn("ZZ", out["columns"]["res_state"]["new_top_values"])
+
+
+class TestIngestProfiles(unittest.TestCase):
+    def setUp(self):
+        self.engine = pg_engine()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        with self.engine.begin() as conn:
+            for table in (T, "stg_prof_b_raw"):
+                conn.execute(text(f"DROP TABLE IF EXISTS {table}, {table}_dups;"))
+            conn.execute(text("DELETE FROM pipeline_state WHERE dataset_id = 'prof-0001';"))
+            conn.execute(text("DELETE FROM ingest_checkpoints WHERE dataset_id = 'prof-0001';"))
+            delete_profiles(conn, T, "stg_prof_b_raw")
+
+    def ingest(self, rows, run_id, *configs):
+        run = metrics.start_run(run_id, self.tmp.name, profile="")
+        with SocrataStub(rows, "prof-0001") as stub, mock.patch.object(pipeline, "SETTINGS", pipeline.SETTINGS.replace(
+                cdc_base_url=stub.base_url, dataset_id=stub.dataset_id, page_size=100, fetch_workers=1,
+                rate_limit=0, max_rows=0, ingest_mode="frame", staging_table=T, max_retries=0)):
+            for cfg in configs or [None]:
+                pipeline.stage_to_postgres(cfg=cfg)
+        run.close("success", 0)
+        return run
+
+    def test_profiles_stored_per_run_and_compared(self):
+        rows = make_rows(300)
+        self.ingest(rows, "prof_a")
+        run = self.ingest([dict(r, sex="") if i % 2 else r for i, r in enumerate(rows)], "prof_b")
+        event = [e for e in metrics.read_run(run.path) if e["event"] == "data_profile"][0]
+        self.assertEqual((event["rows"], event["mode"]), (300, "full"))
+
+        runs = validation_api.profiles("prof-0001")
+        self.assertEqual([(r["run_id"], r["table"]) for r in runs], [("prof_b", T), ("prof_a", T)])
+        latest = validation_api.profile("prof-0001")
+        self.assertEqual((latest["run"]["run_id"], latest["rows"]), ("prof_b", 300))
+        self.assertEqual(latest["columns"]["sex"]["null_rate"], 0.5)
+
+        out = validation_api.profile_drift("prof-0001")
+        self.assertEqual((out["run"]["run_id"], out["baseline"]["run_id"]), ("prof_b", "prof_a"))
+        self.assertIn("sex", out["drifted"])
+        back = validation_api.profile_drift("prof-0001", run_id="prof_a", baseline_run_id="prof_b")
+        self.assertEqual(back["columns"]["sex"]["null_rate"], 0.0)
+        with self.assertRaises(validation_api.HTTPException):
+            validation_api.profile_drift("prof-0001", run_id="prof_a")  # nothing before it
+
+    def test_configs_sharing_a_dataset(self):
+        rows = make_rows(300)
+        a = datasets.DatasetConfig("prof_a", "prof-0001", staging_table=T)
+        b = datasets.DatasetConfig.from_dict({"name": "prof_b", "dataset_id": "prof-0001",
+                                              "columns": ["case_month", "res_state"]})
+        self.ingest(rows, "prof_c", a, b)  # one run, two profiles
+        self.ingest([dict(r, sex="") for r in rows], "prof_d", a)
+        runs = validation_api.profiles("prof-0001")
+        self.assertEqual([(r["run_id"], r["table"]) for r in runs][1:], [("prof_c", "stg_prof_b_raw"), ("prof_c", T)])
+        narrow = validation_api.profile("prof-0001", table="stg_prof_b_raw")
+        self.assertEqual((narrow["run"]["run_id"], sorted(narrow["columns"])), ("prof_c", ["case_month", "res_state"]))
+        out = validation_api.profile_drift("prof-0001")  # a's latest run against a's previous one, not b's
+        self.assertEqual((out["run"]["table"], out["baseline"]["table"], out["baseline"]["run_id"]), (T, T, "prof_c"))
+        self.assertEqual(out["drifted"], ["sex"])
+        with self.assertRaises(validation_api.HTTPException):
+            validation_api.profile_drift("prof-0001", table="stg_prof_b_raw")
+
+    def test_disabled(self):
+        with mock.patch.object(pipeline, "SETTINGS", pipeline.SETTINGS.replace(data_profile=False)):
+            self.assertIsNone(pipeline.new_profile())
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
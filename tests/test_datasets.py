@@ -0,0 +1,186 @@
+import json, os, tempfile, unittest
+import requests
+from unittest import mock
+from sqlalchemy import text
+
+os.environ.setdefault("DATASET_ID", "test-0001")
+os.environ.setdefault("GCP_PROJECT_ID", "test-project")
+import datasets, metrics, orchestrator, pipeline, socrata
+from tests.pg import delete_profiles, pg_engine
+from tests.socrata_stub import SocrataStub, make_rows
+
+
+def rows(n, tag):
+    return [dict(r, res_county=f"{tag} {i}") for i, r in enumerate(make_rows(n))]
+
+
+class TestDatasetConfig(unittest.TestCase):
+    def test_defaults_namespace_tables(self):
+        cfg = datasets.DatasetConfig("cases", "n8mc-b4w4")
+        self.assertEqual((cfg.staging_table, cfg.clean_table, cfg.bq_table),
+                         ("stg_cases_raw", "stg_cases_clean", "cases"))
+        self.assertEqual(cfg.staging_columns[:2], ("row_id", "source_updated_at"))
+        self.assertIs(cfg.rules, datasets.RULE_SETS["cdc_cases"])
+
+    def test_load_configs(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump([{"name": "a", "dataset_id": "aaaa-0001", "columns": ["Case Month", "res_state"]},
+                       {"name": "b", "dataset_id": "bbbb-0001", "clean_table": "stg_a_clean"}], f)
+        self.addCleanup(os.remove, f.name)
+        with self.assertRaisesRegex(ValueError, "both use table stg_a_clean"):
+            datasets.load_configs(f.name)
+        with open(f.name, "w") as out:
+            json.dump([{"name": "a", "dataset_id": "aaaa-0001"},
+                       {"name": "b", "dataset_id": "aaaa-0001", "bq_table": "a"}], out)
+        with self.assertRaisesRegex(ValueError, "both use BigQuery table a"):
+            datasets.load_configs(f.name)
+        with self.assertRaisesRegex(ValueError, "unknown rule set"):
+            datasets.DatasetConfig("c", "cccc-0001", rule_set="nope")
+        with self.assertRaisesRegex(ValueError, "lower-case identifier"):
+            datasets.DatasetConfig("C-1", "cccc-0001")
+
+    def test_rejects_names_that_are_not_identifiers(self):
+        for bad in ({"staging_table": "stg_c; DROP TABLE stg_cdc_clean"}, {"clean_table": "public.stg_c"},
+                    {"bq_table": "Cases"}, {"columns": ["case_month", "res_state); --"]}):
+            with self.subTest(bad=bad), self.assertRaisesRegex(ValueError, "not a plain identifier"):
+                datasets.DatasetConfig.from_dict(dict({"name": "c", "dataset_id": "cccc-0001"}, **bad))
+        s = pipeline.SETTINGS
+        datasets.DatasetConfig("cdc", "cccc-0001", s.staging_table, s.clean_table, s.bq_table, s.staging_columns)
+
+    def test_select_only_staged_columns(self):
+        cfg = datasets.DatasetConfig.from_dict({"name": "a", "dataset_id": "aaaa-0001",
+                                                "columns": ["Case Month", "res_state"]})
+        self.assertEqual(pipeline.soql_params(cfg=cfg)["$select"], ":id,:updated_at,case_month,res_state")
+        cfg = datasets.DatasetConfig("b", "bbbb-0001")  # columns not listed: whatever the dataset has
+        self.assertEqual(pipeline.soql_params(cfg=cfg)["$select"], ":id,:updated_at,*")
+
+
+class TestConcurrentDatasets(unittest.TestCase):
+    NAMES = ("multi_a", "multi_b", "multi_bad")
+
+    def setUp(self):
+        self.engine = pg_engine()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(setattr, metrics, "run", metrics.run)
+
+    def tearDown(self):
+        with self.engine.begin() as conn:
+            for name in self.NAMES:
+                conn.execute(text(f"DROP TABLE IF EXISTS stg_{name}_raw, stg_{name}_raw_dups, stg_{name}_clean;"))
+            conn.execute(text("DELETE FROM pipeline_state WHERE dataset_id LIKE 'multi-%';"))
+            conn.execute(text("DELETE FROM ingest_checkpoints WHERE dataset_id LIKE 'multi-%';"))
+            delete_profiles(conn, *(f"stg_{name}_raw" for name in self.NAMES))
+
+    def test_failures_are_isolated(self):
+        configs = [datasets.DatasetConfig("multi_a", "multi-000a"),
+                   datasets.DatasetConfig("multi_b", "multi-000b"),
+                   datasets.DatasetConfig("multi_bad", "multi-0404")]  # not served: fetch fails
+        limiter = socrata.TokenBucket(0)
+        acquired = []
+        real_acquire = limiter.acquire
+        limiter.acquire = lambda: acquired.append(1) or real_acquire()
+        with SocrataStub(rows(250, "A"), "multi-000a") as stub, mock.patch.object(
+                pipeline, "SETTINGS", pipeline.SETTINGS.replace(
+                    cdc_base_url=stub.base_url, page_size=100, fetch_workers=1, max_rows=0, ingest_mode="frame",
+                    load_target_dir=self.tmp.name, max_retries=0)), \
+                mock.patch.object(pipeline, "get_limiter", lambda rate: limiter):
+            stub.add_dataset("multi-000b", rows(120, "B"))
+            run = metrics.start_run("multi", self.tmp.name, profile="")
+            args = orchestrator.parse_args(["run"])
+            errors = orchestrator.run_datasets(configs, args, run, workers=3)
+            run.close("failed", 0)
+            served = len(stub.requests)
+
+        self.assertEqual(errors["multi_a"], None)
+        self.assertEqual(errors["multi_b"], None)
+        self.assertIn("HTTPError", errors["multi_bad"])
+        with self.engine.begin() as conn:
+            counts = [conn.execute(text(f"SELECT COUNT(*) FROM stg_{n}_clean")).scalar() for n in ("multi_a", "multi_b")]
+        self.assertEqual(counts, [250, 120])
+        self.assertTrue(os.path.isdir(os.path.join(self.tmp.name, pipeline.SETTINGS.bq_dataset, "multi_b")))
+        self.assertEqual(len(acquired), served)  # every dataset's requests went through the one rate limiter
+        stages = {e["stage"]: e["status"] for e in metrics.read_run(run.path) if e["event"] == "stage"}
+        self.assertEqual(stages["multi_a:LOAD_TO_BQ"], "ok")
+        self.assertEqual(stages["multi_bad:INGEST"], "failed")
+
+
+class TestSharedDataset(unittest.TestCase):
+    """Two configs over one Socrata dataset keep separate watermarks, dirty partitions and cached pages."""
+
+    def setUp(self):
+        self.engine = pg_engine()
+
+    def tearDown(self):
+        with self.engine.begin() as conn:
+            for name in ("shared_a", "shared_b"):
+                conn.execute(text(f"DROP TABLE IF EXISTS stg_{name}_raw, stg_{name}_raw_dups, stg_{name}_clean;"))
+            conn.execute(text("DELETE FROM pipeline_state WHERE dataset_id = 'shared-0001';"))
+            conn.execute(text("DELETE FROM ingest_checkpoints WHERE dataset_id = 'shared-0001';"))
+
+    def test_state_is_per_config(self):
+        a = datasets.DatasetConfig("shared_a", "shared-0001")
+        b = datasets.DatasetConfig("shared_b", "shared-0001")
+        data = rows(200, "S")
+        with SocrataStub(data, "shared-0001") as stub, mock.patch.object(pipeline, "SETTINGS", pipeline.SETTINGS.replace(
+                cdc_base_url=stub.base_url, page_size=100, fetch_workers=1, rate_limit=0, max_rows=0,
+                ingest_mode="frame", max_retries=0, data_profile=False)):
+            pipeline.stage_to_postgres(cfg=a)
+            pipeline.simple_clean_transform(cfg=a)
+            data.append(dict(data[0], **{":id": "row-new", ":updated_at": "2024-02-01T00:00:00.000Z",
+                                         "res_county": "S new"}))
+            self.assertEqual(pipeline.stage_incremental(cfg=a), (1, 0))
+            # b has never been loaded: its first incremental run fetches everything, past a's watermark or not
+            self.assertEqual(pipeline.stage_incremental(cfg=b), (201, 0))
+            self.assertEqual(pipeline.simple_clean_transform(cfg=a)["partitions"], 1)  # only a's dirty month
+            self.assertEqual(pipeline.simple_clean_transform(cfg=b)["rows"], 201)
+            self.assertEqual(pipeline.stage_incremental(cfg=b), (0, 0))
+
+    def test_page_cache_is_per_column_set(self):
+        narrow = datasets.DatasetConfig.from_dict({"name": "shared_b", "dataset_id": "shared-0001",
+                                                   "columns": ["case_month", "res_state"]})
+        wide = datasets.DatasetConfig("shared_a", "shared-0001")
+        with tempfile.TemporaryDirectory() as tmp, SocrataStub(rows(200, "S"), "shared-0001") as stub, \
+                mock.patch.object(pipeline, "SETTINGS", pipeline.SETTINGS.replace(
+                    cdc_base_url=stub.base_url, page_size=100, fetch_workers=1, rate_limit=0, max_rows=0,
+                    ingest_mode="frame", max_retries=0, data_profile=False, page_cache_dir=tmp)):
+            pipeline.stage_to_postgres(cfg=narrow)
+            pipeline.stage_to_postgres(cfg=wide)  # must not replay the narrow config's pages
+            self.assertEqual(len(os.listdir(tmp)), 2)
+        with self.engine.begin() as conn:
+            counts = conn.execute(text("SELECT COUNT(*), COUNT(res_county) FROM stg_shared_a_raw")).fetchone()
+        self.assertEqual(tuple(counts), (200, 200))
+
+
+class TestNarrowSchema(unittest.TestCase):
+    """A dataset without most of the CDC case columns (make_rows has four of them)."""
+
+    def setUp(self):
+        self.engine = pg_engine()
+
+    def tearDown(self):
+        with self.engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS stg_narrow_raw, stg_narrow_raw_dups;"))
+            conn.execute(text("DELETE FROM pipeline_state WHERE dataset_id = 'narrow-0001';"))
+            conn.execute(text("DELETE FROM ingest_checkpoints WHERE dataset_id = 'narrow-0001';"))
+            delete_profiles(conn, "stg_narrow_raw")
+
+    def test_default_columns_select_star(self):
+        cfg = datasets.DatasetConfig("narrow", "narrow-0001")
+        for mode in ("frame", "stream"):
+            with self.subTest(mode=mode), SocrataStub(rows(150, "N"), "narrow-0001") as stub, \
+                    mock.patch.object(pipeline, "SETTINGS", pipeline.SETTINGS.replace(
+                        cdc_base_url=stub.base_url, page_size=100, fetch_workers=1, rate_limit=0, max_rows=0,
+                        ingest_mode=mode, max_retries=0)):
+                self.assertEqual(pipeline.stage_to_postgres(cfg=cfg), 150)
+                with self.engine.begin() as conn:
+                    counts = conn.execute(text("SELECT COUNT(res_county), COUNT(age_group) FROM stg_narrow_raw")).one()
+                self.assertEqual(tuple(counts), (150, 0))  # columns the dataset lacks are NULL
+                listed = datasets.DatasetConfig.from_dict({"name": "narrow", "dataset_id": "narrow-0001",
+                                                           "columns": ["case_month", "age_group"]})
+                with self.assertRaisesRegex(requests.HTTPError, "400"):  # Socrata's 400 for a column it does not have
+                    pipeline.stage_to_postgres(cfg=listed)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,108 @@
+import os, unittest
+from collections import Counter
+from unittest import mock
+from sqlalchemy import text
+
+os.environ.setdefault("DATASET_ID", "test-0001")
+os.environ.setdefault("GCP_PROJECT_ID", "test-project")
+import cleaning, pipeline, staging
+from benchmarks.synth import make_case_rows
+from tests.pg import delete_profiles, pg_engine
+from tests.socrata_stub import SocrataStub, make_rows
+
+T = "test_dedup_raw"
+
+
+def rows():
+    out = [dict(r, res_county=f"COUNTY {i}") for i, r in enumerate(make_rows(300))]
+    out[5]["sex"] = "MALE"  # normalizes to row 1's content
+    out[5]["res_county"] = out[1]["res_county"]
+    out[5]["case_month"] = out[1]["case_month"]
+    out[5]["res_state"] = out[1]["res_state"]
+    for i in range(250, 300):  # second half of the last pages repeats earlier content
+        out[i] = dict(out[i - 250], **{":id": out[i][":id"]})
+    return out
+
+
+class TestFingerprintDedup(unittest.TestCase):
+    def setUp(self):
+        self.engine = pg_engine()
+
+    def tearDown(self):
+        with self.engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {T}, {T}_dups, test_dedup_clean, test_dedup_ref;"))
+            conn.execute(text("DELETE FROM pipeline_state WHERE dataset_id = 'dedup-0001';"))
+            delete_profiles(conn, T)
+
+    def patched(self, stub, mode="frame"):
+        return mock.patch.object(pipeline, "SETTINGS", pipeline.SETTINGS.replace(
+            cdc_base_url=stub.base_url, dataset_id=stub.dataset_id, page_size=100, fetch_workers=1, rate_limit=0,
+            max_rows=0, ingest_mode=mode, staging_table=T, clean_table="test_dedup_clean", max_retries=0))
+
+    def one(self, sql):
+        with self.engine.begin() as conn:
+            return conn.execute(text(sql)).one()
+
+    def test_fingerprint_is_clean_row_hash(self):
+        cols = ["case_month", "res_state", "sex"]
+        clean = [r.name for r in cleaning.output_columns(cols)]
+        with self.engine.begin() as conn:
+            conn.execute(text("CREATE TEMP TABLE fp_src (case_month text, res_state text, sex text)"))
+            conn.execute(text("INSERT INTO fp_src VALUES ('2021-01', 'ny', 'male'), ('2021-01', 'NY', 'Male')"))
+            got = conn.execute(text(f"SELECT {cleaning.fingerprint_sql(cols)} FROM fp_src")).scalars().all()
+            clean_rows = cleaning.select_sql("fp_src", cols)
+            ref = conn.execute(text(f"SELECT {cleaning.row_hash_sql(clean)} FROM ({clean_rows}) c")).scalar()
+        self.assertEqual(got, [ref, ref])
+
+    def test_full_load_rejects_duplicates(self):
+        for mode in ("frame", "stream"):
+            with self.subTest(mode=mode), SocrataStub(rows(), "dedup-0001") as stub, self.patched(stub, mode):
+                self.assertEqual(pipeline.stage_to_postgres(), 300)
+                self.assertEqual(tuple(self.one(f"SELECT COUNT(*), COUNT(DISTINCT row_fp) FROM {T}")), (249, 249))
+                self.assertEqual(self.one(f"SELECT COUNT(*) FROM {T}_dups")[0], 51)
+                pipeline.simple_clean_transform()
+                with self.engine.begin() as conn:
+                    conn.execute(text("DROP TABLE IF EXISTS test_dedup_ref"))
+                    conn.execute(text(cleaning.compile_clean_sql(T, "test_dedup_ref", staging.CDC_CASE_COLUMNS)))
+                    # enum columns come back as strings, so compare the rows as multisets
+                    got = Counter(conn.execute(text("SELECT * FROM test_dedup_clean")).fetchall())
+                    ref = Counter(conn.execute(text("SELECT * FROM test_dedup_ref")).fetchall())
+                self.assertEqual((got, sum(got.values())), (ref, 249))
+
+    def test_incremental_keeps_content_of_replaced_duplicates(self):
+        data = rows()
+        with SocrataStub(data, "dedup-0001") as stub, self.patched(stub):
+            pipeline.stage_to_postgres()
+            owner, twin = data[0][":id"], data[250][":id"]
+            # the staged owner changes; its old content must survive under the duplicate's row_id
+            data[0] = dict(data[0], sex="Unknown", **{":updated_at": "2024-02-01T00:00:00.000Z"})
+            # a new row that repeats staged content is recorded as a duplicate
+            data.append(dict(data[10], **{":id": "row-new", ":updated_at": "2024-02-01T00:00:00.000Z"}))
+            new, updated = pipeline.stage_incremental()
+
+            self.assertEqual((new, updated), (1, 1))
+            self.assertEqual(self.one(f"SELECT COUNT(*) FROM {T}")[0], 250)
+            self.assertEqual(self.one(f"SELECT sex FROM {T} WHERE row_id = '{owner}'")[0], "Unknown")
+            self.assertEqual(self.one(f"SELECT sex FROM {T} WHERE row_id = '{twin}'")[0], data[250]["sex"])
+            self.assertEqual(self.one(f"SELECT COUNT(*) FROM {T}_dups WHERE row_id IN ('{twin}', 'row-new')"), (1,))
+
+    def test_stream_and_frame_stage_alike(self):
+        # every field present, some of them '' (which the state filter rejects)
+        data = [dict(dict.fromkeys(staging.CDC_CASE_COLUMNS, ""), **r, **{":id": f"row-{i:05d}",
+                                                                          ":updated_at": "2024-01-01T00:00:00.000Z"})
+                for i, r in enumerate(make_case_rows(2000, seed=5, dirty=0.2))]
+        tables = {}
+        for mode in ("frame", "stream"):
+            with SocrataStub(data, "dedup-0001") as stub, self.patched(stub, mode):
+                pipeline.stage_to_postgres()
+                pipeline.simple_clean_transform(full=True)
+            with self.engine.begin() as conn:
+                tables[mode] = [Counter(conn.execute(text(f"SELECT * FROM {t}")).fetchall())
+                                for t in (T, f"{T}_dups", "test_dedup_clean")]
+                empty = conn.execute(text(f"SELECT COUNT(*) FROM {T} WHERE res_state = ''")).scalar()
+            self.assertGreater(empty, 0, mode)
+        self.assertEqual(tables["stream"], tables["frame"])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,125 @@
+import tempfile, unittest
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text
+
+import bq_loader, cleaning, encoding, page_cache, partitions, staging
+from benchmarks.synth import make_case_rows
+from tests.pg import pg_engine
+
+SRC, CLEAN = "test_enc_raw", "test_enc_clean"
+COLS = ["case_month", "res_state", "test_enc_grade"]
+RULES = [cleaning.ColumnRule("case_month", "nullif_empty", required=True),
+         cleaning.ColumnRule("res_state", "upper", required=True),
+         cleaning.ColumnRule("test_enc_grade", encoded=True)]
+
+
+class TestCategorize(unittest.TestCase):
+    def test_page_memory_and_values(self):
+        rows = [dict(r, **{":id": f"row-{i}"}) for i, r in enumerate(make_case_rows(5000, seed=2))]
+        plain = pd.DataFrame(rows)
+        df = encoding.categorize(pd.DataFrame(rows))
+        self.assertEqual(df["sex"].dtype, "category")
+        self.assertEqual(df[":id"].dtype, object)  # unique per row: left alone
+        self.assertEqual(df["res_county"].dtype, "category")
+        self.assertLess(df.memory_usage(deep=True).sum() * 3, plain.memory_usage(deep=True).sum())
+        pd.testing.assert_frame_equal(df.astype(object).where(df.notna(), None), plain)
+
+    def test_high_cardinality_stays_object(self):
+        df = encoding.categorize(pd.DataFrame({"a": [str(i) for i in range(10)], "b": [{"x": 1}] * 10}))
+        self.assertEqual(list(df.dtypes), [object, object])
+
+    def test_page_cache_keeps_dictionaries(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = page_cache.PageCache(tmp, "ds", 100)
+            cache.put("v1", 0, encoding.categorize(pd.DataFrame({"sex": ["Male", "Female"] * 50})))
+            with pa.memory_map(cache.pages("v1")[0][0]) as f:
+                self.assertTrue(pa.types.is_dictionary(pa.ipc.open_file(f).schema.field("sex").type))
+
+    def test_rule_labels(self):
+        sex = next(r for r in cleaning.CLEAN_COLUMNS if r.name == "sex")
+        self.assertEqual(encoding.rule_labels(sex), ["Male", "Female", "Unknown", "Missing"])
+        self.assertEqual(encoding.rule_labels(cleaning.ColumnRule("race")), [])
+
+
+class TestEnumColumns(unittest.TestCase):
+    def setUp(self):
+        self.engine = pg_engine()
+        self.stage([("2021-01", "ny", "A"), ("2021-01", "ca", "B"), ("2021-02", "tx", None)] * 50)
+
+    def tearDown(self):
+        with self.engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {SRC}, {CLEAN}, test_enc_cdc_raw, test_enc_cdc_clean, "
+                              f"test_enc_cdc_text;"))
+            conn.execute(text("DROP TYPE IF EXISTS dict_test_enc_grade;"))
+
+    def stage(self, rows, drop=True):
+        writer = staging.CopyWriter(self.engine, SRC, COLS)
+        try:
+            if drop:
+                writer.create_table(drop=True)
+            writer.copy(staging.copy_text(rows))
+        finally:
+            writer.close()
+
+    def query(self, sql):
+        with self.engine.begin() as conn:
+            return conn.execute(text(sql)).fetchall()
+
+    def rebuild(self, keys=None):
+        return partitions.rebuild(self.engine, SRC, CLEAN, COLS, keys=keys, distinct=False,
+                                  rules=RULES, filters=[])
+
+    def types(self):
+        with self.engine.begin() as conn:
+            return partitions.table_types(conn.connection.cursor(), CLEAN)
+
+    def test_labels_grow_then_fall_back_to_text(self):
+        self.rebuild()
+        self.assertEqual(self.types(), {"case_month": "text", "res_state": "text",
+                                        "test_enc_grade": "dict_test_enc_grade"})
+        self.assertEqual(self.query(f"SELECT COUNT(*) FROM {CLEAN} WHERE test_enc_grade = 'A'"), [(50,)])
+
+        self.stage([("2021-03", "wa", "C")], drop=False)  # a new value in one month: the enum grows
+        stats = self.rebuild(keys=["2021-03"])
+        self.assertEqual((stats["full"], stats["partitions"]), (False, 1))
+        self.assertEqual([r[0] for r in self.query("SELECT unnest(enum_range(NULL::dict_test_enc_grade))")],
+                         ["A", "B", "C"])
+
+        self.stage([("2021-03", "wa", "x" * 80)], drop=False)  # too long for a label: back to TEXT
+        stats = self.rebuild(keys=["2021-03"])
+        self.assertTrue(stats["full"])
+        self.assertEqual(self.types()["test_enc_grade"], "text")
+        self.assertEqual(self.query(f"SELECT COUNT(*), COUNT(DISTINCT test_enc_grade) FROM {CLEAN}"), [(152, 4)])
+        self.assertFalse(self.rebuild(keys=["2021-01"])["full"])  # stays TEXT on later incremental runs
+
+    def test_cdc_table_smaller_and_exported_as_dictionaries(self):
+        writer = staging.CopyWriter(self.engine, "test_enc_cdc_raw", staging.CDC_CASE_COLUMNS)
+        try:
+            writer.create_table(drop=True)
+            writer.write_records(list(make_case_rows(20000, seed=5)))
+        finally:
+            writer.close()
+        text_rules = [cleaning.ColumnRule(**{**r.__dict__, "encoded": False}) for r in cleaning.CLEAN_COLUMNS]
+        for table, rules in (("test_enc_cdc_clean", cleaning.CLEAN_COLUMNS), ("test_enc_cdc_text", text_rules)):
+            partitions.rebuild(self.engine, "test_enc_cdc_raw", table, staging.CDC_CASE_COLUMNS, rules=rules)
+        size = {t: int(self.query(f"SELECT SUM(pg_relation_size(relid)) FROM pg_partition_tree('{t}')")[0][0])
+                for t in ("test_enc_cdc_clean", "test_enc_cdc_text")}
+        self.assertLess(size["test_enc_cdc_clean"] * 1.3, size["test_enc_cdc_text"])
+        self.assertEqual(set(self.query("SELECT * FROM test_enc_cdc_clean")),
+                         set(self.query("SELECT * FROM test_enc_cdc_text")))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            files = bq_loader.export_parquet(self.engine, "test_enc_cdc_clean", tmp)
+            schema = pq.read_schema(files[0])
+            meta = pq.ParquetFile(files[0]).metadata.row_group(0)
+            self.assertTrue(pa.types.is_dictionary(schema.field("sex").type))
+            self.assertEqual(schema.field("case_month").type, pa.string())
+            self.assertIn("RLE_DICTIONARY", meta.column(schema.get_field_index("sex")).encodings)
+            self.assertEqual(pq.read_table(files[0]).num_rows,
+                             self.query("SELECT COUNT(*) FROM test_enc_cdc_clean")[0][0])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,147 @@
+import unittest, time, requests
+import socrata
+from tests.socrata_stub import SocrataStub, make_rows
+
+
+class TestConcurrentFetch(unittest.TestCase):
+    def fetch(self, stub, page_size, workers):
+        params = {"$select": ":id,:updated_at,*"}
+        return list(socrata.iter_pages(stub.base_url, stub.dataset_id, page_size, workers=workers, params=params))
+
+    def test_pages_in_offset_order(self):
+        rows = make_rows(2345)
+        with SocrataStub(rows) as stub:
+            pages = self.fetch(stub, 200, workers=4)
+        self.assertEqual([o for o, _ in pages], list(range(0, 2345, 200)))
+        self.assertEqual([r for _, page in pages for r in page], rows)
+
+    def test_stops_on_first_empty_page(self):
+        with SocrataStub(make_rows(1000)) as stub:
+            pages = self.fetch(stub, 250, workers=3)
+        self.assertEqual(len(pages), 4)
+        self.assertEqual(sum(len(p) for _, p in pages), 1000)
+
+    def test_empty_dataset(self):
+        with SocrataStub([]) as stub:
+            self.assertEqual(self.fetch(stub, 100, workers=4), [])
+
+    def test_http_error_propagates(self):
+        with SocrataStub(make_rows(10)) as stub:
+            with self.assertRaises(requests.HTTPError):
+                list(socrata.iter_pages(stub.base_url, "missing-id", 5, workers=2))
+
+    def test_where_filter_and_system_fields(self):
+        rows = make_rows(300)
+        for i, r in enumerate(rows):
+            r[":updated_at"] = f"2024-01-{1 + i // 100:02d}T00:00:00.000Z"
+        params = {"$select": ":id,:updated_at,*", "$where": ":updated_at > '2024-01-01T00:00:00.000Z'"}
+        with SocrataStub(rows) as stub:
+            pages = list(socrata.iter_pages(stub.base_url, stub.dataset_id, 150, workers=2, params=params))
+            plain = list(socrata.iter_pages(stub.base_url, stub.dataset_id, 500))
+        got = [r for _, page in pages for r in page]
+        self.assertEqual(got, rows[100:])
+        self.assertNotIn(":id", plain[0][1][0])
+
+    def test_transient_errors_are_retried(self):
+        rows = make_rows(500)
+        retry = socrata.RetryPolicy(retries=3, backoff=0.01)
+        with SocrataStub(rows) as stub:
+            stub.faults = {200: [503, 429], 400: [502]}
+            pages = list(socrata.iter_pages(stub.base_url, stub.dataset_id, 200, workers=2, retry=retry))
+            hits = [p["$offset"] for _, p in stub.requests]
+        self.assertEqual([r for _, page in pages for r in page], [
+            {k: v for k, v in r.items() if not k.startswith(":")} for r in rows])
+        self.assertEqual(hits.count("200"), 3)
+        self.assertEqual(hits.count("400"), 2)
+
+    def test_retries_exhausted_raise(self):
+        with SocrataStub(make_rows(100)) as stub:
+            stub.fail_offsets.add(50)
+            with self.assertRaises(requests.HTTPError):
+                list(socrata.iter_csv_pages(stub.base_url, stub.dataset_id, 50,
+                                            retry=socrata.RetryPolicy(retries=2, backoff=0.01)))
+            self.assertEqual(sum(p["$offset"] == "50" for _, p in stub.requests), 3)
+
+    def test_retry_after_header_wins(self):
+        retry = socrata.RetryPolicy(backoff=100, cap=5)
+        self.assertEqual(retry.delay(0, "2"), 2.0)
+        self.assertEqual(retry.delay(0, "30"), 5.0)
+        self.assertLessEqual(retry.delay(10), 5.0)
+
+    def test_token_bucket_limits_rate(self):
+        bucket = socrata.TokenBucket(rate=20)
+        start = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+        # first token is available immediately, the other five are spaced 50ms apart
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+
+class TestFetchController(unittest.TestCase):
+    @staticmethod
+    def run_rounds(ctl, latency, rounds=40):
+        for _ in range(rounds):
+            for _ in range(ctl.window):
+                ctl.done(ctl.page_size, ctl.page_size * 50, latency(ctl.page_size, ctl.window))
+
+    def test_finds_server_capacity(self):
+        # fixed per-request overhead, and a server that serves 2 requests at a time
+        ctl = socrata.FetchController(100, workers=1, max_workers=6, max_page_size=400)
+        self.run_rounds(ctl, lambda size, window: (0.05 + size * 1e-5) * max(1, window / 2))
+        self.assertEqual((ctl.window, ctl.page_size), (2, 400))
+        self.assertEqual(ctl.report()["best_window"], 2)
+
+    def test_report_leaves_out_unfinished_probe(self):
+        ctl = socrata.FetchController(100, workers=1, max_workers=6)
+        self.assertFalse(ctl.report()["measured"])  # no round yet
+        self.run_rounds(ctl, lambda size, window: 0.05, rounds=4)  # 4 pages at 1 x 100: one round, then a probe
+        self.assertEqual(ctl.window, 2)
+        r = ctl.report()
+        self.assertEqual((r["page_size"], r["window"], r["measured"]), (100, 1, True))
+        ctl.throttled(503)
+        self.assertFalse(ctl.report()["measured"])
+
+    def test_slow_pages_shrink(self):
+        ctl = socrata.FetchController(10_000, max_page_size=40_000, target_latency=1.0)
+        self.run_rounds(ctl, lambda size, window: size * 2e-4)  # 1s per 5,000 rows
+        self.assertLessEqual(ctl.page_size, 5_000)
+        self.assertGreaterEqual(ctl.page_size, 2_500)
+
+    def test_throttling_halves_window_once_per_burst(self):
+        ctl = socrata.FetchController(4000, workers=4)
+        sent = time.monotonic()
+        ctl.throttled(429, "0.2", sent)
+        ctl.throttled(429, "0.2", sent)  # in flight before the first back-off: no second halving
+        self.assertEqual((ctl.window, ctl.page_size), (2, 4000))
+        ctl.throttled(0, sent_at=time.monotonic())
+        self.assertEqual((ctl.window, ctl.page_size), (1, 2000))  # timeouts also halve the page size
+        start = time.monotonic()
+        ctl.wait()
+        self.assertGreater(time.monotonic() - start, 0.1)
+
+    def test_adaptive_pages_with_retry_after(self):
+        rows = make_rows(3000)
+        ctl = socrata.FetchController(100, workers=3, max_workers=4, min_page_size=50)
+        with SocrataStub(rows) as stub:
+            stub.faults, stub.retry_after = {300: [429]}, "0.2"
+            start = time.monotonic()
+            pages = list(socrata.iter_pages(stub.base_url, stub.dataset_id, 100, params={"$select": ":id,*"},
+                                            controller=ctl, retry=socrata.RetryPolicy(backoff=0.01)))
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertEqual([r for _, page in pages for r in page],
+                         [{k: v for k, v in r.items() if k != ":updated_at"} for r in rows])
+        offsets = [o for o, _ in pages]
+        self.assertEqual(offsets, [0] + [o + len(p) for o, p in pages[:-1]])  # contiguous, sizes vary
+
+    def test_select_and_gzip(self):
+        with SocrataStub(make_rows(500)) as stub:
+            session = socrata.make_session()
+            r = socrata.get_with_retries(session, f"{stub.base_url}/resource/{stub.dataset_id}.json",
+                                         {"$select": ":id,case_month", "$limit": 500})
+            self.assertEqual(r.headers["Content-Encoding"], "gzip")
+            self.assertLess(r.raw.tell() * 3, len(r.content))
+            self.assertEqual(set(r.json()[0]), {":id", "case_month"})
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,110 @@
+import os, tempfile, unittest
+from unittest import mock
+from sqlalchemy import text
+
+os.environ.setdefault("DATASET_ID", "test-0001")
+os.environ.setdefault("GCP_PROJECT_ID", "test-project")
+import metrics, partitions, pipeline, staging
+from benchmarks.synth import make_case_rows
+from tests.pg import delete_profiles, pg_engine
+from tests.socrata_stub import SocrataStub, make_rows
+
+
+class TestRunRecorder(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(setattr, metrics, "run", metrics.run)
+
+    def test_disabled_recorder_is_noop(self):
+        rec = metrics.RunRecorder()
+        with rec.stage("INGEST") as st:
+            st["rows"] = 10
+        rec.http("u", 0, 200, 0.1, 5, 0)
+        self.assertFalse(rec.enabled)
+
+    def test_summary_and_prometheus(self):
+        rec = metrics.start_run("r1", self.tmp.name, profile="")
+        with rec.stage("INGEST") as st:
+            rec.http("http://x", 0, 429, 0.5, 0, 0)
+            rec.http("http://x", 0, 200, 0.25, 1000, 1)
+            rec.page("ingest", 0, 100, 0.1)
+            st["rows"] = 100
+        rec.event("load", mode="merge", rows=40, partitions=2, upload_bytes=2048, upload_sec=0.5)
+        with self.assertRaises(ValueError), rec.stage("TRANSFORM"):
+            raise ValueError("boom")
+        rec.close("failed", 1.5)
+
+        summary = metrics.summarize(metrics.read_run(metrics.latest_run_file(self.tmp.name)))
+        self.assertEqual(summary["status"], "failed")
+        self.assertEqual(summary["stages"]["INGEST"]["rows"], 100)
+        self.assertEqual(summary["stages"]["TRANSFORM"]["status"], "failed")
+        self.assertEqual((summary["http"]["requests"], summary["http"]["bytes"]), (2, 1000))
+        self.assertEqual(summary["pages"]["rows"], 100)
+        self.assertEqual((summary["load"]["rows"], summary["load"]["upload_bytes"]), (40, 2048))
+        self.assertGreater(summary["peak_rss_bytes"], 0)
+
+        lines = metrics.prometheus_lines(summary)
+        self.assertIn('pipeline_run_success{run_id="r1",status="failed"} 0', lines)
+        self.assertIn('pipeline_http_requests{run_id="r1",status="429"} 1', lines)
+        self.assertIn('pipeline_stage_rows{run_id="r1",stage="INGEST"} 100', lines)
+        self.assertIn('pipeline_load_upload_bytes{run_id="r1"} 2048', lines)
+
+    def test_cprofile_dump_per_stage(self):
+        rec = metrics.start_run("r2", self.tmp.name, profile="cprofile")
+        with rec.stage("TRANSFORM"):
+            sum(range(1000))
+        rec.close("success", 0.1)
+        stage = [e for e in metrics.read_run(rec.path) if e["event"] == "stage"][0]
+        self.assertTrue(os.path.exists(stage["profile"]))
+
+
+class TestPipelineInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.engine = pg_engine()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(setattr, metrics, "run", metrics.run)
+
+    def tearDown(self):
+        with self.engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS test_metrics_raw, test_metrics_raw_dups, test_metrics_clean;"))
+            conn.execute(text("DELETE FROM pipeline_state WHERE dataset_id = 'metr-0001';"))
+            delete_profiles(conn, "test_metrics_raw")
+
+    def test_ingest_records_http_and_page_events(self):
+        rows = [dict(r, res_county=f"COUNTY {i}") for i, r in enumerate(make_rows(250))]
+        rec = metrics.start_run("ingest", self.tmp.name, profile="")
+        with SocrataStub(rows, "metr-0001") as stub, mock.patch.object(pipeline, "SETTINGS", pipeline.SETTINGS.replace(
+                cdc_base_url=stub.base_url, dataset_id=stub.dataset_id, page_size=100, fetch_workers=1,
+                rate_limit=0, max_rows=0, ingest_mode="frame", staging_table="test_metrics_raw", max_retries=0)):
+            pipeline.stage_to_postgres()
+        rec.close("success", 0)
+        events = metrics.read_run(rec.path)
+        http = [e for e in events if e["event"] == "http"]
+        pages = [e for e in events if e["event"] == "page"]
+        self.assertEqual(sorted(e["offset"] for e in pages), [0, 100, 200])
+        self.assertEqual(sum(e["rows"] for e in pages), 250)
+        self.assertTrue(all(e["status"] == 200 and e["bytes"] > 0 for e in http))
+        self.assertGreaterEqual(len(http), 3)
+
+    def test_explain_analyze_partition_build(self):
+        cols = staging.CDC_CASE_COLUMNS
+        writer = staging.CopyWriter(self.engine, "test_metrics_raw", cols)
+        try:
+            writer.create_table(drop=True)
+            writer.write_records(list(make_case_rows(500, seed=3)))
+        finally:
+            writer.close()
+        rec = metrics.start_run("explain", self.tmp.name, profile="")
+        with mock.patch.object(metrics, "EXPLAIN", True):
+            stats = partitions.rebuild(self.engine, "test_metrics_raw", "test_metrics_clean", cols, workers=2)
+        rec.close("success", 0)
+        stmts = [e for e in metrics.read_run(rec.path) if e.get("name") == "clean_partition"]
+        self.assertEqual(len(stmts), stats["partitions"])
+        self.assertEqual(sum(e["rows"] for e in stmts), stats["rows"])
+        self.assertTrue(all(e["execution_ms"] is not None for e in stmts))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,117 @@
+import os, tempfile, unittest
+from unittest import mock
+import pandas as pd
+from sqlalchemy import text
+
+os.environ.setdefault("DATASET_ID", "test-0001")
+os.environ.setdefault("GCP_PROJECT_ID", "test-project")
+import page_cache, pipeline
+from tests.pg import delete_profiles, pg_engine
+from tests.socrata_stub import SocrataStub, make_rows
+
+T = "test_cache_raw"
+
+
+def frame(offset, n):
+    return pd.DataFrame([{":id": f"row-{i}", "sex": None if i % 3 else "Male"} for i in range(offset, offset + n)])
+
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache = page_cache.PageCache(self.tmp.name, "ds-1", 10)
+
+    def test_version_from_last_modified(self):
+        self.assertEqual(page_cache.PageCache.version("Mon, 01 Jan 2024 00:00:00 GMT"), "1704067200")
+        self.assertRegex(page_cache.PageCache.version("not a date"), r"^h[0-9a-f]{12}$")
+        self.assertIsNone(page_cache.PageCache.version(None))
+
+    def test_round_trip_and_complete(self):
+        for offset, n in [(0, 10), (10, 10), (20, 4)]:
+            self.cache.put("v1", offset, frame(offset, n))
+        got = list(self.cache.replay("v1", start_offset=10))
+        self.assertEqual([o for o, _ in got], [10, 20])
+        pd.testing.assert_frame_equal(got[1][1], frame(20, 4))
+        self.assertTrue(self.cache.mark_complete("v1"))
+        self.assertEqual(self.cache.latest_complete(), "v1")
+        # other page sizes are other cache entries
+        self.assertIsNone(page_cache.PageCache(self.tmp.name, "ds-1", 5).latest_complete())
+
+    def test_gap_is_not_complete(self):
+        self.cache.put("v1", 0, frame(0, 10))
+        self.cache.put("v1", 20, frame(20, 3))
+        self.assertFalse(self.cache.mark_complete("v1"))
+        self.assertEqual(len(list(self.cache.replay("v1"))), 1)
+
+    def test_lru_eviction(self):
+        self.cache.put("v1", 0, frame(0, 10))
+        size = os.path.getsize(self.cache.pages("v1")[0][0])
+        self.cache.max_bytes = int(size * 2.5)
+        self.cache.put("v1", 10, frame(10, 10))
+        os.utime(self.cache.pages("v1")[10][0], (1, 1))  # least recently used
+        self.cache.get(self.cache.pages("v1")[0][0])
+        self.cache.put("v1", 20, frame(20, 4))
+        self.assertEqual(sorted(self.cache.pages("v1")), [0, 20])
+
+
+class TestCachedLoad(unittest.TestCase):
+    def setUp(self):
+        self.engine = pg_engine()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def tearDown(self):
+        with self.engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {T}, {T}_dups;"))
+            conn.execute(text("DELETE FROM pipeline_state WHERE dataset_id = 'cache-0001';"))
+            conn.execute(text("DELETE FROM ingest_checkpoints WHERE dataset_id = 'cache-0001';"))
+            delete_profiles(conn, T)
+
+    def patched(self, base_url):
+        return mock.patch.object(pipeline, "SETTINGS", pipeline.SETTINGS.replace(
+            cdc_base_url=base_url, dataset_id="cache-0001", page_size=100, fetch_workers=2, rate_limit=0,
+            max_rows=0, ingest_mode="frame", staging_table=T, page_cache_dir=self.tmp.name, max_retries=0))
+
+    def staged(self):
+        with self.engine.begin() as conn:
+            return conn.execute(text(f"SELECT COUNT(*), COUNT(DISTINCT res_county) FROM {T}")).one()
+
+    def test_replay_without_network(self):
+        rows = [dict(r, res_county=f"COUNTY {i}") for i, r in enumerate(make_rows(250))]
+        with SocrataStub(rows, "cache-0001") as stub, self.patched(stub.base_url):
+            self.assertEqual(pipeline.stage_to_postgres(), 250)
+            fetched = len(stub.requests)
+            # a rerun only asks Socrata for the last-modified time
+            self.assertEqual(pipeline.stage_to_postgres(), 250)
+            self.assertEqual(len(stub.requests), fetched + 1)
+            stub.last_modified = "Tue, 02 Jan 2024 00:00:00 GMT"  # dataset changed: fetched again
+            pipeline.stage_to_postgres()
+            self.assertGreater(len(stub.requests), fetched + 4)
+
+        with self.patched("http://127.0.0.1:9"):  # nothing listens there
+            self.assertEqual(pipeline.stage_to_postgres(from_cache=True), 250)
+            self.assertEqual(tuple(self.staged()), (250, 250))
+            with mock.patch.object(pipeline, "SETTINGS", pipeline.SETTINGS.replace(page_size=50)), \
+                    self.assertRaises(RuntimeError):
+                pipeline.stage_to_postgres(from_cache=True)
+
+    def test_resume_off_a_page_boundary(self):
+        rows = [dict(r, res_county=f"COUNTY {i}") for i, r in enumerate(make_rows(250))]
+        with SocrataStub(rows, "cache-0001") as stub, self.patched(stub.base_url):
+            self.assertEqual(pipeline.stage_to_postgres(), 250)  # cached as pages at 0, 100, 200
+            pages = sorted(self.cache_pages())
+            self.assertEqual(len(pages), 4)  # three pages and the complete marker
+            # e.g. a checkpoint from a streamed or adaptive-page run: fetched live, the cache left alone
+            fetched = pd.concat(pipeline.fetch_paginated(start_offset=150))
+            self.assertEqual(sorted(fetched["res_county"]), sorted(r["res_county"] for r in rows[150:]))
+            self.assertEqual(sorted(self.cache_pages()), pages)
+        with self.patched("http://127.0.0.1:9"), self.assertRaises(RuntimeError):
+            list(pipeline.fetch_paginated(start_offset=150, from_cache=True))
+
+    def cache_pages(self):
+        return [name for _, _, names in os.walk(self.tmp.name) for name in names]
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,87 @@
+import unittest
+from sqlalchemy import text
+
+import cleaning, partitions, staging
+from benchmarks.synth import make_case_rows
+from tests.pg import pg_engine
+
+SRC, CLEAN = "test_part_raw", "test_part_clean"
+
+
+class TestPartitionSQL(unittest.TestCase):
+    def test_names(self):
+        self.assertEqual(partitions.partition_name("t", "2021-03"), "t_p2021_03")
+        self.assertEqual(partitions.partition_name("t", None), "t_pdefault")
+        odd = partitions.partition_name("t", "2021-3'; DROP")
+        self.assertRegex(odd, r"^t_px[0-9a-f]{12}$")
+
+    def test_source_filter_matches_clean_key(self):
+        self.assertEqual(partitions.source_filter("2021-03"), "case_month = '2021-03'")
+        self.assertEqual(partitions.source_filter(None), "(case_month IS NULL OR case_month = '')")
+
+    def test_sort_keys_default_last(self):
+        self.assertEqual(partitions.sort_keys([None, "2021-02", "2021-01", "2021-02"]), ["2021-01", "2021-02", None])
+
+
+class TestPartitionedRebuild(unittest.TestCase):
+    def setUp(self):
+        self.engine = pg_engine()
+        rows = list(make_case_rows(3000, seed=7))
+        rows[0]["case_month"] = ""             # -> default partition
+        rows[1]["case_month"] = "2999-01"      # future month: filtered, partition dropped
+        self.cols = staging.CDC_CASE_COLUMNS
+        writer = staging.CopyWriter(self.engine, SRC, self.cols)
+        try:
+            writer.create_table(drop=True)
+            writer.write_records(rows)
+        finally:
+            writer.close()
+
+    def tearDown(self):
+        with self.engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {SRC}, {CLEAN}, {CLEAN}_ref;"))
+
+    def query(self, sql):
+        with self.engine.begin() as conn:
+            return conn.execute(text(sql)).fetchall()
+
+    def partition_oids(self):
+        return dict(self.query(f"SELECT c.relname, c.oid FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                               f"WHERE i.inhparent = '{CLEAN}'::regclass"))
+
+    def test_full_build_matches_single_pass(self):
+        stats = partitions.rebuild(self.engine, SRC, CLEAN, self.cols, workers=3)
+        with self.engine.begin() as conn:
+            conn.execute(text(cleaning.compile_clean_sql(SRC, f"{CLEAN}_ref", self.cols)))
+        self.assertTrue(stats["full"])
+        self.assertEqual(set(self.query(f"SELECT * FROM {CLEAN}")), set(self.query(f"SELECT * FROM {CLEAN}_ref")))
+        parts = self.partition_oids()
+        self.assertIn(f"{CLEAN}_pdefault", parts)
+        self.assertNotIn(f"{CLEAN}_p2999_01", parts)
+        self.assertEqual(len(parts), 37)  # 36 synthetic months + default
+        idx = self.query(f"SELECT indexname FROM pg_indexes WHERE tablename = '{CLEAN}_p2021_05'")
+        self.assertEqual(idx, [(f"{CLEAN}_p2021_05_res_state_idx",)])
+
+    def test_incremental_rebuilds_only_given_months(self):
+        partitions.rebuild(self.engine, SRC, CLEAN, self.cols)
+        before = self.partition_oids()
+        with self.engine.begin() as conn:
+            conn.execute(text(f"UPDATE {SRC} SET case_month = '2020-02' WHERE case_month = '2020-01'"))
+        stats = partitions.rebuild(self.engine, SRC, CLEAN, self.cols, keys=["2020-01", "2020-02"])
+        after = self.partition_oids()
+
+        self.assertFalse(stats["full"])
+        self.assertEqual(stats["partitions"], 2)
+        self.assertNotIn(f"{CLEAN}_p2020_01", after)  # emptied month is dropped
+        self.assertNotEqual(before[f"{CLEAN}_p2020_02"], after[f"{CLEAN}_p2020_02"])
+        untouched = {k: v for k, v in before.items() if not k.startswith(f"{CLEAN}_p2020_0")}
+        self.assertEqual(untouched, {k: after[k] for k in untouched})
+        self.assertEqual(self.query(f"SELECT COUNT(*) FROM {CLEAN} WHERE case_month = '2020-01'"), [(0,)])
+
+    def test_nothing_to_do(self):
+        partitions.rebuild(self.engine, SRC, CLEAN, self.cols)
+        self.assertEqual(partitions.rebuild(self.engine, SRC, CLEAN, self.cols, keys=[])["partitions"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
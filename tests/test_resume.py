@@ -0,0 +1,68 @@
+import os, unittest
+from unittest import mock
+from sqlalchemy import text
+
+os.environ.setdefault("DATASET_ID", "test-0001")
+os.environ.setdefault("GCP_PROJECT_ID", "test-project")
+import pipeline
+from tests.pg import delete_profiles, pg_engine
+from tests.socrata_stub import SocrataStub, make_rows
+
+
+def distinct_rows(n):
+    # staging rejects duplicate content, so give every row its own county
+    return [dict(r, res_county=f"COUNTY {i}") for i, r in enumerate(make_rows(n))]
+
+
+class TestCheckpointedIngest(unittest.TestCase):
+    def setUp(self):
+        self.engine = pg_engine()
+
+    def tearDown(self):
+        with self.engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS test_resume_raw, test_resume_raw_dups;"))
+            conn.execute(text("DELETE FROM ingest_checkpoints WHERE table_name = 'test_resume_raw';"))
+            delete_profiles(conn, "test_resume_raw")
+
+    def patched(self, stub, mode):
+        return mock.patch.object(pipeline, "SETTINGS", pipeline.SETTINGS.replace(
+            cdc_base_url=stub.base_url, dataset_id=stub.dataset_id, page_size=100, fetch_workers=2, rate_limit=0,
+            max_rows=0, ingest_mode=mode, staging_table="test_resume_raw", max_retries=2, backoff_base=0.01))
+
+    def staged(self):
+        with self.engine.begin() as conn:
+            return conn.execute(text("SELECT COUNT(*), COUNT(DISTINCT row_id) FROM test_resume_raw")).one()
+
+    def test_transient_faults_recover(self):
+        for mode in ("frame", "stream"):
+            with self.subTest(mode=mode), SocrataStub(distinct_rows(550)) as stub, self.patched(stub, mode):
+                stub.faults = {200: [503, 503], 400: [429]}
+                self.assertEqual(pipeline.stage_to_postgres(), 550)
+                self.assertEqual(tuple(self.staged()), (550, 550))
+
+    def test_resume_after_failure_stages_each_row_once(self):
+        for mode in ("frame", "stream"):
+            with self.subTest(mode=mode), SocrataStub(distinct_rows(550)) as stub, self.patched(stub, mode):
+                stub.fail_offsets.add(300)
+                with self.assertRaises(Exception):
+                    pipeline.stage_to_postgres()
+                self.assertEqual(tuple(self.staged()), (300, 300))  # committed pages survive
+
+                stub.fail_offsets.clear()
+                stub.requests.clear()
+                self.assertEqual(pipeline.stage_to_postgres(resume=True), 250)
+                self.assertEqual(tuple(self.staged()), (550, 550))
+                self.assertEqual(min(int(p["$offset"]) for _, p in stub.requests), 300)
+
+    def test_fresh_run_resets_checkpoints(self):
+        with SocrataStub(distinct_rows(250)) as stub, self.patched(stub, "frame"):
+            pipeline.stage_to_postgres()
+            self.assertEqual(pipeline.stage_to_postgres(), 250)
+            with self.engine.begin() as conn:
+                n = conn.execute(text("SELECT SUM(row_count) FROM ingest_checkpoints "
+                                      "WHERE table_name = 'test_resume_raw'")).scalar()
+            self.assertEqual(n, 250)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,70 @@
+import unittest
+import pandas as pd
+import socrata, staging
+from tests.socrata_stub import SocrataStub, make_rows
+
+
+class FakeWriter(staging.CopyWriter):
+    """CopyWriter that captures the COPY payload instead of talking to Postgres."""
+
+    def __init__(self, columns):
+        self.table, self.columns, self._warned, self.sent = "stg", columns, set(), []
+
+    def copy(self, data, commit=True):
+        self.sent.append(data)
+
+    def copy_stream(self, f, commit=True):
+        self.sent.append(f.read(7) + f.read())  # odd first read size exercises LineStream buffering
+
+
+class TestCopyFormat(unittest.TestCase):
+    def test_escapes_and_nulls(self):
+        line = staging.copy_text([("a\tb", None, "x\\y", "line\nbreak", float("nan"), 5)])
+        self.assertEqual(line, "a\\tb\t\\N\tx\\\\y\tline\\nbreak\t\\N\t5\n")
+
+    def test_records_projected_onto_schema(self):
+        w = FakeWriter(["case_month", "res_state", "sex"])
+        n = w.write_records([{"case_month": "2021-01", "Sex": "Male", "extra": "x"},
+                             {"res_state": "NY"}])
+        self.assertEqual(n, 2)
+        self.assertEqual(w.sent, ["2021-01\t\\N\tMale\n\\N\tNY\t\\N\n"])
+
+    def test_frame_matches_records(self):
+        rows = [{"case_month": "2021-01", "res_state": "NY"}, {"case_month": "2021-02", "sex": "Female"}]
+        a, b = FakeWriter(["case_month", "res_state", "sex"]), FakeWriter(["case_month", "res_state", "sex"])
+        a.write_records(rows)
+        b.write_frame(pd.DataFrame(rows))
+        self.assertEqual(a.sent, b.sent)
+
+    def test_csv_stream_matches_json_records(self):
+        columns = ["case_month", "res_state", "sex"]
+        streamed, paged = FakeWriter(columns), FakeWriter(columns)
+        with SocrataStub(make_rows(250)) as stub:
+            for _, header, rows in socrata.iter_csv_pages(stub.base_url, stub.dataset_id, 100):
+                streamed.write_rows(header, rows)
+            for _, records in socrata.iter_pages(stub.base_url, stub.dataset_id, 100):
+                paged.write_records(records)
+        self.assertEqual(len(streamed.sent), 3)
+        self.assertEqual(streamed.sent, paged.sent)
+
+    def test_csv_empty_field_is_empty_string(self):
+        rows, csv_rows = [{"case_month": "2021-01", "res_state": ""}], [["2021-01", ""]]
+        streamed, paged = FakeWriter(["case_month", "res_state", "sex"]), FakeWriter(["case_month", "res_state", "sex"])
+        streamed.write_rows(["case_month", "res_state"], csv_rows)
+        paged.write_records(rows)
+        self.assertEqual(streamed.sent, ["2021-01\t\t\\N\n"])  # only the missing column is NULL
+        self.assertEqual(streamed.sent, paged.sent)
+
+    def test_system_fields_map_to_staging_columns(self):
+        self.assertEqual(staging.normalize_column(":id"), "row_id")
+        self.assertEqual(staging.normalize_column(":updated_at"), "source_updated_at")
+        self.assertEqual(staging.normalize_column(" Case Month "), "case_month")
+
+    def test_ddl_is_explicit_text(self):
+        ddl = staging.staging_ddl("stg", ["case_month", "sex"])
+        self.assertIn("case_month TEXT", ddl)
+        self.assertIn("sex TEXT", ddl)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
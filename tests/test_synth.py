@@ -0,0 +1,32 @@
+import unittest
+import socrata
+from benchmarks.synth import SyntheticCases, DIRTY_SEXES, DIRTY_STATES, make_case_rows
+from tests.socrata_stub import SocrataStub
+
+
+class TestSyntheticCases(unittest.TestCase):
+    def test_rows_independent_of_page_size(self):
+        a, b = SyntheticCases(5000, seed=3), SyntheticCases(5000, seed=3)
+        self.assertEqual(a[100:3000], [b[i] for i in range(100, 3000)])
+        self.assertEqual(len(a[4990:9000]), 10)
+        self.assertEqual(a[-1][":id"], "row-000004999")
+        self.assertNotEqual(a[0], SyntheticCases(5000, seed=4)[0])
+
+    def test_dirty_values(self):
+        rows = SyntheticCases(2000, dirty=0.2)[:]
+        self.assertTrue({r["sex"] for r in rows} & set(DIRTY_SEXES))
+        self.assertTrue({r["res_state"] for r in rows} & set(DIRTY_STATES))
+        self.assertTrue(any("hosp_yn" not in r for r in rows))  # nulls are left out, as in Socrata JSON
+        self.assertEqual(list(make_case_rows(50, seed=1)), list(make_case_rows(50, seed=1, dirty=0.0)))
+
+    def test_stub_pages_lazy_rows(self):
+        data = SyntheticCases(2500, dirty=0.1)
+        with SocrataStub(data, "synth-0001") as stub:
+            pages = list(socrata.iter_pages(stub.base_url, stub.dataset_id, 1000, params={"$select": ":id,*"}))
+        self.assertEqual([(o, len(r)) for o, r in pages], [(0, 1000), (1000, 1000), (2000, 500)])
+        self.assertEqual(pages[1][1][0][":id"], "row-000001000")
+        self.assertNotIn(":updated_at", pages[0][1][0])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -29,5 +29,30 @@ class TestValidationAPI(unittest.TestCase):
         have = {c["name"] for c in r["checks"]}
         self.assertTrue(need.issubset(have))
 
+    def test_cache_and_refresh(self):
+        requests.get(f"{API}/validate", timeout=60).raise_for_status()
+        before = self.metric("validation_cache_hits_total")
+        cached = requests.get(f"{API}/validate", timeout=60).json()
+        self.assertEqual(self.metric("validation_cache_hits_total"), before + 1)
+        fresh = requests.get(f"{API}/validate", params={"refresh": "true"}, timeout=60).json()
+        self.assertEqual(cached, fresh)
+        self.assertEqual(self.metric("validation_cache_hits_total"), before + 1)
+
+    def test_validation_job(self):
+        job = requests.post(f"{API}/validate/jobs", params={"refresh": "true"}, timeout=10).json()
+        self.assertIn(job["status"], ("queued", "running", "done"))
+        for _ in range(120):
+            job = requests.get(f"{API}/validate/jobs/{job['job_id']}", timeout=10).json()
+            if job["status"] in ("done", "failed"):
+                break
+            time.sleep(0.5)
+        self.assertEqual(job["status"], "done")
+        self.assertIn("overall_passed", job["result"])
+        self.assertEqual(requests.get(f"{API}/validate/jobs/nope", timeout=10).status_code, 404)
+
+    def metric(self, name):
+        text = requests.get(f"{API}/metrics", timeout=5).text
+        return float(next(l.split()[1] for l in text.splitlines() if l.startswith(name + " ")))
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -0,0 +1,70 @@
+import threading, unittest, time
+from unittest import mock
+import validation_api
+from validation_api import JobRegistry, ValidationCache, ValidationResponse
+
+
+class TestValidationCache(unittest.TestCase):
+    def test_hit_miss_counters(self):
+        c = ValidationCache(size=4, ttl=60)
+        self.assertIsNone(c.get(("t", "v1")))
+        c.put(("t", "v1"), "resp")
+        self.assertEqual(c.get(("t", "v1")), "resp")
+        self.assertIsNone(c.get(("t", "v2")))  # new version token -> miss
+        self.assertEqual((c.hits, c.misses), (1, 2))
+
+    def test_lru_eviction(self):
+        c = ValidationCache(size=2, ttl=60)
+        c.put("a", 1)
+        c.put("b", 2)
+        c.get("a")          # a is now most recently used
+        c.put("c", 3)       # evicts b
+        self.assertIsNone(c.get("b"))
+        self.assertEqual(c.get("a"), 1)
+        self.assertEqual((len(c), c.evictions), (2, 1))
+
+    def test_ttl_expiry(self):
+        c = ValidationCache(size=2, ttl=0.05)
+        c.put("a", 1)
+        time.sleep(0.06)
+        self.assertIsNone(c.get("a"))
+        self.assertEqual(len(c), 0)
+
+
+class TestJobRegistry(unittest.TestCase):
+    def test_concurrent_requests_share_one_job(self):
+        release, calls = threading.Event(), []
+
+        def slow_checks(table, refresh=False):
+            calls.append(table)
+            release.wait(5)
+            return ValidationResponse(overall_passed=True, checks=[])
+
+        with mock.patch.object(validation_api, "table_version", return_value="v7"), \
+             mock.patch.object(validation_api, "run_checks", slow_checks), \
+             mock.patch.object(validation_api, "cache", ValidationCache(4, 60)):
+            reg = JobRegistry(workers=2, history=10)
+            a = reg.submit("stg")
+            b = reg.submit("stg")
+            self.assertEqual(a.job_id, b.job_id)
+            release.set()
+            self.assertTrue(reg.wait(a).overall_passed)
+            # finished: the next request is served from the cache without a scan
+            c = reg.submit("stg")
+            self.assertEqual((c.status, c.table_version), ("done", "v7"))
+        self.assertEqual(calls, ["stg"])
+
+    def test_failed_job_reports_error(self):
+        with mock.patch.object(validation_api, "table_version", return_value="v1"), \
+             mock.patch.object(validation_api, "run_checks", side_effect=RuntimeError("boom")), \
+             mock.patch.object(validation_api, "cache", ValidationCache(4, 60)):
+            reg = JobRegistry(workers=1, history=10)
+            job = reg.submit("stg")
+            with self.assertRaises(RuntimeError):
+                reg.wait(job)
+            self.assertEqual(reg.get(job.job_id).status, "failed")
+            self.assertIn("boom", reg.get(job.job_id).error)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
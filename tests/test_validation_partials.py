@@ -0,0 +1,73 @@
+import unittest
+from sqlalchemy import text
+
+import partitions, staging, validation_partials
+from benchmarks.synth import make_case_rows
+from tests.pg import pg_engine
+from validation_rules import TOTAL, compile_validation_sql
+
+SRC, CLEAN = "test_vp_raw", "test_vp_clean"
+
+
+class TestValidationPartials(unittest.TestCase):
+    def setUp(self):
+        self.engine = pg_engine()
+        self.cols = staging.CDC_CASE_COLUMNS
+        writer = staging.CopyWriter(self.engine, SRC, self.cols)
+        try:
+            writer.create_table(drop=True)
+            writer.write_records(list(make_case_rows(3000, seed=9, dirty=0.3)))
+        finally:
+            writer.close()
+        partitions.rebuild(self.engine, SRC, CLEAN, self.cols)
+
+    def tearDown(self):
+        with self.engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {SRC}, {CLEAN}, {CLEAN}_flat;"))
+            conn.execute(text(f"DELETE FROM {validation_partials.PARTIALS_TABLE} WHERE table_name LIKE 'test_vp_%'"))
+
+    def collect(self, table=CLEAN, **kw):
+        with self.engine.begin() as conn:
+            return validation_partials.collect(conn.connection.cursor(), table, **kw)
+
+    def full_scan(self, table=CLEAN):
+        with self.engine.begin() as conn:
+            return dict(conn.execute(text(compile_validation_sql(table))).mappings().one())
+
+    def test_incremental_matches_full_scan(self):
+        first, stats = self.collect()
+        n = stats["scanned"]
+        self.assertEqual((n, stats["reused"]), (36, 0))  # one per synthetic month
+        self.assertEqual(first, self.full_scan())
+
+        values, stats = self.collect()  # nothing changed: no partition scanned
+        self.assertEqual((stats["scanned"], stats["reused"], stats["scanned_rows"]), (0, n, 0))
+        self.assertEqual(values, self.full_scan())
+
+        with self.engine.begin() as conn:
+            conn.execute(text(f"UPDATE {SRC} SET sex = 'F' WHERE case_month = '2021-05'"))
+            conn.execute(text(f"UPDATE {SRC} SET case_month = '2021-07' WHERE case_month = '2021-06'"))
+        partitions.rebuild(self.engine, SRC, CLEAN, self.cols, keys=["2021-05", "2021-06", "2021-07"])
+        values, stats = self.collect()
+        self.assertEqual((stats["scanned"], stats["reused"]), (2, n - 3))  # 2021-06 is gone
+        self.assertEqual(values, self.full_scan())
+        self.assertEqual(values["min_distinct_months"], first["min_distinct_months"] - 1)
+
+        _, stats = self.collect(refresh=True)
+        self.assertEqual(stats["scanned"], n - 1)
+        with self.engine.begin() as conn:
+            stored = conn.execute(text(f"SELECT COUNT(*) FROM {validation_partials.PARTIALS_TABLE} "
+                                       f"WHERE table_name = '{CLEAN}'")).scalar()
+        self.assertEqual(stored, n - 1)
+
+    def test_plain_table_scanned_in_full(self):
+        with self.engine.begin() as conn:
+            conn.execute(text(f"CREATE TABLE {CLEAN}_flat AS SELECT * FROM {CLEAN}"))
+        values, stats = self.collect(f"{CLEAN}_flat")
+        self.assertFalse(stats["partitioned"])
+        self.assertEqual(values, self.full_scan(f"{CLEAN}_flat"))
+        self.assertGreater(values[TOTAL], 1000)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,33 @@
+import unittest
+from validation_rules import RULES, TOTAL, compile_partial_sql, compile_validation_sql, evaluate, merge_partials
+
+
+class TestValidationRules(unittest.TestCase):
+    def test_single_scan(self):
+        sql = compile_validation_sql("stg_cdc_clean")
+        self.assertEqual(sql.count("FROM stg_cdc_clean"), 1)
+        self.assertEqual(sql.count(" AS "), len(RULES) + 1)
+
+    def test_evaluate(self):
+        values = {r.name: 0 for r in RULES}
+        values.update({TOTAL: 10, "non_empty": 10, "case_month_format": 10,
+                       "res_state_null_rate": 3, "min_distinct_months": 2, "sex_domain": 1})
+        res = {name: (passed, details) for name, passed, details in evaluate(values)}
+        self.assertEqual(res["sex_domain"], (False, "bad_rows=1"))
+        self.assertEqual(res["res_state_null_rate"], (False, "null_pct=30.00%"))
+        self.assertTrue(res["min_distinct_months"][0])
+        self.assertTrue(res["no_future_months"][0])
+
+    def test_merge_partials(self):
+        sql = compile_partial_sql("t_p2021_03")
+        self.assertIn("array_agg(DISTINCT case_month::text)", sql)
+        a = {r.name: 0 for r in RULES}
+        a.update({TOTAL: 4, "sex_domain": 1, "min_distinct_months": ["2021-01", "2021-02"]})
+        b = dict(a, **{TOTAL: 6, "sex_domain": 2, "min_distinct_months": ["2021-02"]})
+        c = dict(a, **{TOTAL: 0, "sex_domain": 0, "min_distinct_months": None})  # empty partition
+        values = merge_partials([a, b, c])
+        self.assertEqual((values[TOTAL], values["sex_domain"], values["min_distinct_months"]), (10, 3, 2))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
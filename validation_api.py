@@ -1,24 +1,26 @@
-import os
-import datetime as dt
-from typing import List, Any
-from fastapi import FastAPI
+import os, threading, time, uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Any, Optional
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from sqlalchemy import create_engine, text
-from dotenv import load_dotenv
+from validation_rules import RULES, evaluate
+import metrics as run_metrics, settings, state, validation_partials
 
-load_dotenv()
+SETTINGS = settings.Settings.from_env()
+CLEAN_TABLE = SETTINGS.clean_table
 
-PG_HOST = os.getenv("PG_HOST", "localhost")
-PG_PORT = int(os.getenv("PG_PORT", "5433"))
-PG_USER = os.getenv("PG_USER", "ph")
-PG_PASSWORD = os.getenv("PG_PASSWORD", "ph")
-PG_DB = os.getenv("PG_DB", "public_health")
-CLEAN_TABLE = "stg_cdc_clean"
+# /validate results are cached per (table, version token); see table_version()
+CACHE_TTL = float(os.getenv("VALIDATION_CACHE_TTL", "3600"))   # seconds
+CACHE_SIZE = int(os.getenv("VALIDATION_CACHE_SIZE", "32"))     # entries (LRU)
 
-engine = create_engine(
-    f"postgresql+psycopg2://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}",
-    pool_pre_ping=True,
-)
+# background validation jobs (POST /validate/jobs)
+JOB_WORKERS = int(os.getenv("VALIDATION_WORKERS", "2"))        # concurrent scans
+JOB_HISTORY = int(os.getenv("VALIDATION_JOB_HISTORY", "100"))  # finished jobs kept for polling
+
+engine = create_engine(SETTINGS.pg_url, pool_pre_ping=True)
 
 app = FastAPI(title="Validation API", version="1.0")
 
@@ -39,77 +41,247 @@ def fetch_val(query: str) -> Any:
 def health():
     return {"status": "ok"}
 
-@app.get("/validate", response_model=ValidationResponse)
-def validate():
+class ValidationCache:
+    """Thread-safe LRU of ValidationResponse with a per-entry TTL, plus hit/miss counters."""
+
+    def __init__(self, size: int, ttl: float):
+        self.size, self.ttl = size, ttl
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key) -> Optional["ValidationResponse"]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:  # expired
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value: "ValidationResponse"):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+cache = ValidationCache(CACHE_SIZE, CACHE_TTL)
+
+
+def table_version(table: str) -> Optional[str]:
+    """
+    Cheap change token for `table`: the version simple_clean_transform bumps when
+    it rebuilds the table, else a fingerprint of the table's oid and pg_stat
+    write counters (covers tables modified outside the pipeline). None if absent.
+    """
+    with engine.begin() as conn:
+        version = state.get_table_version(conn.connection.cursor(), table)
+        if version is not None:
+            return f"v{version}"
+        row = conn.execute(text(
+            "SELECT relid, n_tup_ins, n_tup_upd, n_tup_del FROM pg_stat_user_tables WHERE relname = :t"
+        ), {"t": table}).first()
+    return "stat:" + ":".join(map(str, row)) if row else None
+
+
+def run_checks(table: str = CLEAN_TABLE, refresh: bool = False) -> ValidationResponse:
     checks: List[CheckResult] = []
 
     # 1) table exists
     exists = fetch_val(f"""
       SELECT COUNT(*)>0 FROM information_schema.tables
-      WHERE table_name='{CLEAN_TABLE}';
+      WHERE table_name='{table}';
     """)
-    checks.append(CheckResult(name="table_exists", passed=bool(exists), details=CLEAN_TABLE))
-
-    # 2) row count > 0
-    cnt = fetch_val(f"SELECT COUNT(*) FROM {CLEAN_TABLE};") if exists else 0
-    checks.append(CheckResult(name="non_empty", passed=(cnt and cnt > 0), details=f"rows={cnt}"))
-
-    # 3) case_month format YYYY-MM (dataset n8mc-b4w4)
-    fmt_ok = fetch_val(f"""
-      SELECT COUNT(*) FROM {CLEAN_TABLE}
-      WHERE case_month IS NOT NULL AND case_month ~ '^[0-9]{{4}}-[0-1][0-9]$';
-    """) or 0
-    checks.append(CheckResult(name="case_month_format", passed=fmt_ok > 0, details=f"matching_rows={fmt_ok}"))
-
-    # 4) no future months
-    yyyy_mm_today = dt.date.today().strftime("%Y-%m")
-    future = fetch_val(f"""
-      SELECT COUNT(*) FROM {CLEAN_TABLE}
-      WHERE case_month > '{yyyy_mm_today}';
-    """) or 0
-    checks.append(CheckResult(name="no_future_months", passed=future == 0, details=f"future_rows={future}"))
-
-    # 5) res_state looks like 2-letter A–Z
-    state_bad = fetch_val(f"""
-      SELECT COUNT(*) FROM {CLEAN_TABLE}
-      WHERE res_state IS NOT NULL AND res_state !~ '^[A-Z]{{2}}$';
-    """) or 0
-    checks.append(CheckResult(name="res_state_format", passed=state_bad == 0, details=f"bad_rows={state_bad}"))
-
-    # 6) allowed sex values
-    sex_bad = fetch_val(f"""
-      SELECT COUNT(*) FROM {CLEAN_TABLE}
-      WHERE sex IS NOT NULL AND sex NOT IN ('Male','Female','Unknown','Missing');
-    """) or 0
-    checks.append(CheckResult(name="sex_domain", passed=sex_bad == 0, details=f"bad_rows={sex_bad}"))
-
-    # 7) allowed current_status values
-    status_bad = fetch_val(f"""
-      SELECT COUNT(*) FROM {CLEAN_TABLE}
-      WHERE current_status IS NOT NULL AND current_status NOT IN ('Confirmed Case','Probable Case');
-    """) or 0
-    checks.append(CheckResult(name="current_status_domain", passed=status_bad == 0, details=f"bad_rows={status_bad}"))
-
-    # 8–10) Y/N flags & null/state coverage
-    def yn_bad(col: str) -> int:
-        return fetch_val(f"""
-          SELECT COUNT(*) FROM {CLEAN_TABLE}
-          WHERE {col} IS NOT NULL AND {col} NOT IN ('Yes','No','Unknown','Missing');
-        """) or 0
-
-    hosp_bad = yn_bad("hosp_yn")
-    icu_bad  = yn_bad("icu_yn")
-    death_bad= yn_bad("death_yn")
-    checks.append(CheckResult(name="hosp_yn_domain",  passed=hosp_bad  == 0, details=f"bad_rows={hosp_bad}"))
-    checks.append(CheckResult(name="icu_yn_domain",   passed=icu_bad   == 0, details=f"bad_rows={icu_bad}"))
-    checks.append(CheckResult(name="death_yn_domain", passed=death_bad == 0, details=f"bad_rows={death_bad}"))
-
-    null_states = fetch_val(f"SELECT COUNT(*) FROM {CLEAN_TABLE} WHERE res_state IS NULL;") or 0
-    pct_null = (null_states / cnt * 100.0) if cnt else 100.0
-    checks.append(CheckResult(name="res_state_null_rate", passed=(pct_null <= 20.0), details=f"null_pct={pct_null:.2f}%"))
-
-    months = fetch_val(f"SELECT COUNT(DISTINCT case_month) FROM {CLEAN_TABLE};") or 0
-    checks.append(CheckResult(name="min_distinct_months", passed=(months >= 2), details=f"months={months}"))
+    checks.append(CheckResult(name="table_exists", passed=bool(exists), details=table))
+
+    # 2..n) every rule in validation_rules.RULES, from per-partition partials
+    # (only partitions changed since the last run are scanned; refresh rescans all)
+    if exists:
+        with engine.begin() as conn:
+            values, _ = validation_partials.collect(conn.connection.cursor(), table, refresh=refresh)
+        for name, passed, details in evaluate(values):
+            checks.append(CheckResult(name=name, passed=passed, details=details))
+    else:
+        checks += [CheckResult(name=r.name, passed=False, details="table missing") for r in RULES]
 
     overall = all(c.passed for c in checks)
     return ValidationResponse(overall_passed=overall, checks=checks)
+
+
+class ValidationJob(BaseModel):
+    job_id: str
+    status: str                      # queued | running | done | failed
+    table: str
+    table_version: Optional[str] = None
+    submitted_at: float
+    finished_at: Optional[float] = None
+    result: Optional[ValidationResponse] = None
+    error: Optional[str] = None
+
+
+class JobRegistry:
+    """
+    Runs validations on a bounded worker pool. Requests for a (table, version)
+    that already has a job in flight join that job instead of starting a scan.
+    """
+
+    def __init__(self, workers: int, history: int):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="validate")
+        self._jobs: "OrderedDict[str, ValidationJob]" = OrderedDict()
+        self._futures: Dict[str, Future] = {}
+        self._inflight: Dict[tuple, str] = {}
+        self._history = history
+        self._lock = threading.Lock()
+
+    def submit(self, table: str, refresh: bool = False) -> ValidationJob:
+        version = table_version(table)
+        key = (table, version)
+        with self._lock:
+            if version is not None and key in self._inflight:
+                return self._jobs[self._inflight[key]]
+            job = ValidationJob(job_id=uuid.uuid4().hex, status="queued", table=table,
+                                table_version=version, submitted_at=time.time())
+            cached = cache.get(key) if version is not None and not refresh else None
+            if cached is not None:
+                job.status, job.result, job.finished_at = "done", cached, time.time()
+                self._remember(job)
+                return job
+            self._remember(job)
+            if version is not None:
+                self._inflight[key] = job.job_id
+            self._futures[job.job_id] = self._pool.submit(self._run, job, key, refresh)
+            return job
+
+    def _run(self, job: ValidationJob, key: tuple, refresh: bool = False) -> ValidationResponse:
+        job.status = "running"
+        try:
+            job.result = run_checks(job.table, refresh=refresh)
+            if job.table_version is not None:
+                cache.put(key, job.result)
+            job.status = "done"
+            return job.result
+        except Exception as e:
+            job.status, job.error = "failed", f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                if self._inflight.get(key) == job.job_id:
+                    del self._inflight[key]
+                self._futures.pop(job.job_id, None)
+
+    def _remember(self, job: ValidationJob):
+        self._jobs[job.job_id] = job
+        # forget the oldest finished jobs beyond the history limit
+        finished = [j for j in self._jobs.values() if j.finished_at is not None]
+        for j in finished[:max(0, len(finished) - self._history)]:
+            del self._jobs[j.job_id]
+
+    def get(self, job_id: str) -> Optional[ValidationJob]:
+        return self._jobs.get(job_id)
+
+    def wait(self, job: ValidationJob) -> ValidationResponse:
+        fut = self._futures.get(job.job_id)
+        if fut is not None:
+            return fut.result()
+        if job.result is None:  # finished between submit() and here
+            raise RuntimeError(job.error or "validation job failed")
+        return job.result
+
+
+jobs = JobRegistry(JOB_WORKERS, JOB_HISTORY)
+
+
+@app.get("/validate", response_model=ValidationResponse)
+def validate(refresh: bool = False):
+    # synchronous form: joins (or starts) the shared job for the current table version
+    job = jobs.submit(CLEAN_TABLE, refresh=refresh)
+    return job.result if job.status == "done" else jobs.wait(job)
+
+
+@app.post("/validate/jobs", response_model=ValidationJob, status_code=202)
+def submit_validation(refresh: bool = False):
+    """Start (or join) a validation of the clean table and return its job id immediately."""
+    return jobs.submit(CLEAN_TABLE, refresh=refresh)
+
+
+@app.get("/validate/jobs/{job_id}", response_model=ValidationJob)
+def validation_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"unknown job {job_id}")
+    return job
+
+
+def _profile(cur, dataset_id: str, table: Optional[str], run_id: Optional[str]):
+    import data_profile  # heavy import (pandas), only needed for /profiles
+    found = data_profile.load(cur, dataset_id, table, run_id)
+    if found is None:
+        where = f" ({table})" if table else ""
+        raise HTTPException(status_code=404, detail=f"no profile for {dataset_id}{where} run {run_id or '(latest)'}")
+    return found
+
+
+@app.get("/profiles")
+def profiles(dataset_id: Optional[str] = None, table: Optional[str] = None, limit: int = 20):
+    """Stored column profiles (one per dataset, staging table and ingest run), newest first."""
+    import data_profile  # heavy import (pandas), only needed for /profiles
+    with engine.begin() as conn:
+        return data_profile.runs(conn.connection.cursor(), dataset_id, table, limit)
+
+
+@app.get("/profiles/{dataset_id}")
+def profile(dataset_id: str, table: Optional[str] = None, run_id: Optional[str] = None, top: int = 10,
+            months: bool = False):
+    """
+    Null rate, distinct count and top values per column for one run (default: the
+    latest). `table` picks a staging table when several configs load the dataset.
+    """
+    import data_profile  # heavy import (pandas), only needed for /profiles
+    with engine.begin() as conn:
+        run, prof = _profile(conn.connection.cursor(), dataset_id, table, run_id)
+    return {"run": run, **data_profile.summary(prof, top, months)}
+
+
+@app.get("/profiles/{dataset_id}/drift")
+def profile_drift(dataset_id: str, table: Optional[str] = None, run_id: Optional[str] = None,
+                  baseline_run_id: Optional[str] = None):
+    """A run (default: the latest) against another of its table (default: the previous run of the same mode)."""
+    import data_profile  # heavy import (pandas), only needed for /profiles
+    with engine.begin() as conn:
+        cur = conn.connection.cursor()
+        run, prof = _profile(cur, dataset_id, table, run_id)
+        baseline = _profile(cur, dataset_id, run["table"], baseline_run_id) if baseline_run_id else \
+            data_profile.previous(cur, run)
+    if baseline is None:
+        raise HTTPException(status_code=404, detail=f"no earlier {run['mode']} run of {dataset_id} "
+                                                    f"({run['table']}) to compare with")
+    return {"run": run, "baseline": baseline[0], **data_profile.drift(prof, baseline[1])}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text exposition of the validation cache counters and the latest pipeline run."""
+    lines = [
+        "# TYPE validation_cache_hits_total counter",
+        f"validation_cache_hits_total {cache.hits}",
+        "# TYPE validation_cache_misses_total counter",
+        f"validation_cache_misses_total {cache.misses}",
+        "# TYPE validation_cache_evictions_total counter",
+        f"validation_cache_evictions_total {cache.evictions}",
+        "# TYPE validation_cache_entries gauge",
+        f"validation_cache_entries {len(cache)}",
+    ]
+    latest = run_metrics.latest_run_file()
+    if latest:
+        lines += run_metrics.prometheus_lines(run_metrics.summarize(run_metrics.read_run(latest)))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,114 @@
+"""
+Declarative data-quality rules for the clean table.
+
+Each rule is one aggregate expression; `compile_validation_sql` folds all of
+them into a single SELECT (mostly `COUNT(*) FILTER (WHERE ...)`), so every
+check is answered by one scan of the table. The same rules also compile to
+per-partition partial aggregates (`compile_partial_sql`), which
+`merge_partials` combines into the values of a whole-table scan; see
+validation_partials.py.
+"""
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class Rule:
+    """
+    name:    check name reported by /validate
+    agg:     aggregate SQL over the table, aliased to `name` in the compiled query
+    passes:  (value, total_rows) -> bool
+    details: (value, total_rows) -> str
+    merge:   how values of `partial` from disjoint parts of the table combine:
+             "sum" (counts) | "max" | "min" | "union" (of arrays; the value is the union's size)
+    partial: aggregate SQL computed per part; defaults to `agg`
+    """
+    name: str
+    agg: str
+    passes: Callable[[Any, int], bool]
+    details: Callable[[Any, int], str]
+    merge: str = "sum"
+    partial: Optional[str] = None
+
+
+def bad_rows(name: str, where: str) -> Rule:
+    """Passes when no row matches `where`."""
+    return Rule(name, f"COUNT(*) FILTER (WHERE {where})",
+                lambda v, n: v == 0, lambda v, n: f"bad_rows={v}")
+
+
+def domain(name: str, column: str, allowed) -> Rule:
+    values = ", ".join(f"'{v}'" for v in allowed)
+    return bad_rows(name, f"{column} IS NOT NULL AND {column} NOT IN ({values})")
+
+
+def distinct_count(name: str, column: str, passes, details) -> Rule:
+    """COUNT(DISTINCT column); partials keep the distinct values themselves so they can be unioned."""
+    return Rule(name, f"COUNT(DISTINCT {column})", passes, details, merge="union",
+                partial=f"array_agg(DISTINCT {column}::text) FILTER (WHERE {column} IS NOT NULL)")
+
+
+def _pct(v, n):
+    return (v / n * 100.0) if n else 100.0
+
+
+YN_VALUES = ("Yes", "No", "Unknown", "Missing")
+
+RULES: List[Rule] = [
+    Rule("non_empty", "COUNT(*)", lambda v, n: v > 0, lambda v, n: f"rows={v}"),
+    Rule("case_month_format",
+         "COUNT(*) FILTER (WHERE case_month IS NOT NULL AND case_month ~ '^[0-9]{4}-[0-1][0-9]$')",
+         lambda v, n: v > 0, lambda v, n: f"matching_rows={v}"),
+    Rule("no_future_months", "COUNT(*) FILTER (WHERE case_month > to_char(CURRENT_DATE, 'YYYY-MM'))",
+         lambda v, n: v == 0, lambda v, n: f"future_rows={v}"),
+    bad_rows("res_state_format", "res_state IS NOT NULL AND res_state !~ '^[A-Z]{2}$'"),
+    domain("sex_domain", "sex", ("Male", "Female", "Unknown", "Missing")),
+    domain("current_status_domain", "current_status", ("Confirmed Case", "Probable Case")),
+    domain("hosp_yn_domain", "hosp_yn", YN_VALUES),
+    domain("icu_yn_domain", "icu_yn", YN_VALUES),
+    domain("death_yn_domain", "death_yn", YN_VALUES),
+    Rule("res_state_null_rate", "COUNT(*) FILTER (WHERE res_state IS NULL)",
+         lambda v, n: _pct(v, n) <= 20.0, lambda v, n: f"null_pct={_pct(v, n):.2f}%"),
+    distinct_count("min_distinct_months", "case_month", lambda v, n: v >= 2, lambda v, n: f"months={v}"),
+]
+
+TOTAL = "_total_rows"
+
+
+def compile_validation_sql(table: str, rules: List[Rule] = RULES) -> str:
+    aggs = ",\n    ".join(f"{r.agg} AS {r.name}" for r in rules)
+    return f"SELECT\n    COUNT(*) AS {TOTAL},\n    {aggs}\nFROM {table};"
+
+
+def compile_partial_sql(table: str, rules: List[Rule] = RULES) -> str:
+    """Like compile_validation_sql, but each rule's mergeable `partial` aggregate."""
+    aggs = ",\n    ".join(f"{r.partial or r.agg} AS {r.name}" for r in rules)
+    return f"SELECT\n    COUNT(*) AS {TOTAL},\n    {aggs}\nFROM {table};"
+
+
+def merge_partials(partials: List[Dict[str, Any]], rules: List[Rule] = RULES) -> Dict[str, Any]:
+    """Combine compile_partial_sql rows of disjoint parts into a compile_validation_sql row."""
+    values = {TOTAL: sum(p[TOTAL] or 0 for p in partials)}
+    for r in rules:
+        parts = [p[r.name] for p in partials if p[r.name] is not None]
+        if r.merge == "sum":
+            values[r.name] = sum(parts)
+        elif r.merge == "max":
+            values[r.name] = max(parts, default=None)
+        elif r.merge == "min":
+            values[r.name] = min(parts, default=None)
+        elif r.merge == "union":
+            values[r.name] = len(set().union(*parts))
+        else:
+            raise ValueError(f"unknown merge {r.merge!r} for rule {r.name}")
+    return values
+
+
+def evaluate(values: Dict[str, Any], rules: List[Rule] = RULES) -> List[Tuple[str, bool, str]]:
+    """Turn one row of the compiled query into (name, passed, details) per rule."""
+    n = values[TOTAL] or 0
+    out = []
+    for r in rules:
+        v = values[r.name] or 0
+        out.append((r.name, bool(r.passes(v, n)), r.details(v, n)))
+    return out